@@ -0,0 +1,57 @@
+# pyright: strict
+
+"""Times fastfilters against the FFT implementation of the same filters over a range of kernel widths.
+
+The first kernel width at which FFT wins is a good value for WEBILASTIK_FFT_MIN_KERNEL_WIDTH.
+"""
+
+from typing import Callable, List, Optional
+import argparse
+import time
+
+import numpy as np
+
+from webilastik.features.channelwise_fastfilters import (
+    ChannelwiseFastFilter, GaussianGradientMagnitude, GaussianSmoothing, LaplacianOfGaussian
+)
+
+filter_classes = {
+    "GaussianSmoothing": lambda sigma: GaussianSmoothing(sigma=sigma, axis_2d="z"),
+    "GaussianGradientMagnitude": lambda sigma: GaussianGradientMagnitude(sigma=sigma, axis_2d="z"),
+    "LaplacianOfGaussian": lambda sigma: LaplacianOfGaussian(scale=sigma, axis_2d="z"),
+}
+
+def best_time(fn: Callable[[], object], repetitions: int) -> float:
+    times: List[float] = []
+    for _ in range(repetitions):
+        t = time.perf_counter()
+        _ = fn()
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    _ = argparser.add_argument("--filter", choices=list(filter_classes.keys()), default="GaussianSmoothing")
+    _ = argparser.add_argument("--tile-side", type=int, default=256, help="side of the (square) tile to filter, without halo")
+    _ = argparser.add_argument("--sigmas", nargs="+", type=float, default=[0.7, 1.0, 1.6, 3.5, 5.0, 10.0, 20.0])
+    _ = argparser.add_argument("--repetitions", type=int, default=5)
+    args = argparser.parse_args()
+
+    crossover_width: Optional[int] = None
+    print(f"{'sigma':>8} {'kernel width':>13} {'fastfilters (s)':>16} {'fft (s)':>10}")
+    for sigma in sorted(args.sigmas):
+        fx: ChannelwiseFastFilter = filter_classes[args.filter](sigma)
+        side = args.tile_side + 2 * fx.halo_radius
+        data = (np.random.rand(side, side) * 255).astype(np.float32)
+        direct_time = best_time(lambda: fx.filter_fn(data), repetitions=args.repetitions)
+        fft_filter_fn = fx.get_fft_filter_fn()
+        assert fft_filter_fn is not None
+        fft_time = best_time(lambda: fft_filter_fn(data), repetitions=args.repetitions)
+        print(f"{sigma:>8} {fx.kernel_width:>13} {direct_time:>16.5f} {fft_time:>10.5f}")
+        if crossover_width is None and fft_time < direct_time:
+            crossover_width = fx.kernel_width
+
+    if crossover_width is None:
+        print("FFT was never faster. Leave WEBILASTIK_FFT_MIN_KERNEL_WIDTH unset")
+    else:
+        print(f"FFT is faster starting at a kernel width of about {crossover_width}: WEBILASTIK_FFT_MIN_KERNEL_WIDTH={crossover_width}")
@@ -4,11 +4,12 @@ from abc import ABC, abstractmethod
 import atexit
 import threading
 from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
-from typing import Optional
+from typing import Optional, Set
 import multiprocessing as mp
 import sys
 
 from webilastik.scheduling import ExecutorGetter, ExecutorHint, SerialExecutor
+from webilastik.scheduling.affinity_executor import AffinityExecutor
 # from webilastik.scheduling.hashing_mpi_executor import HashingMpiExecutor
 # from webilastik.scheduling.mpi_comm_executor_wrapper import MPICommExecutorWrapper
 
@@ -48,6 +49,20 @@ class ProcessPoolExecutorManager(ExecutorManager):
     def _create_executor(self, max_workers: Optional[int]) -> Executor:
         return ProcessPoolExecutor(max_workers=8, mp_context=mp.get_context("spawn"))
 
+_inside_server_worker = False
+
+def _mark_as_server_worker() -> None:
+    global _inside_server_worker
+    _inside_server_worker = True
+
+class AffinityProcessPoolExecutorManager(ExecutorManager):
+    def _create_executor(self, max_workers: Optional[int]) -> Executor:
+        # one process per worker, so that tasks can be routed to a specific one (see AffinityExecutor)
+        return AffinityExecutor([
+            ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn"), initializer=_mark_as_server_worker)
+            for _ in range(8)
+        ])
+
 class ThreadPoolExecutorManager(ExecutorManager):
     WORKER_THERAD_PREFIX = "worker_pool_thread_"
 
@@ -57,21 +72,32 @@ class ThreadPoolExecutorManager(ExecutorManager):
 
 # _server_executor_manager = MPICommExecutorManager()
 # _server_executor_manager = HashingMpiExecutorManager()
-_server_executor_manager = ProcessPoolExecutorManager()
+_server_executor_manager = AffinityProcessPoolExecutorManager()
+_training_executor_manager = ProcessPoolExecutorManager()
 _worker_thread_pool_manager = ThreadPoolExecutorManager()
 
+_EXPECTED_NESTED_HINTS: Set[ExecutorHint] = {"sampling", "feature_extraction"}
+
 
 def _get_executor(*, hint: ExecutorHint, max_workers: Optional[int] = None) -> Executor:
     if threading.current_thread().name.startswith(ThreadPoolExecutorManager.WORKER_THERAD_PREFIX):
-        print(f"[WARNING]{hint} needs an executor but already inside one", file=sys.stderr)
+        # sampling the tiles of an annotation that is itself being sampled in the pool is expected, so don't warn about it
+        if hint not in _EXPECTED_NESTED_HINTS:
+            print(f"[WARNING]{hint} needs an executor but already inside one", file=sys.stderr)
         return SerialExecutor()
     if hint == "server_tile_handler":
         return _server_executor_manager.get_executor(max_workers=max_workers)
     if hint == "training":
-        return SerialExecutor()
-        # return _worker_thread_pool_manager.get_executor(max_workers=max_workers)
+        if _inside_server_worker:
+            # server workers are already one process per core; a training pool in each of them would spawn up
+            # to 8 more interpreters per worker, so they train their forests serially instead
+            return SerialExecutor()
+        # forests are trained in parallel worker processes, which get the training data through shared memory
+        return _training_executor_manager.get_executor(max_workers=max_workers)
     elif hint == "sampling":
-        return SerialExecutor()
+        # samples of different annotations (or of the tiles under a single one) are independent. Nested sampling
+        # from inside the pool falls back to the SerialExecutor above, so the pool can't deadlock on itself
+        return _worker_thread_pool_manager.get_executor(max_workers=max_workers)
     elif hint == "feature_extraction":
         return SerialExecutor()
         # return _worker_thread_pool_manager.get_executor(max_workers=max_workers)
@@ -84,6 +110,7 @@ def _get_executor(*, hint: ExecutorHint, max_workers: Optional[int] = None) -> E
 def _shutdown_executors():
     print(f"Shutting down global executors....")
     _server_executor_manager.shutdown()
+    _training_executor_manager.shutdown()
     _worker_thread_pool_manager.shutdown()
 
 _ = atexit.register(_shutdown_executors)
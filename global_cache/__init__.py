@@ -4,6 +4,8 @@ import functools
 import os
 import sys
 
+from webilastik.utility.cache import LruCache, SingleFlight, make_cache_key
+
 P = ParamSpec("P")
 T = TypeVar("T", bound=Callable[..., Any])
 
@@ -18,4 +20,10 @@ else:
     _maxsize = int(_max_size_env_var)
 
 def global_cache(func: T) -> T:
-    return functools.lru_cache(maxsize=_maxsize)(func) #type: ignore
\ No newline at end of file
+    cache = LruCache(max_entries=_maxsize)
+    single_flight = SingleFlight()
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return single_flight.get_or_compute(make_cache_key(func, args, kwargs), cache=cache, compute=lambda: func(*args, **kwargs))
+    return wrapper #type: ignore
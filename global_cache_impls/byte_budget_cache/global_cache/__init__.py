@@ -0,0 +1,34 @@
+from typing import Any, Callable, TypeVar
+from typing_extensions import ParamSpec
+from functools import wraps
+import os
+import sys
+
+from webilastik.utility.cache import ByteBudgetCache, CacheStats, SingleFlight, make_cache_key
+
+P = ParamSpec("P")
+T = TypeVar("T", bound=Callable[..., Any])
+
+ENV_VAR_NAME = "GLOBAL_CACHE_MAX_BYTES"
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+_max_bytes_env_var = os.environ.get(ENV_VAR_NAME)
+if _max_bytes_env_var is None:
+    print(f"{ENV_VAR_NAME} was not set, defaulting to {DEFAULT_MAX_BYTES}", file=sys.stderr)
+    _max_bytes = DEFAULT_MAX_BYTES
+else:
+    print(f"Setting global cache byte budget to {_max_bytes_env_var}", file=sys.stderr)
+    _max_bytes = int(_max_bytes_env_var)
+
+_cache = ByteBudgetCache(max_bytes=_max_bytes)
+_single_flight = SingleFlight()
+
+def get_cache_stats() -> CacheStats:
+    return _cache.stats()
+
+def global_cache(func: T) -> T:
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return _single_flight.get_or_compute(
+            make_cache_key(func, args, kwargs), cache=_cache, compute=lambda: func(*args, **kwargs)
+        )
+    return wrapper #type: ignore
@@ -1,49 +1,58 @@
-from typing import Any, Callable, Tuple, TypeVar
+from typing import Any, Callable, List, Sequence, Tuple, TypeVar
 from typing_extensions import ParamSpec
-import pickle
 from functools import wraps
-from pathlib import Path
-import sys
-import os
 
-import redis # pyright: ignore [reportMissingTypeStubs]
-
-from webilastik.utility import get_env_var_or_exit
+from webilastik.utility import Empty
+from webilastik.utility.cache import try_make_stable_cache_key
+from webilastik.utility.redis_cache import RedisCache
 
 P = ParamSpec("P")
 T = TypeVar("T", bound=Callable[..., Any])
 
-def parse_ip_port(value: str) -> Tuple[str, int]:
-    ip_str, port = value.split(":")
-    return ip_str, int(port)
-
-REDIS_HOST_PORT = os.environ.get("REDIS_HOST_PORT")
-if REDIS_HOST_PORT is not None:
-    redis_host, port_str = REDIS_HOST_PORT.split(":")
-    redis_factory = lambda: redis.Redis(host=redis_host, port=int(port_str))
-else:
-    REDIS_UNIX_SOCKET_PATH = get_env_var_or_exit(var_name="REDIS_UNIX_SOCKET_PATH", parser=Path)
-    if not REDIS_UNIX_SOCKET_PATH.exists():
-        print(f"Redis socket path {REDIS_UNIX_SOCKET_PATH} does not exist", file=sys.stderr)
-        exit(1)
-    if not REDIS_UNIX_SOCKET_PATH.is_socket():
-        print(f"Redis socket path {REDIS_UNIX_SOCKET_PATH} is not a socket", file=sys.stderr)
-        exit(1)
-    redis_factory = lambda: redis.Redis(unix_socket_path=str(REDIS_UNIX_SOCKET_PATH))
+redis_cache = RedisCache.from_env()
+
+def _run_serially(computations: Sequence[Callable[[], Any]]) -> List[Any]:
+    return [compute() for compute in computations]
 
 def _redis_cache(func: T) -> T: #FIXME: use Callabe[P, OUT] ?
+    namespace = f"{func.__module__}.{func.__qualname__}"
+
     @wraps(func)
-    def wrapper(*args, **kwargs):
-        r = redis_factory()
-        key_tuple = (func.__qualname__, tuple(args), sorted(kwargs.items(), key=lambda x: x[0]))
-        key  = pickle.dumps(key_tuple)
-        raw_value = r.get(key)
-        if raw_value is not None:
-            value = pickle.loads(raw_value) # pyright: ignore [reportArgumentType]
-        else:
-            value = func(*args, **kwargs)
-            _ = r.set(key, pickle.dumps(value))
-        return value
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        key = try_make_stable_cache_key(namespace, args, kwargs)
+        if isinstance(key, Exception):
+            # e.g. rois of an in-memory ArrayDataSource, which other processes could never ask for anyway
+            return func(*args, **kwargs)
+        return redis_cache.get_or_compute(key, lambda: func(*args, **kwargs))
+
+    def get_many(
+        args_list: Sequence[Tuple[Any, ...]],
+        run_all: Callable[[Sequence[Callable[[], Any]]], List[Any]] = _run_serially,
+    ) -> List[Any]:
+        """Looks up the results for many calls in a single round trip, computing only the ones that are missing.
+
+        The missing values are computed by handing their computations to run_all, e.g. to run them concurrently.
+        """
+        maybe_keys = [try_make_stable_cache_key(namespace, args, {}) for args in args_list]
+        # calls that have no stable key (e.g. over an in-memory ArrayDataSource) skip redis and are always computed
+        keyed = [(idx, key) for idx, key in enumerate(maybe_keys) if not isinstance(key, Exception)]
+        values: "List[Any | Empty]" = [Empty()] * len(args_list)
+        for (idx, _), value in zip(keyed, redis_cache.get_many([key for _, key in keyed])):
+            values[idx] = value
+        missing_indices = [idx for idx, value in enumerate(values) if isinstance(value, Empty)]
+
+        def make_computation(idx: int) -> Callable[[], Any]:
+            key = maybe_keys[idx]
+            args = args_list[idx]
+            if isinstance(key, Exception):
+                return lambda: func(*args)
+            return lambda: redis_cache.compute_missing(key, lambda: func(*args))
+        computed_values = run_all([make_computation(idx) for idx in missing_indices])
+        for idx, value in zip(missing_indices, computed_values):
+            values[idx] = value
+        return values
+
+    wrapper.get_many = get_many # type: ignore
     return wrapper #type: ignore
 
 global_cache = _redis_cache
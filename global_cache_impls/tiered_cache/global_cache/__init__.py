@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Literal, Mapping, TypeVar
+from typing_extensions import ParamSpec
+from functools import wraps
+
+from webilastik.utility import get_env_var_or_exit, parse_bool
+from webilastik.utility.cache import ByteBudgetCache, CacheStats, CacheTier, TieredCache, make_cache_key, try_make_stable_cache_key
+
+P = ParamSpec("P")
+T = TypeVar("T", bound=Callable[..., Any])
+
+def parse_l2_kind(value: str) -> "Literal['redis', 'local'] | Exception":
+    if value == "redis" or value == "local":
+        return value
+    return ValueError(f"Bad L2 cache kind: {value}. Expected 'redis' or 'local'")
+
+_l1_max_bytes = get_env_var_or_exit(var_name="TIERED_CACHE_L1_MAX_BYTES", parser=int, default=256 * 1024 * 1024)
+_l2_kind = get_env_var_or_exit(var_name="TIERED_CACHE_L2", parser=parse_l2_kind, default="redis")
+_async_write_back = get_env_var_or_exit(var_name="TIERED_CACHE_ASYNC_WRITE_BACK", parser=parse_bool, default=False)
+
+_l2: "CacheTier[bytes]"
+if _l2_kind == "redis":
+    from webilastik.utility.redis_cache import RedisCache
+    _l2 = RedisCache.from_env()
+else:
+    # a process-local stand-in for the shared tier, e.g. for development machines without a redis server
+    _l2 = ByteBudgetCache(
+        max_bytes=get_env_var_or_exit(var_name="TIERED_CACHE_L2_MAX_BYTES", parser=int, default=2 * 1024 * 1024 * 1024)
+    )
+
+_cache = TieredCache(
+    l1=ByteBudgetCache(max_bytes=_l1_max_bytes),
+    l2=_l2,
+    write_back_executor=ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache_write_back_") if _async_write_back else None,
+)
+
+def get_cache_stats() -> Mapping[str, CacheStats]:
+    return _cache.stats()
+
+def global_cache(func: T) -> T:
+    namespace = f"{func.__module__}.{func.__qualname__}"
+
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return _cache.get_or_compute(
+            local_key=make_cache_key(func, args, kwargs),
+            make_shared_key=lambda: try_make_stable_cache_key(namespace, args, kwargs),
+            compute=lambda: func(*args, **kwargs),
+        )
+    return wrapper #type: ignore
@@ -1,10 +1,158 @@
+import numpy as np
+from ndstructs.array5D import Array5D
+from ndstructs.point5D import Shape5D
+
 from tests import get_sample_c_cells_datasource
+from webilastik.datasource.array_datasource import ArrayDataSource
 from webilastik.features.channelwise_fastfilters import (
-    GaussianSmoothing
+    APPROXIMATION_TOLERANCE, ChannelwiseFastFilter, DifferenceOfGaussians, GaussianGradientMagnitude, GaussianSmoothing, HessianOfGaussianEigenvalues,
+    LaplacianOfGaussian, StructureTensorEigenvalues
+)
+from webilastik.features.ilp_filter import (
+    IlpDifferenceOfGaussians,
+    IlpGaussianGradientMagnitude,
+    IlpGaussianSmoothing,
+    IlpHessianOfGaussianEigenvalues,
+    IlpLaplacianOfGaussian,
+    IlpStructureTensorEigenvalues,
 )
+from webilastik.features.feature_graph import FeatureGraph
+
+
+def test_halo_grows_with_sigma():
+    assert GaussianSmoothing(sigma=0.3, axis_2d="z").halo.x < GaussianSmoothing(sigma=10.0, axis_2d="z").halo.x
+    assert GaussianSmoothing(sigma=0.3, axis_2d="z").halo.z == 0
+    assert GaussianSmoothing(sigma=0.3, axis_2d=None).halo.z > 0
+
+    small_scale = IlpGaussianSmoothing(ilp_scale=0.7, axis_2d="z")
+    large_scale = IlpGaussianSmoothing(ilp_scale=10.0, axis_2d="z")
+    assert small_scale.halo.x < large_scale.halo.x
+    assert large_scale.halo.x == large_scale.presmoother.halo.x + large_scale.op.halo.x
+
+def test_tiled_filtering_has_no_seams():
+    data = Array5D(np.random.rand(200, 200).astype(np.float32) * 255, axiskeys="yx")
+    datasource = ArrayDataSource(data=data, tile_shape=Shape5D(x=64, y=64))
+
+    filters: "list[ChannelwiseFastFilter]" = [
+        GaussianSmoothing(sigma=10.0, axis_2d="z"),
+        GaussianGradientMagnitude(sigma=3.5, axis_2d="z"),
+        DifferenceOfGaussians(sigma0=5.0, sigma1=3.3, axis_2d="z"),
+        HessianOfGaussianEigenvalues(scale=5.0, axis_2d="z"),
+        StructureTensorEigenvalues(innerScale=3.0, outerScale=1.5, axis_2d="z"),
+        GaussianSmoothing(sigma=5.0, axis_2d="z", preprocessor=GaussianSmoothing(sigma=3.0, axis_2d="z")),
+    ]
+    for fx in filters:
+        whole_image_features = fx(datasource.roi)
+        for tile in datasource.roi.get_datasource_tiles():
+            tile_features = fx(tile)
+            expected = whole_image_features.cut(tile_features.interval)
+            assert np.allclose(tile_features.raw("yxc"), expected.raw("yxc"), atol=1e-3), f"Seams in {fx}"
+
+def test_slices_are_filtered_independently():
+    data = Array5D(np.random.rand(2, 16, 40, 50).astype(np.float32) * 255, axiskeys="czyx")
+    fx = HessianOfGaussianEigenvalues(scale=2.0, axis_2d="z")
+
+    # no halo, so that every slice is filtered exactly as filter_fn would on its own
+    features = fx.compute_from_source(source_data=data, roi=data.interval)
+    for c in range(2):
+        for z in range(16):
+            expected = fx.filter_fn(np.ascontiguousarray(data.raw("czyx")[c, z]))
+            slice_features = features.cut(features.interval.updated(z=(z, z + 1), c=(c * 2, c * 2 + 2)))
+            assert np.allclose(slice_features.raw("yxc"), expected), f"Mismatch at c={c} z={z}"
+
+def test_downsampled_approximation_stays_within_tolerance():
+    y, x = np.mgrid[0:300, 0:300]
+    raw = 127 + 64 * np.sin(x / 13) * np.cos(y / 17) # smooth structures...
+    raw[100:180, 60:250] += 60 # ...sharp edges...
+    raw += np.random.rand(300, 300) * 10 # ...and noise
+    data = Array5D(raw.astype(np.float32), axiskeys="yx")
+    datasource = ArrayDataSource(data=data, tile_shape=Shape5D(x=128, y=128))
+    dynamic_range = float(raw.max() - raw.min())
+
+    filters: "list[ChannelwiseFastFilter]" = [
+        GaussianSmoothing(sigma=5.0, axis_2d="z"),
+        GaussianSmoothing(sigma=10.0, axis_2d="z"),
+        DifferenceOfGaussians(sigma0=10.0, sigma1=6.6, axis_2d="z"),
+    ]
+    for fx in filters:
+        assert fx.get_approximation_factor(approximation_min_sigma=4.0) > 1
+        assert fx.get_approximation_factor(approximation_min_sigma=0) == 1
+        for tile in datasource.roi.get_datasource_tiles():
+            source_data = tile.enlarged(fx.halo).retrieve()
+            exact = fx.compute_from_source(source_data=source_data, roi=tile.interval, approximation_min_sigma=0)
+            approximated = fx.compute_from_source(source_data=source_data, roi=tile.interval, approximation_min_sigma=4.0)
+            assert approximated.interval == exact.interval
+            max_error = np.abs(approximated.raw("yxc") - exact.raw("yxc")).max()
+            assert max_error <= APPROXIMATION_TOLERANCE * dynamic_range, f"Error of {max_error} in {fx}"
+
+    small_filter = GaussianSmoothing(sigma=1.0, axis_2d="z")
+    assert small_filter.get_approximation_factor(approximation_min_sigma=4.0) == 1
+
+    # there's no tested error bound for derivative filters, so they are always computed exactly
+    derivative_filters: "list[ChannelwiseFastFilter]" = [
+        GaussianGradientMagnitude(sigma=10.0, axis_2d="z"),
+        LaplacianOfGaussian(scale=10.0, axis_2d="z"),
+        HessianOfGaussianEigenvalues(scale=10.0, axis_2d="z"),
+        StructureTensorEigenvalues(innerScale=10.0, outerScale=10.0, axis_2d="z"),
+    ]
+    for fx in derivative_filters:
+        assert fx.get_approximation_factor(approximation_min_sigma=4.0) == 1
+
+def test_approximated_tiles_agree_at_seams():
+    y, x = np.mgrid[0:300, 0:300]
+    raw = 127 + 64 * np.sin(x / 13) * np.cos(y / 17)
+    raw[100:180, 60:250] += 60
+    data = Array5D(raw.astype(np.float32), axiskeys="yx")
+    # tiles that are not multiples of the approximation factor, so that each one starts at a different block offset
+    datasource = ArrayDataSource(data=data, tile_shape=Shape5D(x=64, y=64))
+    dynamic_range = float(raw.max() - raw.min())
+
+    fx = GaussianSmoothing(sigma=10.0, axis_2d="z")
+    factor = fx.get_approximation_factor(approximation_min_sigma=4.0)
+    assert factor > 1 and 64 % factor != 0
+    whole_image = fx.compute_from_source(
+        source_data=datasource.roi.enlarged(fx.halo).retrieve(), roi=datasource.roi.interval, approximation_min_sigma=4.0
+    )
+    tiled = Array5D.allocate(interval=whole_image.interval, dtype=np.dtype("float32"), axiskeys="yxc")
+    for tile in datasource.roi.get_datasource_tiles():
+        tiled.set(fx.compute_from_source(source_data=tile.enlarged(fx.halo).retrieve(), roi=tile.interval, approximation_min_sigma=4.0))
+
+    # pixels on both sides of every seam must average the same blocks as when computing the image as a whole
+    max_difference = np.abs(tiled.raw("yxc") - whole_image.raw("yxc")).max()
+    assert max_difference <= APPROXIMATION_TOLERANCE * dynamic_range / 2, f"Difference of {max_difference} at seams"
+
+def test_ilp_presmoothers_are_never_approximated():
+    # ilp ops differentiate their presmoothed input, which would amplify the error of an approximated presmoother
+    ilp_filters = [
+        IlpGaussianSmoothing(ilp_scale=10.0, axis_2d="z"),
+        IlpLaplacianOfGaussian(ilp_scale=10.0, axis_2d="z"),
+        IlpGaussianGradientMagnitude(ilp_scale=10.0, axis_2d="z"),
+        IlpDifferenceOfGaussians(ilp_scale=10.0, axis_2d="z"),
+        IlpStructureTensorEigenvalues(ilp_scale=10.0, axis_2d="z"),
+        IlpHessianOfGaussianEigenvalues(ilp_scale=5.0, axis_2d="z"),
+        IlpHessianOfGaussianEigenvalues(ilp_scale=10.0, axis_2d="z"),
+    ]
+    for ilp_filter in ilp_filters:
+        assert ilp_filter.presmoother.sigma >= 4.0
+        assert ilp_filter.presmoother.get_approximation_factor(approximation_min_sigma=4.0) == 1
+        assert ilp_filter.op.get_approximation_factor(approximation_min_sigma=4.0) == 1
+
+    # nor are the cascaded gaussians that the feature graph computes them as
+    graph = FeatureGraph([ilp_filter.op for ilp_filter in ilp_filters], cascade=True)
+    assert len(graph.substitutes) > 0
+    for substitute in graph.substitutes.values():
+        assert isinstance(substitute, GaussianSmoothing)
+        assert substitute.get_approximation_factor(approximation_min_sigma=4.0) == 1
 
 if __name__ == "__main__":
+    test_halo_grows_with_sigma()
+    test_tiled_filtering_has_no_seams()
+    test_slices_are_filtered_independently()
+    test_downsampled_approximation_stays_within_tolerance()
+    test_approximated_tiles_agree_at_seams()
+    test_ilp_presmoothers_are_never_approximated()
+
     ds = get_sample_c_cells_datasource()
     feature_extractor = GaussianSmoothing(axis_2d="z", sigma=3.0)
     for tile in ds.roi.get_datasource_tiles():
-        _ = feature_extractor(tile)#.show_images()
\ No newline at end of file
+        _ = feature_extractor(tile)#.show_images()
@@ -0,0 +1,83 @@
+from typing import List
+
+import numpy as np
+from ndstructs.array5D import Array5D
+from ndstructs.point5D import Point5D, Shape5D
+
+from webilastik.datasource import DataRoi
+from webilastik.datasource.array_datasource import ArrayDataSource
+from webilastik.features.compute_blocks import (
+    BlockwiseFeatureExtractor, estimate_compute_block_bytes, get_block_cache_stats, get_max_halo, plan_compute_block_shape
+)
+from webilastik.features.feature_extractor import FeatureData, FeatureExtractorCollection
+from webilastik.features.ilp_filter import IlpGaussianGradientMagnitude, IlpGaussianSmoothing, IlpHessianOfGaussianEigenvalues
+
+
+def test_compute_blocks_are_multiples_of_tiles_within_budget():
+    data = Array5D(np.zeros((64, 512, 512), dtype=np.uint8), axiskeys="zyx")
+    datasource = ArrayDataSource(data=data, tile_shape=Shape5D(x=64, y=64, z=64))
+    halo = Point5D.zero(x=30, y=30, z=30)
+    max_bytes = 512 * 1024 * 1024
+
+    block_shape = plan_compute_block_shape(datasource=datasource, halo=halo, num_feature_channels=4, max_bytes=max_bytes)
+    assert block_shape.x > datasource.tile_shape.x and block_shape.y > datasource.tile_shape.y
+    assert block_shape.z == 64 # the datasource is only one tile deep
+    for axis in "xyz":
+        assert block_shape[axis] % datasource.tile_shape[axis] == 0
+    assert estimate_compute_block_bytes(block_shape=block_shape, halo=halo, num_input_channels=1, num_feature_channels=4) <= max_bytes
+
+    tiny_block_shape = plan_compute_block_shape(datasource=datasource, halo=halo, num_feature_channels=4, max_bytes=1)
+    assert tiny_block_shape.updated(c=1) == datasource.tile_shape.updated(c=1)
+
+def test_blockwise_features_match_direct_features():
+    data = Array5D(np.random.rand(200, 230).astype(np.float32) * 255, axiskeys="yx")
+    datasource = ArrayDataSource(data=data, tile_shape=Shape5D(x=32, y=32))
+    extractors = [
+        IlpGaussianSmoothing(ilp_scale=3.5, axis_2d="z"),
+        IlpGaussianGradientMagnitude(ilp_scale=1.0, axis_2d="z"),
+        IlpHessianOfGaussianEigenvalues(ilp_scale=1.6, axis_2d="z"),
+    ]
+    collection = FeatureExtractorCollection(extractors)
+    assert get_max_halo(extractors) == max((fx.halo for fx in extractors), key=lambda halo: halo.x)
+
+    blockwise = BlockwiseFeatureExtractor(collection, block_shape=Shape5D(x=128, y=128))
+    rois = [
+        *datasource.roi.get_datasource_tiles(),
+        DataRoi(datasource, x=(100, 150), y=(120, 140)), # across blocks
+    ]
+    for roi in rois:
+        expected = collection(roi)
+        blockwise_features = blockwise(roi)
+        assert blockwise_features.interval == expected.interval
+        assert np.allclose(blockwise_features.raw("yxc"), expected.raw("yxc"), atol=1e-3), f"Mismatch at {roi}"
+computed_blocks: List[DataRoi] = []
+
+class CountingFeatureExtractorCollection(FeatureExtractorCollection):
+    def compute(self, roi: DataRoi) -> FeatureData:
+        computed_blocks.append(roi)
+        return super().compute(roi)
+
+def test_each_block_is_computed_once():
+    data = Array5D(np.random.rand(200, 230).astype(np.float32) * 255, axiskeys="yx")
+    datasource = ArrayDataSource(data=data, tile_shape=Shape5D(x=32, y=32))
+    collection = CountingFeatureExtractorCollection([IlpGaussianSmoothing(ilp_scale=1.6, axis_2d="z")])
+    blockwise = BlockwiseFeatureExtractor(collection, block_shape=Shape5D(x=128, y=128))
+
+    tiles = list(datasource.roi.get_datasource_tiles())
+    blocks = {blockwise.get_block(tile) for tile in tiles}
+    assert len(blocks) == 4
+    stats_before = get_block_cache_stats()
+    for tile in tiles:
+        assert blockwise.get_block(tile).contains(tile.interval)
+        _ = blockwise(tile)
+    assert sorted(computed_blocks, key=lambda block: block.start.to_tuple("xyz")) == sorted(blocks, key=lambda block: block.start.to_tuple("xyz"))
+
+    stats_after = get_block_cache_stats()
+    assert stats_after.misses - stats_before.misses == len(blocks)
+    assert stats_after.hits - stats_before.hits == len(tiles) - len(blocks)
+    assert stats_after.resident_bytes <= stats_after.max_bytes
+
+if __name__ == "__main__":
+    test_compute_blocks_are_multiples_of_tiles_within_budget()
+    test_blockwise_features_match_direct_features()
+    test_each_block_is_computed_once()
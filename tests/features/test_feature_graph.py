@@ -0,0 +1,90 @@
+import numpy as np
+from ndstructs.array5D import Array5D
+from ndstructs.point5D import Shape5D
+
+from executor_getter import get_executor
+from webilastik.datasource.array_datasource import ArrayDataSource
+from webilastik.features.channelwise_fastfilters import GaussianSmoothing
+from webilastik.features.feature_graph import CASCADE_TOLERANCE, FeatureGraph
+from webilastik.features.ilp_filter import IlpDifferenceOfGaussians, IlpFilterCollection, IlpGaussianSmoothing, IlpLaplacianOfGaussian
+
+
+def test_feature_graph_shares_intermediate_results():
+    extractors = [
+        IlpGaussianSmoothing(ilp_scale=1.6, axis_2d="z"),
+        IlpLaplacianOfGaussian(ilp_scale=1.6, axis_2d="z"),
+        IlpDifferenceOfGaussians(ilp_scale=1.6, axis_2d="z"),
+    ]
+    graph = FeatureGraph(extractors, cascade=False)
+    # all three share a presmoother, and the DoG reuses the output of the gaussian smoothing
+    presmoothers = [node for node in graph.radii.keys() if isinstance(node, GaussianSmoothing) and node == extractors[0].presmoother]
+    assert len(presmoothers) == 1
+    gaussians = [node for node in graph.radii.keys() if isinstance(node, GaussianSmoothing)]
+    assert len(gaussians) == 3 # the presmoother, the op of the smoothing (DoG's sigma0) and DoG's sigma1
+
+    # the presmoother must be computed over the largest halo any of its consumers needs
+    assert graph.radii[presmoothers[0]].x == max(extractor.op.halo.x for extractor in extractors)
+
+def test_feature_graph_matches_individual_extractors():
+    data = Array5D(np.random.rand(150, 170, 2).astype(np.float32) * 255, axiskeys="yxc")
+    datasource = ArrayDataSource(data=data, tile_shape=Shape5D(x=64, y=64, c=2))
+    extractors = IlpFilterCollection.all().filters
+
+    for tile in datasource.roi.get_datasource_tiles():
+        graph_features = FeatureGraph(extractors, cascade=False).compute(tile, executor=get_executor(hint="feature_extraction"))
+        for extractor, graph_feature in zip(extractors, graph_features):
+            expected = extractor(tile)
+            assert graph_feature.interval == expected.interval
+            assert np.allclose(graph_feature.raw("yxc"), expected.raw("yxc"), atol=1e-4), f"Mismatch in {extractor}"
+
+def test_feature_graph_writes_into_out():
+    data = Array5D(np.random.randint(0, 255, size=(150, 170, 2)).astype(np.uint8), axiskeys="yxc")
+    datasource = ArrayDataSource(data=data, tile_shape=Shape5D(x=64, y=64, c=2))
+    extractors = IlpFilterCollection.all().filters
+    graph = FeatureGraph(extractors, cascade=False)
+    executor = get_executor(hint="feature_extraction")
+
+    for tile in datasource.roi.get_datasource_tiles():
+        num_channels = [graph.get_num_channels(output, tile.shape.c) for output in graph.outputs]
+        out = Array5D.allocate(
+            interval=tile.shape.updated(c=sum(n or 0 for n in num_channels)), dtype=np.dtype("float32"), axiskeys="tzyxc"
+        ).translated(tile.start)
+        written_features = graph.compute(tile, executor=executor, out=out)
+        expected_features = graph.compute(tile, executor=executor)
+
+        channel_offset = 0
+        for extractor, written, expected in zip(extractors, written_features, expected_features):
+            assert written.interval == expected.interval
+            assert np.shares_memory(written.raw(written.axiskeys), out.raw(out.axiskeys))
+            assert np.allclose(written.raw("yxc"), expected.raw("yxc"), atol=1e-4), f"Mismatch in {extractor}"
+            out_channels = out.cut(out.interval.updated(c=(channel_offset, channel_offset + expected.shape.c)))
+            assert np.allclose(out_channels.raw("yxc"), expected.raw("yxc"), atol=1e-4), f"Misplaced {extractor}"
+            channel_offset += expected.shape.c
+        assert channel_offset == out.shape.c
+
+def test_gaussian_cascade_stays_within_tolerance():
+    data = Array5D(np.random.rand(150, 170).astype(np.float32) * 255, axiskeys="yx")
+    datasource = ArrayDataSource(data=data, tile_shape=Shape5D(x=64, y=64))
+    extractors = [
+        extractor_class(ilp_scale=scale, axis_2d="z")
+        for extractor_class in (IlpGaussianSmoothing, IlpLaplacianOfGaussian)
+        for scale in IlpFilterCollection.DEFAULT_SCALES
+    ]
+    cascaded_graph = FeatureGraph(extractors, cascade=True)
+    assert len(cascaded_graph.substitutes) > 0
+    exact_graph = FeatureGraph(extractors, cascade=False)
+    assert len(exact_graph.substitutes) == 0
+
+    executor = get_executor(hint="feature_extraction")
+    for tile in datasource.roi.get_datasource_tiles():
+        cascaded_features = cascaded_graph.compute(tile, executor=executor)
+        exact_features = exact_graph.compute(tile, executor=executor)
+        for extractor, cascaded, exact in zip(extractors, cascaded_features, exact_features):
+            max_error = np.abs(cascaded.raw("yxc") - exact.raw("yxc")).max()
+            assert max_error <= CASCADE_TOLERANCE * 255, f"Error of {max_error} in {extractor}"
+
+if __name__ == "__main__":
+    test_feature_graph_shares_intermediate_results()
+    test_feature_graph_matches_individual_extractors()
+    test_feature_graph_writes_into_out()
+    test_gaussian_cascade_stays_within_tolerance()
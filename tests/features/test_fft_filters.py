@@ -0,0 +1,52 @@
+import numpy as np
+from ndstructs.array5D import Array5D
+from ndstructs.point5D import Shape5D
+
+from webilastik.datasource.array_datasource import ArrayDataSource
+from webilastik.features.channelwise_fastfilters import (
+    ChannelwiseFastFilter, DifferenceOfGaussians, GaussianGradientMagnitude, GaussianSmoothing, HessianOfGaussianEigenvalues,
+    LaplacianOfGaussian, StructureTensorEigenvalues
+)
+from webilastik.features.fft_filters import get_gaussian_kernel
+
+
+def test_gaussian_kernels_are_exact_on_polynomials():
+    x = np.arange(-40, 41, dtype=np.float64)
+    for sigma in (0.7, 3.5, 10.0):
+        smoothing = get_gaussian_kernel(sigma, order=0, window_size=3.5)
+        assert np.isclose(smoothing.sum(), 1)
+        radius = (len(smoothing) - 1) // 2
+        center = x[40 - radius: 40 + radius + 1]
+        # convolving flips the kernel, hence the signs
+        assert np.isclose(-(get_gaussian_kernel(sigma, order=1, window_size=3.5) * center).sum(), 1)
+        assert np.isclose((get_gaussian_kernel(sigma, order=2, window_size=3.5) * center ** 2).sum(), 2)
+
+def test_fft_filters_match_fastfilters():
+    data = Array5D(np.random.rand(2, 150, 170).astype(np.float32) * 255, axiskeys="cyx")
+    datasource = ArrayDataSource(data=data, tile_shape=Shape5D(x=64, y=64, c=2))
+    filters: "list[ChannelwiseFastFilter]" = [
+        GaussianSmoothing(sigma=0.7, axis_2d="z"),
+        GaussianSmoothing(sigma=10.0, axis_2d="z"),
+        GaussianGradientMagnitude(sigma=5.0, axis_2d="z"),
+        LaplacianOfGaussian(scale=3.5, axis_2d="z"),
+        DifferenceOfGaussians(sigma0=10.0, sigma1=6.6, axis_2d="z"),
+    ]
+    for fx in filters:
+        assert fx.uses_fft(fft_min_kernel_width=1)
+        assert not fx.uses_fft(fft_min_kernel_width=0)
+        for tile in datasource.roi.get_datasource_tiles():
+            source_data = tile.enlarged(fx.halo).retrieve()
+            expected = fx.compute_from_source(source_data=source_data, roi=tile.interval, fft_min_kernel_width=0)
+            fft_features = fx.compute_from_source(source_data=source_data, roi=tile.interval, fft_min_kernel_width=1)
+            assert fft_features.interval == expected.interval
+            max_error = np.abs(fft_features.raw("yxc") - expected.raw("yxc")).max()
+            assert max_error <= 1e-2 * np.abs(expected.raw("yxc")).max() + 1e-3, f"Error of {max_error} in {fx}"
+
+    # filters without an FFT implementation stay on fastfilters no matter how wide their kernels
+    for fx in [HessianOfGaussianEigenvalues(scale=10.0, axis_2d="z"), StructureTensorEigenvalues(innerScale=10.0, outerScale=5.0, axis_2d="z")]:
+        assert fx.get_fft_filter_fn() is None
+        assert not fx.uses_fft(fft_min_kernel_width=1)
+
+if __name__ == "__main__":
+    test_gaussian_kernels_are_exact_on_polynomials()
+    test_fft_filters_match_fastfilters()
@@ -1,9 +1,19 @@
 #pyright: strict
 
 from pathlib import PurePosixPath
-from webilastik.filesystem import create_filesystem_from_url
+from types import SimpleNamespace
+import http.client
+
+import requests
+from requests.cookies import extract_cookies_to_jar
+
+from webilastik.filesystem import FsFileNotFoundException, FsIoException, FsReadRequest, create_filesystem_from_url
 from webilastik.filesystem.os_fs import OsFs
-from webilastik.filesystem.bucket_fs import BucketFs
+from webilastik.filesystem.bucket_fs import BucketFs, ObjectUrlCache
+from webilastik.filesystem.http_fs import HttpFs
+from webilastik.utility.request import get_session
+from webilastik.utility.url import Url
+import time
 import uuid
 from zipfile import ZipFile, ZIP_STORED
 
@@ -105,6 +115,90 @@ def test_zip_fs():
     assert not isinstance(zip_fs, Exception), str(zip_fs)
     assert zip_fs.read_file(PurePosixPath(entry1_path)) == entry1_contents
 
+    batch_results = zip_fs.read_files([
+        FsReadRequest(path=PurePosixPath("/a/b/entry2.txt"), offset=2, num_bytes=3),
+        FsReadRequest(path=PurePosixPath(entry1_path)),
+        FsReadRequest(path=PurePosixPath("/a/b/entry2.txt")),
+        FsReadRequest(path=PurePosixPath("/not_there.txt")),
+    ])
+    assert batch_results[0] == entry2_contents[2:5]
+    assert batch_results[1] == entry1_contents
+    assert batch_results[2] == entry2_contents
+    assert isinstance(batch_results[3], FsFileNotFoundException)
+
+def test_osfs_read_files():
+    temp_fs = OsFs.create_scratch_dir()
+    assert not isinstance(temp_fs, Exception), str(temp_fs)
+    contents1 = b"0123456789"
+    contents2 = b"abcdefghij"
+    assert temp_fs.create_file(path=PurePosixPath("/file1"), contents=contents1) is None
+    assert temp_fs.create_file(path=PurePosixPath("/dir/file2"), contents=contents2) is None
+
+    requests = [
+        FsReadRequest(path=PurePosixPath("/file1"), offset=5, num_bytes=2),
+        FsReadRequest(path=PurePosixPath("/dir/file2")),
+        FsReadRequest(path=PurePosixPath("/file1"), offset=-3),
+        FsReadRequest(path=PurePosixPath("/file1")),
+        FsReadRequest(path=PurePosixPath("/missing")),
+        FsReadRequest(path=PurePosixPath("/file1"), offset=-20),
+    ]
+    batch_results = temp_fs.read_files(requests)
+    assert batch_results[0] == b"56"
+    assert batch_results[1] == contents2
+    assert batch_results[2] == b"789"
+    assert batch_results[3] == contents1
+    assert isinstance(batch_results[4], FsFileNotFoundException)
+    assert isinstance(batch_results[5], FsIoException) # offset before the start of the file
+
+    for req, result in zip(requests, batch_results):
+        single_result = temp_fs.read_file(req.path, offset=req.offset, num_bytes=req.num_bytes)
+        assert type(result) == type(single_result)
+        if isinstance(result, bytes):
+            assert result == single_result
+
+def test_http_filesystems_share_sessions_per_host():
+    def create_http_fs(raw_url: str) -> HttpFs:
+        fs_result = HttpFs.try_from(url=Url.parse_or_raise(raw_url))
+        assert isinstance(fs_result, tuple)
+        return fs_result[0]
+
+    fs1 = create_http_fs("https://some.host.com/some/dataset")
+    fs2 = create_http_fs("https://some.host.com/other/dataset?a=1")
+    fs3 = create_http_fs("https://some.host.com:8443/some/dataset")
+    assert fs1.session is fs2.session
+    assert fs1.session is not fs3.session
+    assert get_session(Url.parse_or_raise("http://some.host.com/")) is not fs1.session
+
+def test_pooled_sessions_keep_no_cookies():
+    url = Url.parse_or_raise("https://some.cookie.host.com/login")
+    session = get_session(url)
+    set_cookie_headers = http.client.HTTPMessage()
+    set_cookie_headers["Set-Cookie"] = "session_id=some_user; Path=/"
+    response = SimpleNamespace(_original_response=SimpleNamespace(msg=set_cookie_headers))
+    extract_cookies_to_jar(session.cookies, requests.Request("GET", url.schemeless_raw).prepare(), response)
+    assert len(session.cookies) == 0
+
+def test_object_url_cache():
+    cache = ObjectUrlCache(ttl_seconds=0.2)
+    path = PurePosixPath("/some/object")
+    url = Url.parse_or_raise("https://object.cscs.ch/v1/AUTH_123/bucket/some/object")
+    cache.put(bucket_name="bucket", path=path, url=url)
+    assert cache.get(bucket_name="bucket", path=path) == url
+    assert cache.get(bucket_name="other_bucket", path=path) is None
+
+    cache.invalidate(bucket_name="bucket", path=path)
+    assert cache.get(bucket_name="bucket", path=path) is None
+
+    cache.put(bucket_name="bucket", path=path, url=url)
+    time.sleep(0.3)
+    assert cache.get(bucket_name="bucket", path=path) is None
+
+    # urls that say when they expire are not kept past that point, regardless of the configured ttl
+    long_lived_cache = ObjectUrlCache(ttl_seconds=3600)
+    expired_url = url.updated_with(extra_search={"temp_url_expires": str(int(time.time()) + 5)})
+    long_lived_cache.put(bucket_name="bucket", path=path, url=expired_url)
+    assert long_lived_cache.get(bucket_name="bucket", path=path) is None
+
 
 if __name__ == "__main__":
     import inspect
@@ -0,0 +1,21 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+import os
+
+from webilastik.scheduling.affinity_executor import AffinityExecutor
+
+
+def test_affinity_executor_keeps_keys_in_one_worker():
+    executor = AffinityExecutor([ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) for _ in range(3)])
+    try:
+        for affinity_key in ["block_a", "block_b", ("block", 3)]:
+            pids = {executor.submit_with_affinity(affinity_key, os.getpid).result() for _ in range(6)}
+            assert len(pids) == 1
+
+        unkeyed_pids = {executor.submit(os.getpid).result() for _ in range(6)}
+        assert len(unkeyed_pids) == 3 # tasks without a key go round-robin over all workers
+    finally:
+        executor.shutdown()
+
+if __name__ == "__main__":
+    test_affinity_executor_keeps_keys_in_one_worker()
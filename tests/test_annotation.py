@@ -1,5 +1,13 @@
-from ndstructs.point5D import Point5D
+from typing import List
+
+from ndstructs.array5D import All, Array5D
+from ndstructs.point5D import Point5D, Shape5D
 from webilastik.annotations import Annotation
+from webilastik.annotations.annotation import FeatureSamples, _make_samples, get_feature_samples_cache_stats
+from webilastik.datasource.array_datasource import ArrayDataSource
+from webilastik.features.ilp_filter import IlpGaussianSmoothing, IlpHessianOfGaussianEigenvalues
+from webilastik.datasource import DataRoi, DataSource
+from webilastik.features.feature_extractor import FeatureData, FeatureExtractor
 from tests import get_sample_c_cells_datasource
 from webilastik.annotations.annotation import Color
 
@@ -24,6 +32,96 @@ def test_collision_clearing():
     # a2.show(color=Color(g=np.uint8(255)))
 
 
+computed_rois: List[DataRoi] = []
+
+class CountingFeatureExtractor(FeatureExtractor):
+    def is_applicable_to(self, datasource: DataSource) -> bool:
+        return True
+
+    def __call__(self, /, roi: DataRoi) -> FeatureData:
+        computed_rois.append(roi)
+        data = roi.retrieve()
+        return FeatureData(data.raw(data.axiskeys).astype(np.float32), axiskeys=data.axiskeys, location=data.location)
+
+def test_feature_samples_are_computed_once_per_annotation():
+    raw_data = get_sample_c_cells_datasource()
+    feature_extractor = CountingFeatureExtractor()
+    a1 = Annotation.interpolate_from_points(
+        voxels=[Point5D(x=10, y=5), Point5D(x=15, y=5)],
+        raw_data=raw_data,
+    )
+    first_samples = a1.get_feature_samples(feature_extractor)
+    num_computed_rois = len(computed_rois)
+    assert num_computed_rois > 0
+
+    # an equal annotation, like the one sent again when the user adds a new stroke, reuses the cached samples
+    a1_again = Annotation.interpolate_from_points(
+        voxels=[Point5D(x=10, y=5), Point5D(x=15, y=5)],
+        raw_data=raw_data,
+    )
+    assert np.all(a1_again.get_feature_samples(feature_extractor).X == first_samples.X)
+    assert len(computed_rois) == num_computed_rois
+
+    a2 = Annotation.interpolate_from_points(
+        voxels=[Point5D(x=12, y=2), Point5D(x=12, y=7)],
+        raw_data=raw_data,
+    )
+    _ = a2.get_feature_samples(feature_extractor)
+    assert len(computed_rois) > num_computed_rois
+
+def test_feature_samples_cache_outlives_many_annotations():
+    # more annotations than the 128 entries per function of the default global_cache, over a non-FsDataSource
+    data = Array5D(np.random.rand(100, 100).astype(np.float32), axiskeys="yx")
+    raw_data = ArrayDataSource(data=data, tile_shape=Shape5D(x=50, y=50))
+    feature_extractor = CountingFeatureExtractor()
+    annotations = [
+        Annotation.interpolate_from_points(voxels=[Point5D(x=x, y=y), Point5D(x=x + 1, y=y)], raw_data=raw_data)
+        for y in range(0, 100, 5)
+        for x in range(0, 98, 10)
+    ]
+    assert len(annotations) == 200
+
+    computed_rois.clear()
+    for annotation in annotations:
+        _ = annotation.get_feature_samples(feature_extractor)
+    assert len(computed_rois) == len(annotations)
+
+    # retraining goes through all annotations again, in the same order
+    stats_before = get_feature_samples_cache_stats()
+    for annotation in annotations:
+        _ = annotation.get_feature_samples(feature_extractor)
+    assert len(computed_rois) == len(annotations)
+    assert get_feature_samples_cache_stats().hits - stats_before.hits == len(annotations)
+
+    # annotations changed in place (like when a new stroke is drawn over them) are sampled again
+    annotations[0].clear_collision(Annotation.interpolate_from_points(voxels=[Point5D(x=0, y=0)], raw_data=raw_data))
+    assert len(annotations[0].get_feature_samples(feature_extractor).X) == 1
+    assert len(computed_rois) == len(annotations) + 1
+
+def test_samples_are_computed_over_annotation_bounding_box():
+    raw_data = get_sample_c_cells_datasource()
+    annotation = Annotation.interpolate_from_points(
+        voxels=[Point5D(x=10, y=5), Point5D(x=15, y=5)],
+        raw_data=raw_data,
+    )
+    data_tile = next(raw_data.roi.get_datasource_tiles())
+    assert data_tile.contains(annotation.interval.updated(c=data_tile.interval.c))
+
+    computed_rois.clear()
+    _ = _make_samples(data_tile, annotation=annotation, feature_extractor=CountingFeatureExtractor())
+    assert [roi.interval for roi in computed_rois] == [annotation.interval.updated(c=data_tile.interval.c)]
+
+    for feature_extractor in (
+        IlpGaussianSmoothing(ilp_scale=3.5, axis_2d="z"),
+        IlpHessianOfGaussianEigenvalues(ilp_scale=1.6, axis_2d="z"),
+    ):
+        samples = _make_samples(data_tile, annotation=annotation, feature_extractor=feature_extractor)
+        whole_tile_samples = FeatureSamples.create(annotation, feature_extractor(data_tile).cut(annotation.interval, c=All()))
+        assert np.allclose(samples.X, whole_tile_samples.X, atol=1e-4)
+
 
 if __name__ == "__main__":
-    test_collision_clearing()
\ No newline at end of file
+    test_collision_clearing()
+    test_feature_samples_are_computed_once_per_annotation()
+    test_feature_samples_cache_outlives_many_annotations()
+    test_samples_are_computed_over_annotation_bounding_box()
\ No newline at end of file
@@ -0,0 +1,108 @@
+import importlib.util
+import os
+from pathlib import Path
+
+import numpy as np
+from ndstructs.array5D import Array5D
+from ndstructs.point5D import Shape5D
+
+from webilastik.datasource import DataRoi
+from webilastik.datasource.array_datasource import ArrayDataSource
+from webilastik.utility import Empty
+from webilastik.utility.cache import ByteBudgetCache, LruCache, SingleFlight, TieredCache, get_nbytes
+
+
+def test_byte_budget_cache():
+    small = Array5D(np.zeros((64, 64), dtype=np.uint8), axiskeys="yx")
+    big = Array5D(np.zeros((64, 64, 4), dtype=np.float32), axiskeys="yxc")
+    assert get_nbytes(small) == 64 * 64
+    assert get_nbytes(big) == 64 * 64 * 4 * 4
+
+    cache = ByteBudgetCache(max_bytes=get_nbytes(big) + get_nbytes(small))
+    cache.put(("small", 1), small)
+    cache.put(("small", 2), small)
+    assert cache.get(("small", 1)) is small # also makes ("small", 1) the most recently used entry
+    assert isinstance(cache.get(("nope",)), Empty)
+
+    cache.put(("big",), big)
+    stats = cache.stats()
+    assert stats.evictions == 1
+    assert isinstance(cache.get(("small", 2)), Empty)
+    assert cache.get(("small", 1)) is small
+    assert stats.resident_bytes == get_nbytes(big) + get_nbytes(small)
+    assert stats.resident_bytes <= stats.max_bytes
+
+    too_big = Array5D(np.zeros((1024, 1024), dtype=np.float32), axiskeys="yx")
+    cache.put(("too_big",), too_big)
+    assert isinstance(cache.get(("too_big",)), Empty)
+
+    stats = cache.stats()
+    assert stats.hits == 2
+    assert stats.misses == 3
+
+def test_lru_cache_behind_single_flight():
+    cache = LruCache(max_entries=2)
+    single_flight = SingleFlight()
+    computed_keys = []
+    def get(key: str) -> str:
+        def compute() -> str:
+            computed_keys.append(key)
+            return key.upper()
+        return single_flight.get_or_compute(key, cache=cache, compute=compute)
+
+    assert [get("a"), get("b"), get("a"), get("c"), get("b")] == ["A", "B", "A", "C", "B"]
+    # "b" was the least recently used entry when "c" came in
+    assert computed_keys == ["a", "b", "c", "b"]
+
+def test_tiered_cache():
+    tile = Array5D(np.zeros((64, 64), dtype=np.uint8), axiskeys="yx")
+    shared_l2 = ByteBudgetCache(max_bytes=10 * get_nbytes(tile))
+    process1_cache = TieredCache(l1=ByteBudgetCache(max_bytes=get_nbytes(tile)), l2=shared_l2)
+    process2_cache = TieredCache(l1=ByteBudgetCache(max_bytes=get_nbytes(tile)), l2=shared_l2)
+
+    num_computations = 0
+    def compute() -> Array5D:
+        nonlocal num_computations
+        num_computations += 1
+        return tile
+
+    for cache in (process1_cache, process1_cache, process2_cache, process2_cache):
+        value = cache.get_or_compute(local_key=("some_tile",), make_shared_key=lambda: b"some_tile", compute=compute)
+        assert value is tile
+    assert num_computations == 1
+
+    process2_stats = process2_cache.stats()
+    assert process2_stats["l1"].hits == 1 and process2_stats["l1"].misses == 1
+    assert process2_stats["l2"].hits == 1 # promoted into process2's l1 on its first lookup
+    assert shared_l2.stats().misses == 1
+
+def test_tiered_global_cache_with_in_memory_datasources():
+    # ArrayDataSources can't be described to other processes, so their results are only cached in l1
+    os.environ["TIERED_CACHE_L2"] = "local"
+    impl_path = Path(__file__).parent.parent / "global_cache_impls/tiered_cache/global_cache/__init__.py"
+    spec = importlib.util.spec_from_file_location("tiered_global_cache", impl_path)
+    assert spec is not None and spec.loader is not None
+    tiered_global_cache = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tiered_global_cache)
+
+    num_computations = 0
+    @tiered_global_cache.global_cache
+    def get_some_tile(roi: DataRoi) -> Array5D:
+        nonlocal num_computations
+        num_computations += 1
+        return roi.retrieve()
+
+    data = Array5D(np.arange(20 * 20, dtype=np.uint8).reshape(20, 20), axiskeys="yx")
+    roi = DataRoi(ArrayDataSource(data=data, tile_shape=Shape5D(x=10, y=10)), x=(0, 10), y=(0, 10))
+    for _ in range(2):
+        assert np.all(get_some_tile(roi).raw("yx") == data.raw("yx")[0:10, 0:10])
+    assert num_computations == 1
+
+    stats = tiered_global_cache.get_cache_stats()
+    assert stats["l2"].hits == 0 and stats["l2"].misses == 0
+
+if __name__ == "__main__":
+    test_byte_budget_cache()
+    test_lru_cache_behind_single_flight()
+    test_tiered_cache()
+    test_tiered_global_cache_with_in_memory_datasources()
@@ -0,0 +1,65 @@
+import threading
+
+import numpy as np
+from ndstructs.array5D import Array5D
+from ndstructs.point5D import Point5D
+
+from webilastik.features.feature_extractor import FeatureData
+from webilastik.features.ilp_filter import IlpGaussianSmoothing
+from webilastik.operator import OpRetriever
+from webilastik.utility.cache import decode_cache_value, encode_cache_value, make_stable_cache_key
+from tests import get_sample_c_cells_datasource
+
+
+def test_cache_value_encoding():
+    feature_data = FeatureData(
+        np.random.rand(10, 20, 3).astype(np.float32), axiskeys="yxc", location=Point5D.zero(x=100, y=200)
+    )
+    for compression in ("none", "zlib"):
+        decoded = decode_cache_value(encode_cache_value(feature_data, compression=compression))
+        assert isinstance(decoded, FeatureData)
+        assert decoded == feature_data
+
+    raw_tile = Array5D(np.arange(64 * 64, dtype=np.uint8).reshape(64, 64), axiskeys="yx")
+    decoded_tile = decode_cache_value(encode_cache_value(raw_tile))
+    assert type(decoded_tile) is Array5D
+    assert decoded_tile == raw_tile
+
+    assert decode_cache_value(encode_cache_value({"not": "an array"})) == {"not": "an array"}
+
+def test_stable_cache_keys():
+    datasource = get_sample_c_cells_datasource()
+    tile = next(iter(datasource.roi.get_datasource_tiles()))
+
+    key1 = make_stable_cache_key("some_namespace", (datasource, tile), {})
+    key2 = make_stable_cache_key("some_namespace", (get_sample_c_cells_datasource(), tile), {})
+    assert key1 == key2
+
+    # presmoothers are part of the key, so filters differing only in their preprocessor must not collide
+    key3 = make_stable_cache_key("some_namespace", (IlpGaussianSmoothing(ilp_scale=1.6, axis_2d="z").op, tile), {})
+    key4 = make_stable_cache_key("some_namespace", (IlpGaussianSmoothing(ilp_scale=3.5, axis_2d="z").op, tile), {})
+    assert key3 != key4
+
+def test_stable_cache_keys_reject_unknown_values():
+    try:
+        _ = make_stable_cache_key("some_namespace", (threading.Lock(),), {})
+        assert False, "Locks should not be usable as cache keys"
+    except TypeError:
+        pass
+
+    cyclic_op = OpRetriever()
+    cyclic_op.myself = cyclic_op # type: ignore
+    try:
+        _ = make_stable_cache_key("some_namespace", (cyclic_op,), {})
+        assert False, "Self-referencing operators should not be usable as cache keys"
+    except TypeError:
+        pass
+
+    # the same object showing up twice without a cycle is fine
+    op = OpRetriever()
+    _ = make_stable_cache_key("some_namespace", (op, op, [op]), {})
+
+if __name__ == "__main__":
+    test_cache_value_encoding()
+    test_stable_cache_keys()
+    test_stable_cache_keys_reject_unknown_values()
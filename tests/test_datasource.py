@@ -4,6 +4,8 @@ from typing import Optional, Any, Tuple
 import tempfile
 from pathlib import PurePosixPath
 import pickle
+import threading
+import time
 from PIL import Image as PilImage # pyright: ignore [reportMissingTypeStubs]
 
 import numpy as np
@@ -551,6 +553,30 @@ def test_dzip_datasource():
     assert retrieved_from_ds_url[0].retrieve() == finest_resolution_level_ds.retrieve()
 
 
+class SlowArrayDataSource(ArrayDataSource):
+    max_concurrent_tile_fetches = 3
+
+    def __init__(self, *, data: Array5D, tile_shape: Shape5D):
+        self.lock = threading.Lock()
+        self.num_running_fetches = 0
+        self.max_running_fetches = 0
+        super().__init__(data=data, tile_shape=tile_shape)
+
+    def _get_tile(self, tile: Interval5D) -> Array5D:
+        with self.lock:
+            self.num_running_fetches += 1
+            self.max_running_fetches = max(self.max_running_fetches, self.num_running_fetches)
+        time.sleep(0.05)
+        with self.lock:
+            self.num_running_fetches -= 1
+        return super()._get_tile(tile)
+
+def test_retrieve_fetches_tiles_concurrently():
+    data = Array5D(np.random.rand(90, 90).astype(np.float32), axiskeys="yx")
+    ds = SlowArrayDataSource(data=data, tile_shape=Shape5D(x=30, y=30))
+
+    assert ds.retrieve() == data
+    assert 1 < ds.max_running_fetches <= SlowArrayDataSource.max_concurrent_tile_fetches
 
 
 if __name__ == "__main__":
@@ -1,6 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from typing import Any, Callable
+
 import numpy as np
 from ndstructs.array5D import Array5D
 from global_cache import global_cache
+from webilastik.utility.cache import SingleFlight
 
 def test_global_cache():
     @global_cache
@@ -20,4 +26,49 @@ def test_global_cache():
     x: str = SomeClass().some_method(123)
     y: str = SomeClass().some_method(123)
 
-    assert x == y
\ No newline at end of file
+    assert x == y
+
+def test_global_cache_single_flight():
+    num_computations = 0
+    counter_lock = threading.Lock()
+
+    @global_cache
+    def slow_computation(seed: int) -> Array5D:
+        nonlocal num_computations
+        with counter_lock:
+            num_computations += 1
+        time.sleep(0.5)
+        return Array5D(np.random.rand(5, 5), axiskeys="yx")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(slow_computation, [42] * 8))
+
+    assert num_computations == 1
+    assert all(np.all(r.raw("yx") == results[0].raw("yx")) for r in results)
+
+def test_global_cache_hits_skip_single_flight():
+    @global_cache
+    def make_some_random_array(seed: int) -> Array5D:
+        return Array5D(np.random.rand(5, 5), axiskeys="yx")
+
+    num_single_flight_runs = 0
+    original_run = SingleFlight.run
+    def counting_run(self: SingleFlight, key: Any, compute: Callable[[], Any]) -> Any:
+        nonlocal num_single_flight_runs
+        num_single_flight_runs += 1
+        return original_run(self, key, compute)
+
+    SingleFlight.run = counting_run # type: ignore
+    try:
+        a = make_some_random_array(17)
+        assert num_single_flight_runs == 1
+        b = make_some_random_array(17)
+        assert num_single_flight_runs == 1
+    finally:
+        SingleFlight.run = original_run # type: ignore
+    assert np.all(a.raw("yx") == b.raw("yx"))
+
+if __name__ == "__main__":
+    test_global_cache()
+    test_global_cache_single_flight()
+    test_global_cache_hits_skip_single_flight()
@@ -1,13 +1,23 @@
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 from pathlib import PurePosixPath
-from typing import List, Set
+import io
+import os
+import pickle
+import tempfile
+import threading
+from typing import Any, Callable, List, Set
 
 import h5py
 import numpy as np
+from vigra.learning import RandomForest as VigraRandomForest
 
 import tests
 from webilastik.classic_ilastik.ilp.pixel_classification_ilp import IlpPixelClassificationGroup
-from webilastik.classifiers.pixel_classifier import VigraPixelClassifier
+from webilastik.classifiers.pixel_classifier import (
+    TrainingData, VigraForestH5Bytes, VigraPixelClassifier, h5_bytes_to_vigra_forest, vigra_forest_to_h5_bytes
+)
 from webilastik.datasource import FsDataSource
+from webilastik.features.feature_extractor import FeatureExtractorCollection
 from webilastik.annotations import Color
 from webilastik.features.ilp_filter import (
     IlpFilter,
@@ -81,7 +91,172 @@ def test_pixel_classifier():
     predictions2 = loaded_classifier(datasource.roi)
     assert predictions2 == predictions1
 
+def test_pixel_classifier_computes_only_used_features():
+    feature_extractors: List[IlpFilter] = [
+        extractor_class(ilp_scale=scale, axis_2d="z")
+        for extractor_class in (IlpGaussianSmoothing, IlpGaussianGradientMagnitude, IlpHessianOfGaussianEigenvalues)
+        for scale in [0.7, 1.0, 1.6, 3.5, 5.0, 10.0]
+    ]
+    labels = tests.get_sample_c_cells_pixel_annotations()
+    # few, shallow trees can't possibly look at all the channels
+    classifier = VigraPixelClassifier.train(
+        feature_extractors=feature_extractors,
+        label_classes=[label.annotations for label in labels],
+        num_trees=2,
+        num_forests=1,
+    )
+    if isinstance(classifier, Exception):
+        raise classifier
+    assert classifier.used_feature_channels is not None
+    assert all(0 <= channel < classifier.num_feature_channels for channel in classifier.used_feature_channels)
+
+    datasource = labels[0].annotations[0].raw_data
+    predictions = classifier(datasource.roi)
+
+    # the same forests, fed with all features
+    feature_data = classifier.feature_extractor(datasource.roi)
+    linear_feature_data = feature_data.raw("tzyxc").reshape((-1, feature_data.shape.c))
+    expected = sum(forest.predictProbabilities(linear_feature_data) for forest in classifier.forests) / len(classifier.forests)
+    assert np.allclose(predictions.raw("tzyxc").reshape((-1, predictions.shape.c)), expected, atol=1e-5)
+
+def test_float16_feature_storage_accuracy():
+    feature_extractors: List[IlpFilter] = [
+        extractor_class(ilp_scale=scale, axis_2d="z")
+        for extractor_class in (
+            IlpGaussianSmoothing, IlpLaplacianOfGaussian, IlpGaussianGradientMagnitude, IlpDifferenceOfGaussians,
+            IlpStructureTensorEigenvalues, IlpHessianOfGaussianEigenvalues,
+        )
+        for scale in [0.7, 1.6, 5.0]
+    ]
+    labels = tests.get_sample_c_cells_pixel_annotations()
+    datasource = labels[0].annotations[0].raw_data
+
+    full_precision_features = FeatureExtractorCollection(feature_extractors, storage_dtype=np.dtype("float32"))(datasource.roi)
+    half_precision_features = FeatureExtractorCollection(feature_extractors, storage_dtype=np.dtype("float16"))(datasource.roi)
+    assert half_precision_features.dtype == np.dtype("float16")
+    full_raw = full_precision_features.raw("tzyxc")
+    half_raw = half_precision_features.raw("tzyxc").astype(np.float32)
+    # float16 has an 11 bit significand
+    assert np.all(np.abs(half_raw - full_raw) <= np.abs(full_raw) * 2 ** -11 + 1e-7)
+
+    label_classes = [label.annotations for label in labels]
+    training_data = TrainingData.create(
+        feature_extractors=feature_extractors, label_classes=label_classes, storage_dtype=np.dtype("float16")
+    )
+    assert not isinstance(training_data, Exception)
+    assert training_data.X.dtype == np.dtype("float16")
+
+    full_precision_classifier = VigraPixelClassifier.train(
+        feature_extractors, label_classes, num_trees=20, num_forests=2, storage_dtype=np.dtype("float32")
+    )
+    half_precision_classifier = VigraPixelClassifier.train(
+        feature_extractors, label_classes, num_trees=20, num_forests=2, storage_dtype=np.dtype("float16")
+    )
+    assert not isinstance(full_precision_classifier, Exception)
+    assert not isinstance(half_precision_classifier, Exception)
+    assert half_precision_classifier.feature_extractor.storage_dtype == np.dtype("float16")
+    # classifiers are pickled on their way to the workers
+    assert pickle.loads(pickle.dumps(half_precision_classifier)).storage_dtype == np.dtype("float16")
+
+    full_precision_predictions = full_precision_classifier(datasource.roi)
+    half_precision_predictions = half_precision_classifier(datasource.roi)
+    assert half_precision_predictions.dtype == np.dtype("float32")
+    full_precision_labels = np.argmax(full_precision_predictions.raw("tzyxc"), axis=-1)
+    half_precision_labels = np.argmax(half_precision_predictions.raw("tzyxc"), axis=-1)
+    assert np.mean(full_precision_labels == half_precision_labels) >= 0.95
+
+class ReverseCompletionExecutor(Executor):
+    """Runs each task in its own thread, holding back every task until the ones submitted after it have completed"""
+
+    def __init__(self, num_tasks: int) -> None:
+        self.num_tasks = num_tasks
+        self.completion_order: List[int] = []
+        self._completed = [threading.Event() for _ in range(num_tasks)]
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=num_tasks)
+        self._num_submitted = 0
+        super().__init__()
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> "Future[Any]":
+        with self._lock:
+            task_index = self._num_submitted
+            self._num_submitted += 1
+
+        def held_back() -> Any:
+            result = fn(*args, **kwargs)
+            if task_index + 1 < self.num_tasks:
+                _ = self._completed[task_index + 1].wait()
+            with self._lock:
+                self.completion_order.append(task_index)
+            self._completed[task_index].set()
+            return result
+        return self._pool.submit(held_back)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+def test_training_data_follows_annotation_order():
+    feature_extractors: List[IlpFilter] = [
+        IlpGaussianSmoothing(ilp_scale=1.6, axis_2d="z"),
+        IlpGaussianGradientMagnitude(ilp_scale=1.6, axis_2d="z"),
+    ]
+    label_classes = [label.annotations for label in tests.get_sample_c_cells_pixel_annotations()]
+    labeled_annotations = [
+        (label_index, annotation)
+        for label_index, annotations in enumerate(label_classes, start=1)
+        for annotation in annotations
+    ]
+
+    # computed without going through the feature samples cache
+    combined_extractor = FeatureExtractorCollection(feature_extractors)
+    expected_samples = [annotation._compute_feature_samples(combined_extractor) for _, annotation in labeled_annotations] # pyright: ignore [reportPrivateUsage]
+    expected_X = np.concatenate([samples.X for samples in expected_samples])
+    expected_y = np.concatenate([
+        samples.get_y(label_class=np.uint8(label_index))
+        for (label_index, _), samples in zip(labeled_annotations, expected_samples)
+    ])
+
+    executor = ReverseCompletionExecutor(num_tasks=len(labeled_annotations))
+    training_data = TrainingData.create(feature_extractors=feature_extractors, label_classes=label_classes, executor=executor)
+    executor.shutdown()
+    assert not isinstance(training_data, Exception)
+    assert executor.completion_order == list(reversed(range(len(labeled_annotations))))
+
+    assert np.all(training_data.X == expected_X)
+    assert np.all(training_data.y == expected_y)
+
+    repeated_training_data = TrainingData.create(feature_extractors=feature_extractors, label_classes=label_classes)
+    assert not isinstance(repeated_training_data, Exception)
+    assert np.all(repeated_training_data.X == training_data.X)
+
+def test_vigra_forest_h5_bytes_round_trip():
+    X = np.random.rand(200, 3).astype(np.float32)
+    y = (X[:, 0] > 0.5).astype(np.uint32).reshape(-1, 1)
+    forest = VigraRandomForest(10)
+    _ = forest.learnRF(X, y, 0)
+    expected_probabilities = forest.predictProbabilities(X)
+
+    # forests written straight to an h5 file, as ilastik does, still load
+    tmp_file_handle, tmp_file_path = tempfile.mkstemp(suffix=".h5")
+    os.close(tmp_file_handle)
+    forest.writeHDF5(tmp_file_path, "/")
+    with open(tmp_file_path, "rb") as f:
+        file_bytes = VigraForestH5Bytes(f.read())
+    os.remove(tmp_file_path)
+    assert np.allclose(h5_bytes_to_vigra_forest(file_bytes).predictProbabilities(X), expected_probabilities)
 
+    # and serialized forests are plain h5 files with the same contents
+    h5_bytes = vigra_forest_to_h5_bytes(forest)
+    with h5py.File(io.BytesIO(h5_bytes), "r") as serialized, h5py.File(io.BytesIO(file_bytes), "r") as written:
+        assert set(serialized.keys()) == set(written.keys())
+        for tree_name in (name for name in written.keys() if name.startswith("Tree_")):
+            assert np.all(np.asarray(serialized[tree_name]["topology"]) == np.asarray(written[tree_name]["topology"]))
+    reloaded_forest = h5_bytes_to_vigra_forest(h5_bytes)
+    assert np.allclose(reloaded_forest.predictProbabilities(X), expected_probabilities)
 
 if __name__ == "__main__":
-    test_pixel_classifier()
\ No newline at end of file
+    test_pixel_classifier()
+    test_pixel_classifier_computes_only_used_features()
+    test_float16_feature_storage_accuracy()
+    test_training_data_follows_annotation_order()
+    test_vigra_forest_h5_bytes_round_trip()
@@ -0,0 +1,34 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from webilastik.classifiers.pixel_classifier import h5_bytes_to_vigra_forest, train_forests
+from webilastik.utility.shared_array import SharedArray, SharedArrayHandle
+
+
+def sum_shared_array(handle: SharedArrayHandle) -> float:
+    memory = handle.attach()
+    try:
+        return float(handle.view(memory).sum())
+    finally:
+        memory.close()
+
+def test_shared_array_is_visible_to_worker_processes():
+    arr = np.random.rand(100, 7).astype(np.float32)
+    with SharedArray(arr) as shared, ProcessPoolExecutor(max_workers=2) as executor:
+        sums = list(executor.map(sum_shared_array, [shared.handle] * 4))
+    assert all(np.isclose(s, arr.sum()) for s in sums)
+
+def test_train_forests_in_worker_processes():
+    X = np.concatenate([np.random.rand(50, 3), np.random.rand(50, 3) + 10]).astype(np.float32)
+    y = np.concatenate([np.full((50, 1), 1), np.full((50, 1), 2)]).astype(np.uint32)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        forests_bytes = train_forests(executor=executor, X=X, y=y, random_seeds=[0, 1, 2], trees_per_forest=[4, 3, 3])
+    forests = [h5_bytes_to_vigra_forest(forest_bytes) for forest_bytes in forests_bytes]
+    assert [forest.treeCount() for forest in forests] == [4, 3, 3]
+    for forest in forests:
+        assert np.all(forest.predictLabels(X) == y)
+
+if __name__ == "__main__":
+    test_shared_array_is_visible_to_worker_processes()
+    test_train_forests_in_worker_processes()
@@ -0,0 +1,53 @@
+import time
+
+import numpy as np
+from ndstructs.array5D import Array5D
+from ndstructs.point5D import Shape5D
+
+from webilastik.datasource import DataRoi, get_tile_fetching_limiter
+from webilastik.datasource.array_datasource import ArrayDataSource
+from webilastik.datasource.tile_prefetcher import TilePrefetcher
+
+
+def wait_for_prefetches(prefetcher: TilePrefetcher, num_tiles: int, timeout_s: float = 10):
+    deadline = time.time() + timeout_s
+    while prefetcher.num_prefetched_tiles < num_tiles:
+        assert time.time() < deadline, f"Only prefetched {prefetcher.num_prefetched_tiles} tiles"
+        time.sleep(0.01)
+
+def test_tile_prefetcher_fetches_neighbors():
+    data = Array5D(np.random.rand(30, 30).astype(np.float32), axiskeys="yx")
+    ds = ArrayDataSource(data=data, tile_shape=Shape5D(x=10, y=10))
+    prefetcher = TilePrefetcher()
+
+    prefetcher.notify_request(DataRoi(ds, x=(10, 20), y=(10, 20)))
+    wait_for_prefetches(prefetcher, num_tiles=4)
+
+    # a corner tile has two neighbours, one of which (the one at x=(10, 20)) was already prefetched
+    prefetcher.notify_request(DataRoi(ds, x=(0, 10), y=(0, 10)))
+    wait_for_prefetches(prefetcher, num_tiles=5)
+
+def test_tile_prefetcher_drops_tiles_far_from_recent_requests():
+    data = Array5D(np.random.rand(10, 1000).astype(np.float32), axiskeys="yx")
+    ds = ArrayDataSource(data=data, tile_shape=Shape5D(x=10, y=10))
+    prefetcher = TilePrefetcher(num_recent_requests=1, acquire_timeout_s=0.01)
+
+    # with all fetch slots taken, the neighbour of the first request is still waiting when the second one comes in
+    limiter = get_tile_fetching_limiter(ds)
+    for _ in range(ds.max_concurrent_tile_fetches):
+        _ = limiter.acquire()
+    prefetcher.notify_request(DataRoi(ds, x=(0, 10), y=(0, 10)))
+    time.sleep(0.1)
+    prefetcher.notify_request(DataRoi(ds, x=(500, 510), y=(0, 10)))
+    time.sleep(0.1)
+    for _ in range(ds.max_concurrent_tile_fetches):
+        limiter.release()
+
+    wait_for_prefetches(prefetcher, num_tiles=2)
+    time.sleep(0.2)
+    # the neighbour of the first request is no longer wanted once the only remembered request is far away
+    assert prefetcher.num_prefetched_tiles == 2
+
+if __name__ == "__main__":
+    test_tile_prefetcher_fetches_neighbors()
+    test_tile_prefetcher_drops_tiles_far_from_recent_requests()
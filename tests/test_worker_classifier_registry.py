@@ -0,0 +1,41 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing as mp
+
+from webilastik.classifiers.worker_classifier_registry import WorkerClassifierRegistry, get_num_resident_classifiers
+from webilastik.scheduling import SerialExecutor
+from webilastik.scheduling.affinity_executor import AffinityExecutor
+from tests import get_sample_c_cells_datasource, get_sample_c_cells_pixel_classifier
+
+
+def test_worker_classifier_registry():
+    classifier = get_sample_c_cells_pixel_classifier()
+    datasource = get_sample_c_cells_datasource()
+    tiles = list(datasource.roi.get_datasource_tiles())[:3]
+
+    registry = WorkerClassifierRegistry(executor=SerialExecutor(), max_generations=2)
+    for tile in tiles:
+        predictions = registry.submit(classifier=classifier, generation=1, roi=tile).result()
+        assert predictions == classifier(tile)
+    assert get_num_resident_classifiers() == 1
+
+    _ = registry.submit(classifier=classifier, generation=2, roi=tiles[0]).result()
+    _ = registry.submit(classifier=classifier, generation=3, roi=tiles[0]).result()
+    assert get_num_resident_classifiers() == 2 # generation 1 must have been evicted
+
+    with ProcessPoolExecutor(max_workers=2, mp_context=mp.get_context("spawn")) as executor:
+        process_registry = WorkerClassifierRegistry(executor=executor)
+        for tile in tiles:
+            predictions = process_registry.submit(classifier=classifier, generation=1, roi=tile).result()
+            assert predictions == classifier(tile)
+
+    affinity_executor = AffinityExecutor([ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn")) for _ in range(2)])
+    try:
+        affinity_registry = WorkerClassifierRegistry(executor=affinity_executor)
+        for tile in tiles:
+            predictions = affinity_registry.submit(classifier=classifier, generation=1, roi=tile).result()
+            assert predictions == classifier(tile)
+    finally:
+        affinity_executor.shutdown()
+
+if __name__ == "__main__":
+    test_worker_classifier_registry()
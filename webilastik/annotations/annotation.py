@@ -1,5 +1,6 @@
 from functools import partial
-from typing import List, Sequence, Tuple, Dict, Iterable, Sequence, Any
+from typing import Hashable, List, Sequence, Tuple, Dict, Iterable, Sequence, Any
+import hashlib
 
 import numpy as np
 from ndstructs.point5D import Interval5D, Point5D
@@ -9,8 +10,21 @@ from webilastik.datasource import DataSource, DataRoi, FsDataSource
 from webilastik.features.feature_extractor import FeatureExtractor, FeatureData
 from executor_getter import get_executor
 from webilastik.server.rpc.dto import ColorDto, MessageParsingError, PixelAnnotationDto
+from webilastik.utility import get_env_var_or_exit
+from webilastik.utility.cache import ByteBudgetCache, CacheStats, SingleFlight
 from webilastik.utility.url import Protocol
 
+# Upper bound for the memory taken by the feature samples each process keeps around for retraining
+FEATURE_SAMPLES_CACHE_MAX_BYTES: int = get_env_var_or_exit(
+    var_name="WEBILASTIK_FEATURE_SAMPLES_CACHE_MAX_BYTES", parser=int, default=256 * 1024 * 1024
+)
+
+_feature_samples_cache = ByteBudgetCache(max_bytes=FEATURE_SAMPLES_CACHE_MAX_BYTES)
+_feature_samples_single_flight = SingleFlight()
+
+def get_feature_samples_cache_stats() -> CacheStats:
+    return _feature_samples_cache.stats()
+
 
 class Color:
     def __init__(
@@ -90,7 +104,10 @@ class AnnotationOutOfBounds(Exception):
 
 def _make_samples(data_tile: DataRoi, annotation: "Annotation", feature_extractor: FeatureExtractor) -> FeatureSamples:
     annotation_tile = annotation.clamped(data_tile)
-    feature_tile = feature_extractor(data_tile).cut(annotation_tile.interval, c=All())
+    # features are only needed under the annotation. The extractor still reads whatever halo it needs around
+    # that, so samples are the same as if the whole tile had been computed
+    feature_roi = data_tile.clamped(annotation_tile.interval.updated(c=data_tile.interval.c))
+    feature_tile = feature_extractor(feature_roi).cut(annotation_tile.interval, c=All())
     return FeatureSamples.create(annotation_tile, feature_tile)
 
 class Annotation(ScalarData):
@@ -202,7 +219,21 @@ class Annotation(ScalarData):
         for x, y, z in zip(*self.raw("xyz").nonzero()):
             yield Point5D(x=x, y=y, z=z) + self.location
 
+    def get_snapshot_key(self) -> Hashable:
+        """Identifies the current contents of this annotation, which can still be changed in place (see clear_collision)"""
+        digest = hashlib.blake2b(np.ascontiguousarray(self.raw("tzyx")).tobytes(), digest_size=16).digest()
+        return (self.interval, digest, self.raw_data)
+
     def get_feature_samples(self, feature_extractor: FeatureExtractor) -> FeatureSamples:
+        # cached so that retraining after a new stroke only samples the annotations that are new or have changed.
+        # Annotations changed in place get a new key, and their stale samples are eventually evicted by the byte budget
+        return _feature_samples_single_flight.get_or_compute(
+            (feature_extractor, self.get_snapshot_key()),
+            cache=_feature_samples_cache,
+            compute=lambda: self._compute_feature_samples(feature_extractor),
+        )
+
+    def _compute_feature_samples(self, feature_extractor: FeatureExtractor) -> FeatureSamples:
         interval_under_annotation = self.interval.updated(c=self.raw_data.interval.c)
 
         tile_shape = self.raw_data.tile_shape.updated(c=self.raw_data.shape.c)
@@ -1,7 +1,9 @@
 from abc import abstractmethod
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
 from functools import partial
 from pathlib import Path
-from typing import Any, Final, Iterator, List, Generic, NewType, Sequence, TypeVar
+from typing import Any, Final, Hashable, Iterator, List, Generic, NewType, Optional, Sequence, Set, Tuple, TypeVar
 import tempfile
 import os
 import typing
@@ -9,6 +11,7 @@ import PIL # pyright: ignore [reportMissingTypeStubs]
 import io
 from dataclasses import dataclass
 
+import h5py
 import numpy as np
 from numpy import ndarray, dtype, float32
 from vigra.learning import RandomForest as VigraRandomForest
@@ -16,10 +19,13 @@ from vigra.learning import RandomForest as VigraRandomForest
 from ndstructs.array5D import Array5D
 from ndstructs.point5D import Interval5D, Shape5D
 from webilastik.features.feature_extractor import FeatureExtractor
-from webilastik.features.feature_extractor import FeatureExtractorCollection
-from webilastik.annotations import Annotation, Color
+from webilastik.features.feature_extractor import FEATURE_STORAGE_DTYPE, FeatureExtractorCollection
+from webilastik.features.feature_graph import FeatureGraph
+from webilastik.features.compute_blocks import BlockwiseFeatureExtractor, get_max_halo, make_blockwise
+from webilastik.annotations import Annotation, Color, FeatureSamples
 from webilastik.operator import Operator
 from webilastik.datasource import DataRoi, DataSource
+from webilastik.utility.shared_array import SharedArray, SharedArrayHandle
 from executor_getter import get_executor
 
 class Predictions(Array5D):
@@ -51,6 +57,9 @@ class Predictions(Array5D):
 
 FE = TypeVar("FE", bound=FeatureExtractor, covariant=True)
 
+def _get_feature_samples(annotation: Annotation, feature_extractor: FeatureExtractor) -> FeatureSamples:
+    return annotation.get_feature_samples(feature_extractor)
+
 @typing.final
 @dataclass
 class TrainingData:
@@ -63,7 +72,12 @@ class TrainingData:
 
     @classmethod
     def create(
-        cls, *, feature_extractors: Sequence[FeatureExtractor], label_classes: Sequence[Sequence[Annotation]]
+        cls,
+        *,
+        feature_extractors: Sequence[FeatureExtractor],
+        label_classes: Sequence[Sequence[Annotation]],
+        executor: "Executor | None" = None,
+        storage_dtype: "dtype[Any]" = FEATURE_STORAGE_DTYPE,
     ) -> "TrainingData | ValueError":
         if sum(len(labels) for labels in label_classes) == 0:
             return ValueError("Cannot train classifier with 0 annotations")
@@ -79,17 +93,27 @@ class TrainingData:
         if len(channel_counts) > 1:
             return ValueError(f"All annotations should be on images of same number of channels")
 
-        combined_extractor = FeatureExtractorCollection(feature_extractors)
+        combined_extractor = FeatureExtractorCollection(feature_extractors, storage_dtype=storage_dtype)
+
+        labeled_annotations = [
+            (label_index, annotation)
+            for label_index, labels in enumerate(label_classes, start=1)
+            for annotation in labels
+        ]
+        executor = executor or get_executor(hint="sampling", max_workers=len(labeled_annotations))
+        # map preserves the order of the annotations, so X and y don't depend on which samples finish first
+        feature_samples = list(executor.map(
+            partial(_get_feature_samples, feature_extractor=combined_extractor),
+            [annotation for _, annotation in labeled_annotations],
+        ))
 
         X_parts: List["np.ndarray[Any, np.dtype[Any]]"] = []
         y_parts: List["np.ndarray[Any, np.dtype[np.uint32]]"] = []
-        for label_index, labels in enumerate(label_classes, start=1):
-            for annotation in labels:
-                feature_sample = annotation.get_feature_samples(combined_extractor)
-                X_parts.append(feature_sample.X)
-                y_parts.append(
-                    feature_sample.get_y(label_class=np.uint8(label_index))
-                )
+        for (label_index, _), feature_sample in zip(labeled_annotations, feature_samples):
+            X_parts.append(feature_sample.X)
+            y_parts.append(
+                feature_sample.get_y(label_class=np.uint8(label_index))
+            )
 
         feature_extractors = feature_extractors
         combined_extractor = combined_extractor
@@ -114,9 +138,11 @@ class PixelClassifier(Operator[DataRoi, Predictions], Generic[FE]):
         feature_extractors: Sequence[FE],
         num_classes: int,
         num_input_channels: int,
+        storage_dtype: "dtype[Any]" = FEATURE_STORAGE_DTYPE,
     ):
         self.feature_extractors = feature_extractors
-        self.feature_extractor = FeatureExtractorCollection(feature_extractors)
+        self.storage_dtype = storage_dtype
+        self.feature_extractor = FeatureExtractorCollection(feature_extractors, storage_dtype=storage_dtype)
         self.num_classes = num_classes
         self.classes: Sequence[np.uint8] = [np.uint8(class_index + 1) for class_index in range(num_classes)]
         self.num_input_channels = num_input_channels
@@ -126,6 +152,10 @@ class PixelClassifier(Operator[DataRoi, Predictions], Generic[FE]):
     def _do_predict(self, roi: DataRoi) -> Predictions:
         pass
 
+    def get_affinity_key(self, roi: DataRoi) -> Hashable:
+        """Predictions of rois with the same key share intermediate results when run in the same process"""
+        return roi
+
     def get_expected_roi(self, data_slice: Interval5D) -> Interval5D:
         c_start = data_slice.c[0]
         c_stop = c_start + self.num_classes
@@ -152,31 +182,116 @@ def dump_to_temp_file(contents: bytes) -> Path:
     os.close(tmp_file_handle)
     return Path(tmp_file_path)
 
+@contextmanager
+def _h5_scratch_path(contents: bytes = b"") -> Iterator[str]:
+    """A path to a file with contents for vigra to read or write HDF5 through.
+
+    Vigra only does HDF5 via file paths, so where possible the file is an anonymous in-memory one (from
+    memfd_create, reachable through /proc), sparing the (possibly slow or network-mounted) temp dir.
+    """
+    memfd_create = getattr(os, "memfd_create", None)
+    if memfd_create is None or not os.path.isdir("/proc/self/fd"):
+        tmp_file_path = dump_to_temp_file(contents)
+        try:
+            yield str(tmp_file_path)
+        finally:
+            os.remove(tmp_file_path)
+        return
+    fd: int = memfd_create("vigra_forest.h5")
+    try:
+        num_bytes_written = os.write(fd, contents)
+        assert num_bytes_written == len(contents)
+        yield f"/proc/self/fd/{fd}"
+    finally:
+        os.close(fd)
+
 def vigra_forest_to_h5_bytes(forest: VigraRandomForest) -> VigraForestH5Bytes:
-    tmp_file_handle, tmp_file_path = tempfile.mkstemp(suffix=".h5") # FIXME
-    os.close(tmp_file_handle)
-    forest.writeHDF5(tmp_file_path, f"/")
-    with open(tmp_file_path, "rb") as f:
-        out = VigraForestH5Bytes(f.read())
-    os.remove(tmp_file_path)
-    return out
+    with _h5_scratch_path() as path:
+        forest.writeHDF5(path, f"/")
+        with open(path, "rb") as f:
+            return VigraForestH5Bytes(f.read())
 
 def h5_bytes_to_vigra_forest(h5_bytes: VigraForestH5Bytes) -> VigraRandomForest:
-    tmp_file_path = dump_to_temp_file(h5_bytes)
-    out = VigraRandomForest(str(tmp_file_path), "/")
-    os.remove(tmp_file_path)
-    return out
-
-def _train_forest(random_seed: int, num_trees: int, training_data: TrainingData) -> VigraForestH5Bytes:
+    with _h5_scratch_path(h5_bytes) as path:
+        return VigraRandomForest(path, "/")
+
+# from vigra's rf_nodeproxy.hxx. A tree's topology starts with its feature and class counts, followed by its nodes,
+# each starting with its type. Threshold nodes continue with their parameters address, their two children and their column
+VIGRA_LEAF_NODE_TAG = 0x40000000
+VIGRA_THRESHOLD_NODE = 0
+
+def get_vigra_forest_feature_columns(forest_h5_bytes: VigraForestH5Bytes) -> "Set[int] | Exception":
+    """The feature columns that some split of the forest looks at"""
+    try:
+        with h5py.File(io.BytesIO(forest_h5_bytes), "r") as f:
+            topologies = [np.asarray(item["topology"]) for name, item in f.items() if name.startswith("Tree_")]
+    except Exception as e:
+        return e
+    if len(topologies) == 0:
+        return Exception("Could not find any trees in the forest")
+
+    columns: Set[int] = set()
+    for topology in topologies:
+        num_features = int(topology[0])
+        nodes_to_visit: List[int] = [2]
+        visited_nodes: Set[int] = set()
+        while nodes_to_visit:
+            node_index = nodes_to_visit.pop()
+            if node_index in visited_nodes:
+                continue
+            visited_nodes.add(node_index)
+            if not 2 <= node_index < len(topology):
+                return Exception(f"Bad node index in forest topology: {node_index}")
+            node_type = int(topology[node_index])
+            if node_type & VIGRA_LEAF_NODE_TAG:
+                continue
+            if node_type != VIGRA_THRESHOLD_NODE or node_index + 4 >= len(topology):
+                return Exception(f"Unsupported node type in forest topology: {node_type}")
+            column = int(topology[node_index + 4])
+            if not 0 <= column < num_features:
+                return Exception(f"Bad column in forest topology: {column}")
+            columns.add(column)
+            nodes_to_visit += [int(topology[node_index + 2]), int(topology[node_index + 3])]
+    return columns
+
+def _train_forest(
+    random_seed: int, num_trees: int, X: "ndarray[Any, dtype[float32]]", y: "ndarray[Any, Any]"
+) -> VigraForestH5Bytes:
     # t = time.time()
     forest = VigraRandomForest(num_trees)
-    _ = forest.learnRF(training_data.X, training_data.y, 0)
+    _ = forest.learnRF(X, y, 0)
     # t_trained = time.time()
     serialized = vigra_forest_to_h5_bytes(forest)
     # t_serialized = time.time()
     # print(f"Trained in {t_trained - t}s, serialized in {t_serialized - t_trained}")
     return serialized
 
+def _train_forest_on_shared_arrays(
+    random_seed: int, num_trees: int, X_handle: SharedArrayHandle, y_handle: SharedArrayHandle
+) -> VigraForestH5Bytes:
+    X_memory = X_handle.attach()
+    y_memory = y_handle.attach()
+    try:
+        return _train_forest(random_seed, num_trees, X=X_handle.view(X_memory), y=y_handle.view(y_memory))
+    finally:
+        X_memory.close()
+        y_memory.close()
+
+def train_forests(
+    *, executor: Executor, X: "ndarray[Any, Any]", y: "ndarray[Any, Any]", random_seeds: Sequence[int], trees_per_forest: Sequence[int]
+) -> List[VigraForestH5Bytes]:
+    """Trains a forest for each random seed in parallel, returning them serialized, since vigra forests are not picklable"""
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    if not isinstance(executor, ProcessPoolExecutor):
+        return list(executor.map(partial(_train_forest, X=X, y=y), random_seeds, trees_per_forest))
+    # the workers read X and y from shared memory instead of getting a pickled copy for each forest
+    with SharedArray(X) as shared_X, SharedArray(y) as shared_y:
+        return list(executor.map(
+            partial(_train_forest_on_shared_arrays, X_handle=shared_X.handle, y_handle=shared_y.handle),
+            random_seeds,
+            trees_per_forest,
+        ))
+
 def _compute_partial_predictions(feature_data: "np.ndarray[Any, np.dtype[np.float32]]", forest: VigraRandomForest) -> "np.ndarray[Any, np.dtype[np.float32]]":
     return forest.predictProbabilities(feature_data) * forest.treeCount()
 
@@ -188,15 +303,60 @@ class VigraPixelClassifier(PixelClassifier[FE]):
         forest_h5_bytes: "Sequence[VigraForestH5Bytes]",
         num_input_channels: int,
         num_classes: int,
-        minInputShape: Shape5D
+        minInputShape: Shape5D,
+        storage_dtype: "dtype[Any]" = FEATURE_STORAGE_DTYPE,
     ):
         super().__init__(
-            num_classes=num_classes, feature_extractors=feature_extractors, num_input_channels=num_input_channels
+            num_classes=num_classes,
+            feature_extractors=feature_extractors,
+            num_input_channels=num_input_channels,
+            storage_dtype=storage_dtype,
         )
         self.forest_h5_bytes: Final[Sequence[VigraForestH5Bytes]] = forest_h5_bytes
         self.forests: Final[Sequence[VigraRandomForest]] = [h5_bytes_to_vigra_forest(forest_bytes) for forest_bytes in forest_h5_bytes]
         self.num_trees: Final[int] = sum(f.treeCount() for f in self.forests)
         self.minInputShape = minInputShape
+        self.num_feature_channels: Final[int] = self.forests[0].featureCount()
+
+        used_feature_channels: "Set[int] | None" = set()
+        for forest_bytes in forest_h5_bytes:
+            forest_columns = get_vigra_forest_feature_columns(forest_bytes)
+            if isinstance(forest_columns, Exception):
+                used_feature_channels = None
+                break
+            used_feature_channels.update(forest_columns)
+        # None if it's not known which channels the forests use, in which case all of them are computed
+        self.used_feature_channels: "Final[Set[int] | None]" = used_feature_channels
+        self._features_halo = get_max_halo(feature_extractors)
+        self._used_features: "Final[Tuple[FeatureExtractorCollection, ndarray[Any, Any]] | None]" = self._get_used_features()
+
+    def _get_used_features(self) -> "Tuple[FeatureExtractorCollection, ndarray[Any, Any]] | None":
+        """The extractors producing the channels the forests use and the feature columns they map to, if not all of them"""
+        if self.used_feature_channels is None:
+            return None
+        extractor_columns: List[range] = []
+        channel_offset = 0
+        for extractor in self.feature_extractors:
+            num_channels = FeatureGraph.get_num_channels(extractor, self.num_input_channels)
+            if num_channels is None:
+                return None
+            extractor_columns.append(range(channel_offset, channel_offset + num_channels))
+            channel_offset += num_channels
+        if channel_offset != self.num_feature_channels:
+            return None
+
+        used_indices = [
+            index
+            for index, columns in enumerate(extractor_columns)
+            if any(column in self.used_feature_channels for column in columns)
+        ]
+        if len(used_indices) == len(self.feature_extractors):
+            return None
+        if len(used_indices) == 0: # forests that never split still need some (ignored) features
+            used_indices = [0]
+        used_extractors = [self.feature_extractors[index] for index in used_indices]
+        used_columns = [column for index in used_indices for column in extractor_columns[index]]
+        return FeatureExtractorCollection(used_extractors, storage_dtype=self.storage_dtype), np.asarray(used_columns)
 
     def get_expected_dtype(self, input_dtype: "dtype[Any]") -> "dtype[float32]":
         return np.dtype("float32")
@@ -210,36 +370,75 @@ class VigraPixelClassifier(PixelClassifier[FE]):
         num_trees: int = 100,
         num_forests: int = 8,
         random_seed: int = 0,
+        storage_dtype: "dtype[Any]" = FEATURE_STORAGE_DTYPE,
     ) -> "VigraPixelClassifier[FE] | ValueError":
-        training_data_result = TrainingData.create(feature_extractors=feature_extractors, label_classes=label_classes)
+        training_data_result = TrainingData.create(
+            feature_extractors=feature_extractors, label_classes=label_classes, storage_dtype=storage_dtype
+        )
         if isinstance(training_data_result, Exception):
             return training_data_result
         random_seeds = range(random_seed, random_seed + num_forests)
-        trees_per_forest = ((num_trees // num_forests) + (forest_index < num_trees % num_forests) for forest_index in range(num_forests))
-
-        executor = get_executor(hint="training", max_workers=num_forests)
-        # we're taking the bytes instead of the forest itself because vigra forests are not picklable
-        forests_bytes: Sequence[VigraForestH5Bytes] = list(executor.map(
-            partial(_train_forest, training_data=training_data_result),
-            random_seeds,
-            trees_per_forest
-        ))
+        trees_per_forest = [(num_trees // num_forests) + (forest_index < num_trees % num_forests) for forest_index in range(num_forests)]
+
+        forests_bytes = train_forests(
+            executor=get_executor(hint="training", max_workers=num_forests),
+            X=training_data_result.X,
+            y=training_data_result.y,
+            random_seeds=random_seeds,
+            trees_per_forest=trees_per_forest,
+        )
 
         return cls(
             feature_extractors=feature_extractors,
             forest_h5_bytes=forests_bytes,
             num_input_channels=training_data_result.num_input_channels,
             num_classes=training_data_result.num_classes,
-            minInputShape=Shape5D(c=training_data_result.num_input_channels)
+            minInputShape=Shape5D(c=training_data_result.num_input_channels),
+            storage_dtype=storage_dtype,
         )
 
 
-    def _do_predict(self, roi: DataRoi) -> Predictions:
-        feature_data = self.feature_extractor(roi)
-        linear_feature_data = feature_data.raw("tzyxc").reshape(
-            (feature_data.shape.t * feature_data.shape.volume, feature_data.shape.c)
+    def _get_blockwise_extractor(self, datasource: DataSource) -> FeatureExtractor:
+        """The extractor of the features the forests use, computed over compute blocks planned for datasource"""
+        if self._used_features is None:
+            return make_blockwise(
+                self.feature_extractor,
+                datasource=datasource,
+                halo=self._features_halo,
+                num_feature_channels=self.num_feature_channels,
+            )
+        used_extractor, used_columns = self._used_features
+        return make_blockwise(
+            used_extractor,
+            datasource=datasource,
+            halo=self._features_halo,
+            num_feature_channels=len(used_columns),
         )
 
+    def get_affinity_key(self, roi: DataRoi) -> Hashable:
+        # tiles of the same compute block are best predicted by the process that has the features of that block
+        feature_extractor = self._get_blockwise_extractor(roi.datasource)
+        if isinstance(feature_extractor, BlockwiseFeatureExtractor):
+            return feature_extractor.get_block(roi)
+        return roi
+
+    def _do_predict(self, roi: DataRoi) -> Predictions:
+        # features are computed over compute blocks that are usually larger than the requested tiles, and then cached
+        feature_data = self._get_blockwise_extractor(roi.datasource)(roi)
+        if self._used_features is None:
+            linear_feature_data = feature_data.raw("tzyxc").reshape(
+                (feature_data.shape.t * feature_data.shape.volume, feature_data.shape.c)
+            ).astype(np.float32, copy=False)
+        else:
+            # channels the forests never look at are left as zeros
+            _, used_columns = self._used_features
+            linear_feature_data = np.zeros(
+                (feature_data.shape.t * feature_data.shape.volume, self.num_feature_channels), dtype=np.float32
+            )
+            linear_feature_data[:, used_columns] = feature_data.raw("tzyxc").reshape(
+                (feature_data.shape.t * feature_data.shape.volume, feature_data.shape.c)
+            )
+
         predictions = Array5D.allocate(
             axiskeys="tzyxc",
             interval=self.get_expected_roi(roi),
@@ -273,7 +472,8 @@ class VigraPixelClassifier(PixelClassifier[FE]):
             "num_input_channels": self.num_input_channels,
             "num_classes": self.num_classes,
             "forest_h5_bytes": self.forest_h5_bytes,
-            "minInputShape": self.minInputShape
+            "minInputShape": self.minInputShape,
+            "storage_dtype": self.storage_dtype,
         }
 
     def __setstate__(self, data):
@@ -283,4 +483,5 @@ class VigraPixelClassifier(PixelClassifier[FE]):
             num_input_channels=data["num_input_channels"],
             num_classes=data["num_classes"],
             minInputShape=data["minInputShape"],
+            storage_dtype=data["storage_dtype"],
         )
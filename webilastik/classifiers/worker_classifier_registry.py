@@ -0,0 +1,109 @@
+# pyright: strict
+
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Executor, Future
+import threading
+import uuid
+from typing import Any, Tuple
+
+from webilastik.classifiers.pixel_classifier import PixelClassifier, Predictions
+from webilastik.datasource import DataRoi
+from webilastik.datasource.tile_prefetcher import get_tile_prefetcher
+from webilastik.scheduling.affinity_executor import submit_with_affinity
+
+
+# (registry_id, generation)
+_ResidentKey = Tuple[str, int]
+
+class ClassifierNotResident(Exception):
+    pass
+
+# These live in each worker process. With a process pool, every worker gets its own copy of the classifier
+# the first time it sees a new generation and keeps it until a newer generation pushes it out
+_resident_classifiers_lock = threading.Lock()
+_resident_classifiers: "OrderedDict[_ResidentKey, PixelClassifier[Any]]" = OrderedDict()
+
+def _make_resident(*, registry_id: str, generation: int, classifier: "PixelClassifier[Any]", max_generations: int) -> None:
+    with _resident_classifiers_lock:
+        _resident_classifiers[(registry_id, generation)] = classifier
+        generations = sorted(gen for (reg_id, gen) in _resident_classifiers.keys() if reg_id == registry_id)
+        for stale_generation in generations[:-max_generations]:
+            del _resident_classifiers[(registry_id, stale_generation)]
+
+def _predict(classifier: "PixelClassifier[Any]", roi: DataRoi) -> Predictions:
+    tile_prefetcher = get_tile_prefetcher()
+    if tile_prefetcher is not None:
+        tile_prefetcher.notify_request(roi)
+    return classifier(roi)
+
+def _predict_with_resident_classifier(registry_id: str, generation: int, roi: DataRoi) -> "Predictions | ClassifierNotResident":
+    with _resident_classifiers_lock:
+        classifier = _resident_classifiers.get((registry_id, generation))
+    if classifier is None:
+        return ClassifierNotResident(f"Generation {generation} of registry {registry_id} is not resident in this worker")
+    return _predict(classifier, roi)
+
+def _make_resident_and_predict(
+    registry_id: str, generation: int, roi: DataRoi, classifier: "PixelClassifier[Any]", max_generations: int
+) -> Predictions:
+    _make_resident(registry_id=registry_id, generation=generation, classifier=classifier, max_generations=max_generations)
+    return _predict(classifier, roi)
+
+def get_num_resident_classifiers() -> int:
+    with _resident_classifiers_lock:
+        return len(_resident_classifiers)
+
+
+class WorkerClassifierRegistry:
+    """Keeps classifiers resident in the workers of an executor so that tile requests only ship (generation, roi).
+
+    Executors can't address individual workers, so classifiers are shipped lazily: a worker that doesn't have
+    the requested generation yet reports so, and the tile is resubmitted along with the classifier itself.
+    Each worker therefore deserializes a classifier at most once per generation. With an AffinityExecutor, tiles
+    with the same affinity key (see PixelClassifier.get_affinity_key) always go to the same worker."""
+
+    def __init__(self, executor: Executor, max_generations: int = 2) -> None:
+        self.executor = executor
+        self.max_generations = max_generations
+        self.registry_id = str(uuid.uuid4())
+        super().__init__()
+
+    def submit(self, *, classifier: "PixelClassifier[Any]", generation: int, roi: DataRoi) -> "Future[Predictions]":
+        affinity_key = classifier.get_affinity_key(roi)
+        out: "Future[Predictions]" = Future()
+        _ = out.set_running_or_notify_cancel()
+
+        def forward_result(fut: "Future[Predictions]"):
+            if fut.cancelled():
+                out.set_exception(CancelledError())
+                return
+            exception = fut.exception()
+            if exception is not None:
+                out.set_exception(exception)
+                return
+            out.set_result(fut.result())
+
+        def on_resident_prediction_done(fut: "Future[Predictions | ClassifierNotResident]"):
+            if fut.cancelled():
+                out.set_exception(CancelledError())
+                return
+            exception = fut.exception()
+            if exception is not None:
+                out.set_exception(exception)
+                return
+            result = fut.result()
+            if not isinstance(result, ClassifierNotResident):
+                out.set_result(result)
+                return
+            try:
+                retry_future = submit_with_affinity(
+                    self.executor, affinity_key, _make_resident_and_predict, self.registry_id, generation, roi, classifier, self.max_generations
+                )
+            except Exception as e:
+                out.set_exception(e)
+                return
+            retry_future.add_done_callback(forward_result)
+
+        resident_future = submit_with_affinity(self.executor, affinity_key, _predict_with_resident_classifier, self.registry_id, generation, roi)
+        resident_future.add_done_callback(on_resident_prediction_done)
+        return out
@@ -4,8 +4,10 @@ import enum
 from abc import abstractmethod, ABC
 from enum import IntEnum
 from pathlib import PurePosixPath
-from typing import Any, ClassVar, Optional, Tuple, Union, Iterator, Dict, Sequence
+from typing import Any, Callable, ClassVar, List, Optional, Tuple, Union, Iterator, Dict, Sequence
 from typing_extensions import Final
+import threading
+import weakref
 
 import numpy as np
 
@@ -15,6 +17,7 @@ from webilastik.filesystem import IFilesystem
 from webilastik.server.rpc.dto import FsDataSourceDto, N5DataSourceDto, PrecomputedChunksDataSourceDto, SkimageDataSourceDto
 from webilastik.utility.url import Url
 from webilastik.utility.url import Url, Protocol
+from webilastik.utility.io_pool import io_map
 from global_cache import global_cache
 
 
@@ -27,7 +30,22 @@ def guess_axiskeys(raw_shape: Tuple[int, ...]) -> str:
     return guesses[len(raw_shape)]
 
 
+_tile_fetching_limiters_lock = threading.Lock()
+_tile_fetching_limiters: "weakref.WeakKeyDictionary[DataSource, threading.BoundedSemaphore]" = weakref.WeakKeyDictionary()
+
+def get_tile_fetching_limiter(datasource: "DataSource") -> threading.BoundedSemaphore:
+    # kept out of the datasource itself so that datasources stay picklable
+    with _tile_fetching_limiters_lock:
+        limiter = _tile_fetching_limiters.get(datasource)
+        if limiter is None:
+            limiter = _tile_fetching_limiters[datasource] = threading.BoundedSemaphore(datasource.max_concurrent_tile_fetches)
+        return limiter
+
+
 class DataSource(ABC):
+    # how many tiles of the same datasource can be fetched at the same time, across all requests of this process
+    max_concurrent_tile_fetches: ClassVar[int] = 8
+
     tile_shape: Final[Shape5D]
     dtype: "Final[np.dtype[Any]]" #FIXME
     interval: Final[Interval5D]
@@ -81,6 +99,18 @@ class DataSource(ABC):
     def _get_tile(self, tile: Interval5D) -> Array5D:
         pass
 
+    def get_tiles(self, tiles: Sequence[Interval5D]) -> Sequence[Array5D]:
+        """Gets many tiles, fetching the ones that are not cached concurrently"""
+        limiter = get_tile_fetching_limiter(self)
+        # some global_cache implementations can look up many calls at once (e.g. with a single redis MGET)
+        get_many = getattr(type(self).get_tile, "get_many", None)
+        if get_many is None:
+            return io_map(self.get_tile, tiles, limiter=limiter)
+
+        def run_all(computations: Sequence[Callable[[], Array5D]]) -> List[Array5D]:
+            return io_map(lambda compute: compute(), computations, limiter=limiter)
+        return get_many([(self, tile) for tile in tiles], run_all=run_all)
+
     def close(self) -> None:
         pass
 
@@ -107,8 +137,8 @@ class DataSource(ABC):
             c=self.interval.c if isinstance(c, All) else c,
         )
         out = self._allocate(interval, fill_value=0, axiskeys_hint=axiskeys_hint)
-        for tile in self.roi.clamped(interval).get_datasource_tiles(clamp_to_datasource=True):
-            tile_data = self.get_tile(tile)
+        tiles = list(self.roi.clamped(interval).get_datasource_tiles(clamp_to_datasource=True))
+        for tile_data in self.get_tiles(tiles):
             out.set(tile_data, autocrop=True)
         out.setflags(write=False)
         return out
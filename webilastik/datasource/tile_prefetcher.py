@@ -0,0 +1,127 @@
+# pyright: strict
+
+from collections import deque
+from typing import Deque, Optional
+import threading
+
+from ndstructs.point5D import Point5D
+
+from webilastik.datasource import DataRoi, get_tile_fetching_limiter
+from webilastik.utility import Empty, get_env_var_or_exit, parse_bool
+from webilastik.utility.log import Logger
+
+logger = Logger()
+
+
+class TilePrefetcher:
+    """Warms the tile cache with the storage tiles neighbouring recently requested ROIs.
+
+    Neighbours of the newest requests are fetched first, one tile at a time, and only while the datasource has
+    spare fetch slots, so that real requests always take precedence. Queued tiles that are no longer near any
+    of the last few requests are dropped without being fetched.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_queued_tiles: int = 64,
+        num_recent_requests: int = 4,
+        acquire_timeout_s: float = 0.1,
+    ) -> None:
+        self.acquire_timeout_s = acquire_timeout_s
+        self._lock = threading.Lock()
+        self._has_work = threading.Condition(self._lock)
+        self._queue: Deque[DataRoi] = deque(maxlen=max_queued_tiles)
+        self._recent_requests: Deque[DataRoi] = deque(maxlen=num_recent_requests)
+        self._num_prefetched_tiles = 0
+        self._thread: Optional[threading.Thread] = None
+        super().__init__()
+
+    @property
+    def num_prefetched_tiles(self) -> int:
+        with self._lock:
+            return self._num_prefetched_tiles
+
+    def _is_wanted(self, tile: DataRoi) -> bool:
+        for request in self._recent_requests:
+            if request.datasource != tile.datasource:
+                continue
+            tile_shape = request.tile_shape
+            # requests are not necessarily aligned to the storage tiles, so neighbours can be up to two tiles away
+            vicinity = request.interval.enlarged(radius=Point5D.zero(x=2 * tile_shape.x, y=2 * tile_shape.y, z=2 * tile_shape.z))
+            if vicinity.contains(tile.interval):
+                return True
+        return False
+
+    def notify_request(self, roi: DataRoi) -> None:
+        requested_tiles = set(roi.get_datasource_tiles())
+        neighbors = [
+            neighbor
+            for tile in requested_tiles
+            for neighbor in tile.get_neighboring_tiles(tile_shape=roi.tile_shape)
+            if neighbor not in requested_tiles
+        ]
+        with self._lock:
+            self._recent_requests.append(roi)
+            still_wanted = [tile for tile in self._queue if self._is_wanted(tile) and tile not in requested_tiles]
+            self._queue.clear()
+            self._queue.extend(still_wanted)
+            for neighbor in neighbors:
+                if neighbor not in self._queue:
+                    self._queue.appendleft(neighbor) # newest first; the oldest tiles fall off the end of the queue
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tile_prefetcher", daemon=True)
+                self._thread.start()
+            self._has_work.notify()
+
+    def _pop_wanted_tile(self) -> DataRoi:
+        with self._has_work:
+            while True:
+                while len(self._queue) == 0:
+                    _ = self._has_work.wait()
+                tile = self._queue.popleft()
+                if self._is_wanted(tile):
+                    return tile
+
+    def _acquire_fetch_slot(self, tile: DataRoi, limiter: threading.BoundedSemaphore) -> bool:
+        """Waits for a spare fetch slot, giving up as soon as tile is no longer wanted"""
+        while not limiter.acquire(timeout=self.acquire_timeout_s):
+            with self._lock:
+                if not self._is_wanted(tile):
+                    return False
+        return True
+
+    def _run(self) -> None:
+        while True:
+            tile = self._pop_wanted_tile()
+            limiter = get_tile_fetching_limiter(tile.datasource)
+            if not self._acquire_fetch_slot(tile, limiter):
+                continue
+            try:
+                with self._lock:
+                    if not self._is_wanted(tile):
+                        continue
+                _ = tile.datasource.get_tile(tile)
+                with self._lock:
+                    self._num_prefetched_tiles += 1
+            except Exception as e:
+                logger.debug(f"Prefetching {tile} failed: {e}")
+            finally:
+                limiter.release()
+
+
+_tile_prefetcher_lock = threading.Lock()
+_tile_prefetcher: "TilePrefetcher | None | Empty" = Empty()
+
+def get_tile_prefetcher() -> Optional[TilePrefetcher]:
+    """The prefetcher of this process, or None if prefetching was not enabled via WEBILASTIK_TILE_PREFETCHING"""
+    global _tile_prefetcher
+    with _tile_prefetcher_lock:
+        if isinstance(_tile_prefetcher, Empty):
+            if get_env_var_or_exit(var_name="WEBILASTIK_TILE_PREFETCHING", parser=parse_bool, default=False):
+                _tile_prefetcher = TilePrefetcher(
+                    max_queued_tiles=get_env_var_or_exit(var_name="WEBILASTIK_TILE_PREFETCHING_MAX_QUEUED_TILES", parser=int, default=64),
+                )
+            else:
+                _tile_prefetcher = None
+        return _tile_prefetcher
@@ -1,20 +1,27 @@
 from abc import abstractmethod
-from typing import Any, Literal, Optional, TypeVar, Type, List
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Literal, Optional, Sequence, TypeVar, Type, List
 import fastfilters #type: ignore
 import math
+import os
+import threading
 
 import numpy
 from numpy import ndarray, float32, dtype
 from ndstructs.array5D import All, Array5D
 from ndstructs.utils.json_serializable import JsonObject, JsonValue, ensureJsonObject, ensureJsonString, ensureJsonFloat
-from ndstructs.point5D import Point5D, Shape5D
+from ndstructs.point5D import Interval5D, Point5D, Shape5D
 
 from .feature_extractor import FeatureData, FeatureExtractor, JsonableFeatureExtractor
+from . import fft_filters
 from webilastik.datasource import DataSource, DataRoi
 from webilastik.operator import Operator, OpRetriever
 from global_cache import global_cache
+from webilastik.utility import get_env_var_or_exit
 
 Axis2D = Literal["x", "y", "z"]
+FilterFn = Callable[["ndarray[Any, dtype[float32]]"], "ndarray[Any, dtype[float32]]"]
 
 def get_axis_2d(data: JsonValue) -> Optional[Axis2D]:
     axis_2d = ensureJsonString(data)
@@ -25,6 +32,73 @@ def get_axis_2d(data: JsonValue) -> Optional[Axis2D]:
 
 WINDOW_SIZE = 3.5
 
+def get_kernel_radius(sigma: float, window_size: float = 0) -> int:
+    """How far, in pixels, a gaussian kernel of this sigma reaches. A window_size of 0 means WINDOW_SIZE"""
+    return math.ceil(sigma * (window_size or WINDOW_SIZE))
+
+# Filters whose smallest sigma is at least APPROXIMATION_MIN_SIGMA (0 means never) are approximated by filtering a
+# block-averaged version of their input at around APPROXIMATION_TARGET_SIGMA and interpolating the result back
+# to full resolution. Only smoothing filters (derivative_order 0) are approximated, for which the maximum absolute
+# difference to the exact result stays under APPROXIMATION_TOLERANCE times the dynamic range of the input. Blocks
+# are aligned to absolute pixel coordinates, so adjacent tiles average the same pixels and agree at their seams.
+APPROXIMATION_MIN_SIGMA: float = get_env_var_or_exit(
+    var_name="WEBILASTIK_FILTER_APPROXIMATION_MIN_SIGMA", parser=float, default=0.0
+)
+APPROXIMATION_TARGET_SIGMA = 2.0
+APPROXIMATION_TOLERANCE = 0.02
+
+# Filters whose kernels are at least FFT_MIN_KERNEL_WIDTH pixels wide (0 means never) are computed via FFT, whose
+# cost doesn't grow with the width of the kernels. benchmarks/fft_filters_benchmark.py finds the crossover point.
+FFT_MIN_KERNEL_WIDTH: int = get_env_var_or_exit(var_name="WEBILASTIK_FFT_MIN_KERNEL_WIDTH", parser=int, default=0)
+
+# fastfilters releases the GIL, so the 2D slices, channels and time points of an ROI are filtered in parallel by
+# a pool shared by all filters of the process. Its size is the thread budget on top of the threads (or processes)
+# of the feature extraction executor; 1 filters all slices serially in the calling thread.
+FILTER_SLICE_THREADS: int = get_env_var_or_exit(
+    var_name="WEBILASTIK_FILTER_SLICE_THREADS", parser=int, default=min(4, os.cpu_count() or 1)
+)
+
+_slice_executor_lock = threading.Lock()
+_slice_executor: Optional[ThreadPoolExecutor] = None
+
+def _get_slice_executor() -> ThreadPoolExecutor:
+    global _slice_executor
+    with _slice_executor_lock:
+        if _slice_executor is None:
+            _slice_executor = ThreadPoolExecutor(max_workers=FILTER_SLICE_THREADS, thread_name_prefix="filter_slice_")
+        return _slice_executor
+
+def get_downsampled_sigma(sigma: float, factor: int) -> float:
+    """The sigma that, applied after averaging blocks of factor pixels, approximates sigma at full resolution"""
+    # averaging factor pixels already smooths with a variance of (factor^2 - 1) / 12
+    return math.sqrt(max(sigma ** 2 - (factor ** 2 - 1) / 12, 0.25)) / factor
+
+def _downsample(data: "ndarray[Any, dtype[float32]]", factor: int, origin: Sequence[int]) -> "ndarray[Any, dtype[float32]]":
+    """Averages the blocks of factor pixels of data, whose first pixel is at origin, starting at multiples of factor"""
+    padding = [(start % factor, -(start % factor + size) % factor) for start, size in zip(origin, data.shape)]
+    padded = numpy.pad(data, padding, mode="edge")
+    blocks_shape: List[int] = []
+    for size in padded.shape:
+        blocks_shape += [size // factor, factor]
+    return padded.reshape(blocks_shape).mean(axis=tuple(range(1, len(blocks_shape), 2)), dtype=numpy.float32)
+
+def _upsample(
+    data: "ndarray[Any, dtype[float32]]", factor: int, shape: "tuple[int, ...]", origin: Sequence[int]
+) -> "ndarray[Any, dtype[float32]]":
+    """Linearly interpolates the first len(shape) axes of data, downsampled with _downsample, back to shape"""
+    out = data
+    for axis, (size, start) in enumerate(zip(shape, origin)):
+        # each downsampled pixel sits at the center of the block of factor pixels it was averaged from
+        positions = (numpy.arange(size, dtype=numpy.float32) + start % factor - (factor - 1) / 2) / factor
+        positions = numpy.clip(positions, 0, out.shape[axis] - 1)
+        lower = numpy.floor(positions).astype(numpy.int64)
+        upper = numpy.minimum(lower + 1, out.shape[axis] - 1)
+        weights_shape = [1] * out.ndim
+        weights_shape[axis] = size
+        weights = (positions - lower).reshape(weights_shape)
+        out = numpy.take(out, lower, axis=axis) * (1 - weights) + numpy.take(out, upper, axis=axis) * weights
+    return out.astype(numpy.float32, copy=False)
+
 class PresmoothedFilter(FeatureExtractor):
     def __init__(
         self,
@@ -34,17 +108,23 @@ class PresmoothedFilter(FeatureExtractor):
         preprocessor: Operator[DataRoi, Array5D] = OpRetriever(axiskeys_hint="ctzyx"),
     ):
         self.ilp_scale = ilp_scale
+        # the presmoothed data is differentiated by most ops, which would amplify the interpolation error of an
+        # approximated presmoother way past APPROXIMATION_TOLERANCE, so it is always computed exactly
         self.presmoother = GaussianSmoothing(
             preprocessor=preprocessor,
             axis_2d=axis_2d,
             window_size=WINDOW_SIZE,
             sigma=math.sqrt(ilp_scale ** 2 - 1.0) if ilp_scale > 1.0 else ilp_scale,
+            approximable=False,
         )
         self.ilp_scale = ilp_scale
         self.axis_2d: Optional[Axis2D] = axis_2d
         super().__init__()
 
 class ChannelwiseFastFilter(JsonableFeatureExtractor):
+    # how many derivatives the filter takes, i.e. by which power of the pixel size its output scales
+    derivative_order: int = 0
+
     def __init__(
         self,
         *,
@@ -70,14 +150,55 @@ class ChannelwiseFastFilter(JsonableFeatureExtractor):
     def channel_multiplier(self) -> int:
         pass
 
+    @property
+    @abstractmethod
+    def min_sigma(self) -> float:
+        pass
+
+    @abstractmethod
+    def downsampled(self, factor: int) -> "ChannelwiseFastFilter":
+        """A version of this filter to be applied to its input after averaging blocks of factor pixels"""
+        pass
+
+    def get_fft_filter_fn(self) -> Optional[FilterFn]:
+        """Same as filter_fn, but convolving via FFT, or None for filters without an FFT implementation"""
+        return None
+
+    @property
+    def kernel_width(self) -> int:
+        return 2 * self.halo_radius + 1
+
+    def uses_fft(self, fft_min_kernel_width: int) -> bool:
+        if fft_min_kernel_width <= 0 or self.kernel_width < fft_min_kernel_width:
+            return False
+        return self.get_fft_filter_fn() is not None
+
+    def get_approximation_factor(self, approximation_min_sigma: float) -> int:
+        if approximation_min_sigma <= 0 or self.derivative_order > 0 or self.min_sigma < approximation_min_sigma:
+            return 1
+        return max(1, math.floor(self.min_sigma / APPROXIMATION_TARGET_SIGMA))
+
+    def approximate_filter_fn(
+        self, source_raw: "ndarray[Any, dtype[float32]]", factor: int, origin: Sequence[int]
+    ) -> "ndarray[Any, dtype[float32]]":
+        """filter_fn approximated at a resolution factor times lower. origin is the position of the first pixel of source_raw"""
+        raw_feature_data = self.downsampled(factor).filter_fn(_downsample(source_raw, factor, origin))
+        return _upsample(raw_feature_data, factor, source_raw.shape, origin)
+
     def __repr__(self):
         props = " ".join(f"{k}={v}" for k, v in self.__dict__.items())
         return f"<{self.__class__.__name__} {props}>"
 
+    @property
+    @abstractmethod
+    def halo_radius(self) -> int:
+        """How many pixels around each output pixel are needed to compute it"""
+        pass
+
     @property
     def halo(self) -> Point5D:
-        # FIXME: Add appropriate halo property to filters
-        args = {"x": 30, "y": 30, "z": 30, "c": 0}
+        radius = self.halo_radius
+        args = {"x": radius, "y": radius, "z": radius, "c": 0}
         if self.axis_2d:
             args[self.axis_2d] = 0
         return Point5D(**args)
@@ -88,8 +209,34 @@ class ChannelwiseFastFilter(JsonableFeatureExtractor):
     @global_cache
     def __call__(self, roi: DataRoi) -> FeatureData:
         haloed_roi = roi.enlarged(self.halo)
-        source_data = self.preprocessor(haloed_roi)
+        return self.compute_from_source(source_data=self.preprocessor(haloed_roi), roi=roi)
+
+    def get_features_interval(self, roi: Interval5D) -> Interval5D:
+        return roi.updated(c=(roi.c[0] * self.channel_multiplier, roi.c[1] * self.channel_multiplier))
 
+    def compute_from_source(
+        self,
+        *,
+        source_data: Array5D,
+        roi: Interval5D,
+        out: Optional[Array5D] = None,
+        approximation_min_sigma: float = APPROXIMATION_MIN_SIGMA,
+        fft_min_kernel_width: int = FFT_MIN_KERNEL_WIDTH,
+    ) -> FeatureData:
+        """Computes the features of roi out of the output of self.preprocessor, which must cover roi enlarged by self.halo
+
+        If out is given, the features are written straight into it instead of into a newly allocated array. It must
+        be a float32 array over get_features_interval(roi), and the returned FeatureData is a view of it.
+        """
+        approximation_factor = self.get_approximation_factor(approximation_min_sigma)
+        fft_filter_fn = self.get_fft_filter_fn() if self.uses_fft(fft_min_kernel_width) else None
+        filter_fn = self.filter_fn if fft_filter_fn is None else fft_filter_fn
+        if source_data.dtype != numpy.dtype("float32"):
+            source_data = Array5D(
+                source_data.raw(source_data.axiskeys).astype(numpy.float32),
+                axiskeys=source_data.axiskeys,
+                location=source_data.location,
+            )
         step_shape: Shape5D = Shape5D(
             c=1,
             t=1,
@@ -98,29 +245,46 @@ class ChannelwiseFastFilter(JsonableFeatureExtractor):
             z= 1 if self.axis_2d == "z" else source_data.shape.z,
         )
 
-        out = Array5D.allocate(
-            interval=roi.updated(
-                c=(roi.c[0] * self.channel_multiplier, roi.c[1] * self.channel_multiplier)
-            ),
-            dtype=numpy.dtype("float32"),
-            axiskeys=source_data.axiskeys.replace("c", "") + "c" # fastfilters puts channel last
-        )
+        owns_out = out is None
+        if out is None:
+            out = Array5D.allocate(
+                interval=self.get_features_interval(roi),
+                dtype=numpy.dtype("float32"),
+                axiskeys=source_data.axiskeys.replace("c", "") + "c" # fastfilters puts channel last
+            )
+        else:
+            assert out.dtype == numpy.dtype("float32") and out.interval == self.get_features_interval(roi)
 
-        for data_slice in source_data.split(step_shape):
-            source_axes = "zyx"
-            if self.axis_2d:
-                source_axes = source_axes.replace(self.axis_2d, "")
+        source_axes = "zyx"
+        if self.axis_2d:
+            source_axes = source_axes.replace(self.axis_2d, "")
 
-            raw_data: "ndarray[Any, dtype[float32]]" = data_slice.raw(source_axes).astype(numpy.float32)
-            raw_feature_data: "ndarray[Any, dtype[float32]]" = self.filter_fn(raw_data)
+        def filter_slice(out: Array5D, data_slice: Array5D) -> None:
+            raw_data: "ndarray[Any, dtype[float32]]" = numpy.ascontiguousarray(data_slice.raw(source_axes))
+            raw_feature_data: "ndarray[Any, dtype[float32]]"
+            if approximation_factor > 1:
+                origin = [data_slice.location[axis] for axis in source_axes]
+                raw_feature_data = self.approximate_filter_fn(raw_data, approximation_factor, origin)
+            else:
+                raw_feature_data = filter_fn(raw_data)
 
             feature_data = FeatureData(
                 raw_feature_data,
                 axiskeys=source_axes + "c" if len(raw_feature_data.shape) > len(source_axes) else source_axes,
                 location=data_slice.location.updated(c=data_slice.location.c * self.channel_multiplier)
             )
+            # slices never overlap, so they can be written concurrently
             out.set(feature_data, autocrop=True)
-        out.setflags(write=False)
+
+        data_slices = list(source_data.split(step_shape))
+        if FILTER_SLICE_THREADS <= 1 or len(data_slices) <= 1:
+            for data_slice in data_slices:
+                filter_slice(out, data_slice)
+        else:
+            # consuming the results re-raises any exception from the workers
+            _ = list(_get_slice_executor().map(partial(filter_slice, out), data_slices))
+        if owns_out:
+            out.setflags(write=False)
         return FeatureData(
             out.raw(out.axiskeys),
             axiskeys=out.axiskeys,
@@ -129,6 +293,8 @@ class ChannelwiseFastFilter(JsonableFeatureExtractor):
 
 
 class StructureTensorEigenvalues(ChannelwiseFastFilter):
+    derivative_order = 2 # products of first derivatives
+
     def __init__(
         self,
         *,
@@ -170,6 +336,24 @@ class StructureTensorEigenvalues(ChannelwiseFastFilter):
     def channel_multiplier(self) -> int:
         return 2 if self.axis_2d else 3
 
+    @property
+    def min_sigma(self) -> float:
+        return min(self.innerScale, self.outerScale)
+
+    def downsampled(self, factor: int) -> "StructureTensorEigenvalues":
+        return StructureTensorEigenvalues(
+            preprocessor=self.preprocessor,
+            innerScale=get_downsampled_sigma(self.innerScale, factor),
+            outerScale=self.outerScale / factor, # applied to the gradients, after the block averaging
+            window_size=self.window_size,
+            axis_2d=self.axis_2d,
+        )
+
+    @property
+    def halo_radius(self) -> int:
+        # gradients at innerScale (one extra pixel for the derivative), then smoothed at outerScale
+        return get_kernel_radius(self.innerScale, self.window_size) + 1 + get_kernel_radius(self.outerScale, self.window_size)
+
     @classmethod
     def from_ilp_scale(
         cls, *, preprocessor: Operator[DataRoi, Array5D] = OpRetriever(axiskeys_hint="ctzyx"), scale: float, axis_2d: Optional[Axis2D]
@@ -215,6 +399,18 @@ class SigmaWindowFilter(ChannelwiseFastFilter):
             "window_size": self.window_size,
         }
 
+    @property
+    def min_sigma(self) -> float:
+        return self.sigma
+
+    def downsampled(self: SIGMA_FILTER, factor: int) -> SIGMA_FILTER:
+        return self.__class__(
+            preprocessor=self.preprocessor,
+            sigma=get_downsampled_sigma(self.sigma, factor),
+            window_size=self.window_size,
+            axis_2d=self.axis_2d,
+        )
+
     @classmethod
     def from_ilp_scale(
         cls: Type[SIGMA_FILTER],
@@ -231,21 +427,54 @@ class SigmaWindowFilter(ChannelwiseFastFilter):
 
 
 class GaussianGradientMagnitude(SigmaWindowFilter):
+    derivative_order = 1
+
     def filter_fn(self, source_raw: "ndarray[Any, dtype[float32]]") -> "ndarray[Any, dtype[float32]]":
         return fastfilters.gaussianGradientMagnitude(source_raw, sigma=self.sigma, window_size=self.window_size)
 
+    def get_fft_filter_fn(self) -> Optional[FilterFn]:
+        return partial(fft_filters.gaussian_gradient_magnitude, sigma=self.sigma, window_size=self.window_size or WINDOW_SIZE)
+
     @property
     def channel_multiplier(self) -> int:
         return 1
 
+    @property
+    def halo_radius(self) -> int:
+        return get_kernel_radius(self.sigma, self.window_size) + 1
+
 class GaussianSmoothing(SigmaWindowFilter):
+    def __init__(
+        self,
+        *,
+        preprocessor: Operator[DataRoi, Array5D] = OpRetriever(axiskeys_hint="ctzyx"),
+        sigma: float,
+        window_size: float = 0,
+        axis_2d: Optional[Axis2D],
+        approximable: bool = True,
+    ):
+        super().__init__(preprocessor=preprocessor, sigma=sigma, window_size=window_size, axis_2d=axis_2d)
+        self.approximable = approximable
+
+    def get_approximation_factor(self, approximation_min_sigma: float) -> int:
+        if not self.approximable:
+            return 1
+        return super().get_approximation_factor(approximation_min_sigma)
+
     def filter_fn(self, source_raw: "ndarray[Any, dtype[float32]]") -> "ndarray[Any, dtype[float32]]":
         return fastfilters.gaussianSmoothing(source_raw, sigma=self.sigma, window_size=self.window_size)
 
+    def get_fft_filter_fn(self) -> Optional[FilterFn]:
+        return partial(fft_filters.gaussian_smoothing, sigma=self.sigma, window_size=self.window_size or WINDOW_SIZE)
+
     @property
     def channel_multiplier(self) -> int:
         return 1
 
+    @property
+    def halo_radius(self) -> int:
+        return get_kernel_radius(self.sigma, self.window_size)
+
 
 class DifferenceOfGaussians(ChannelwiseFastFilter):
     def __init__(
@@ -266,6 +495,23 @@ class DifferenceOfGaussians(ChannelwiseFastFilter):
     def channel_multiplier(self) -> int:
         return 1
 
+    @property
+    def halo_radius(self) -> int:
+        return get_kernel_radius(max(self.sigma0, self.sigma1), self.window_size)
+
+    @property
+    def min_sigma(self) -> float:
+        return min(self.sigma0, self.sigma1)
+
+    def downsampled(self, factor: int) -> "DifferenceOfGaussians":
+        return DifferenceOfGaussians(
+            preprocessor=self.preprocessor,
+            sigma0=get_downsampled_sigma(self.sigma0, factor),
+            sigma1=get_downsampled_sigma(self.sigma1, factor),
+            window_size=self.window_size,
+            axis_2d=self.axis_2d,
+        )
+
     @classmethod
     def from_json_value(cls, data: JsonValue) -> "DifferenceOfGaussians":
         data_dict = ensureJsonObject(data)
@@ -292,11 +538,21 @@ class DifferenceOfGaussians(ChannelwiseFastFilter):
         b = fastfilters.gaussianSmoothing(source_raw, sigma=self.sigma1, window_size=self.window_size)
         return a - b
 
+    def _fft_filter_fn(self, source_raw: "ndarray[Any, dtype[float32]]") -> "ndarray[Any, dtype[float32]]":
+        a = fft_filters.gaussian_smoothing(source_raw, sigma=self.sigma0, window_size=self.window_size or WINDOW_SIZE)
+        b = fft_filters.gaussian_smoothing(source_raw, sigma=self.sigma1, window_size=self.window_size or WINDOW_SIZE)
+        return a - b
+
+    def get_fft_filter_fn(self) -> Optional[FilterFn]:
+        return self._fft_filter_fn
+
 
 ScaleFilter = TypeVar("ScaleFilter", bound="ScaleWindowFilter")
 
 
 class ScaleWindowFilter(ChannelwiseFastFilter):
+    derivative_order = 2
+
     def __init__(
         self,
         *,
@@ -325,6 +581,23 @@ class ScaleWindowFilter(ChannelwiseFastFilter):
             "window_size": self.window_size,
         }
 
+    @property
+    def min_sigma(self) -> float:
+        return self.scale
+
+    def downsampled(self: ScaleFilter, factor: int) -> ScaleFilter:
+        return self.__class__(
+            preprocessor=self.preprocessor,
+            scale=get_downsampled_sigma(self.scale, factor),
+            window_size=self.window_size,
+            axis_2d=self.axis_2d,
+        )
+
+    @property
+    def halo_radius(self) -> int:
+        # one extra pixel for the derivatives
+        return get_kernel_radius(self.scale, self.window_size) + 1
+
 
 class HessianOfGaussianEigenvalues(ScaleWindowFilter):
     def filter_fn(self, source_raw: "ndarray[Any, dtype[float32]]") -> "ndarray[Any, dtype[float32]]":
@@ -339,6 +612,9 @@ class LaplacianOfGaussian(ScaleWindowFilter):
     def filter_fn(self, source_raw: "ndarray[Any, dtype[float32]]") -> "ndarray[Any, dtype[float32]]":
         return fastfilters.laplacianOfGaussian(source_raw, scale=self.scale, window_size=self.window_size)
 
+    def get_fft_filter_fn(self) -> Optional[FilterFn]:
+        return partial(fft_filters.laplacian_of_gaussian, scale=self.scale, window_size=self.window_size or WINDOW_SIZE)
+
     @property
     def channel_multiplier(self) -> int:
         return 1
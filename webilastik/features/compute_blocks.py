@@ -0,0 +1,150 @@
+from typing import Dict, List, Sequence
+import math
+
+import numpy as np
+from ndstructs.array5D import All, Array5D
+from ndstructs.point5D import Point5D, Shape5D
+
+from webilastik.datasource import DataRoi, DataSource
+from webilastik.features.channelwise_fastfilters import ChannelwiseFastFilter
+from webilastik.features.feature_extractor import FeatureData, FeatureExtractor, FeatureExtractorCollection
+from webilastik.features.ilp_filter import IlpFilter
+from webilastik.utility import get_env_var_or_exit
+from webilastik.utility.cache import ByteBudgetCache, CacheStats, SingleFlight
+
+# Upper bound for the memory used while computing the features of a single compute block (0 disables compute blocks)
+COMPUTE_BLOCK_MAX_BYTES: int = get_env_var_or_exit(
+    var_name="WEBILASTIK_COMPUTE_BLOCK_MAX_BYTES", parser=int, default=256 * 1024 * 1024
+)
+# Upper bound for the memory taken by the features of the compute blocks kept around (in each process) for the
+# tiles that still need them. COMPUTE_BLOCK_MAX_BYTES only bounds the memory used while computing a block.
+COMPUTE_BLOCK_CACHE_MAX_BYTES: int = get_env_var_or_exit(
+    var_name="WEBILASTIK_COMPUTE_BLOCK_CACHE_MAX_BYTES", parser=int, default=1024 * 1024 * 1024
+)
+
+_block_cache = ByteBudgetCache(max_bytes=COMPUTE_BLOCK_CACHE_MAX_BYTES)
+_block_single_flight = SingleFlight()
+
+def get_block_cache_stats() -> CacheStats:
+    return _block_cache.stats()
+
+def get_max_halo(extractors: Sequence[FeatureExtractor]) -> Point5D:
+    """The largest halo of any of the extractors whose halo is known"""
+    halos = [extractor.halo for extractor in extractors if isinstance(extractor, (IlpFilter, ChannelwiseFastFilter))]
+    return Point5D(**{label: max([halo[label] for halo in halos], default=0) for label in Point5D.LABELS})
+
+def estimate_compute_block_bytes(*, block_shape: Shape5D, halo: Point5D, num_input_channels: int, num_feature_channels: int) -> int:
+    """A rough estimate of the peak memory used to compute the features of a block.
+
+    That's the float32 input over the haloed block plus about twice the output features, to account for the
+    intermediate results (like presmoothed data) that are computed over the haloed block too.
+    """
+    haloed_volume = (block_shape.x + 2 * halo.x) * (block_shape.y + 2 * halo.y) * (block_shape.z + 2 * halo.z)
+    return haloed_volume * (num_input_channels + 2 * num_feature_channels) * np.dtype("float32").itemsize
+
+def plan_compute_block_shape(
+    *,
+    datasource: DataSource,
+    halo: Point5D,
+    num_feature_channels: int,
+    max_bytes: int = COMPUTE_BLOCK_MAX_BYTES,
+) -> Shape5D:
+    """The shape of the blocks to compute features over, independently of the shape of the requests.
+
+    Blocks are whole multiples of the datasource tiles, so that their reads are aligned, and grow (doubling along every
+    spatial axis the datasource still extends along) for as long as their estimated memory use stays within max_bytes.
+    The larger the block, the smaller the part of the reads that is spent on the halo.
+    """
+    tile_shape = datasource.tile_shape
+    max_sizes: Dict[str, int] = {
+        axis: math.ceil(datasource.shape[axis] / tile_shape[axis]) * tile_shape[axis] for axis in "xyz"
+    }
+    block_sizes: Dict[str, int] = {axis: min(tile_shape[axis], max_sizes[axis]) for axis in "xyz"}
+
+    def to_shape(sizes: Dict[str, int]) -> Shape5D:
+        return Shape5D(x=sizes["x"], y=sizes["y"], z=sizes["z"], c=datasource.shape.c)
+
+    while True:
+        candidate_sizes = {axis: min(size * 2, max_sizes[axis]) for axis, size in block_sizes.items()}
+        if candidate_sizes == block_sizes:
+            break
+        candidate_bytes = estimate_compute_block_bytes(
+            block_shape=to_shape(candidate_sizes),
+            halo=halo,
+            num_input_channels=datasource.shape.c,
+            num_feature_channels=num_feature_channels,
+        )
+        if candidate_bytes > max_bytes:
+            break
+        block_sizes = candidate_sizes
+    return to_shape(block_sizes)
+
+
+def make_blockwise(
+    extractor: FeatureExtractorCollection,
+    *,
+    datasource: DataSource,
+    halo: Point5D,
+    num_feature_channels: int,
+    max_bytes: int = COMPUTE_BLOCK_MAX_BYTES,
+) -> FeatureExtractor:
+    """extractor computed over compute blocks planned for datasource, or extractor itself if blocks wouldn't help"""
+    if max_bytes <= 0:
+        return extractor
+    block_shape = plan_compute_block_shape(
+        datasource=datasource, halo=halo, num_feature_channels=num_feature_channels, max_bytes=max_bytes
+    )
+    if block_shape.updated(c=1) == datasource.tile_shape.updated(c=1):
+        return extractor
+    return BlockwiseFeatureExtractor(extractor, block_shape=block_shape)
+
+
+class BlockwiseFeatureExtractor(FeatureExtractor):
+    """Computes the features of any ROI out of those of the compute blocks it intersects.
+
+    Blocks are kept in a byte-budgeted, per-process cache (see COMPUTE_BLOCK_CACHE_MAX_BYTES) instead of the global
+    cache, so requests for neighbouring tiles share the features of the same block, whose halo is read only once,
+    as long as they are handled by the same process (see get_block).
+    """
+
+    def __init__(self, extractor: FeatureExtractorCollection, block_shape: Shape5D):
+        self.extractor = extractor
+        self.block_shape = block_shape
+        super().__init__()
+
+    def is_applicable_to(self, datasource: DataSource) -> bool:
+        return self.extractor.is_applicable_to(datasource)
+
+    def get_blocks(self, roi: DataRoi) -> List[DataRoi]:
+        block_shape = self.block_shape.updated(c=roi.shape.c, t=1)
+        return [
+            block.clamped(roi.datasource.interval).updated(c=roi.c)
+            for block in roi.get_tiles(tile_shape=block_shape, tiles_origin=roi.datasource.location)
+        ]
+
+    def get_block(self, roi: DataRoi) -> DataRoi:
+        """The block roi starts in, which is the only one a datasource tile intersects"""
+        return self.get_blocks(roi.updated(x=(roi.x[0], roi.x[0] + 1), y=(roi.y[0], roi.y[0] + 1), z=(roi.z[0], roi.z[0] + 1)))[0]
+
+    def compute_block(self, block: DataRoi) -> FeatureData:
+        return _block_single_flight.get_or_compute(
+            (self.extractor, block), cache=_block_cache, compute=lambda: self.extractor.compute(block)
+        )
+
+    def __call__(self, /, roi: DataRoi) -> FeatureData:
+        blocks = self.get_blocks(roi)
+        if len(blocks) == 1:
+            return self.compute_block(blocks[0]).cut(roi.interval, c=All())
+
+        out: "Array5D | None" = None
+        for block in blocks:
+            block_features = self.compute_block(block)
+            if out is None:
+                out = Array5D.allocate(
+                    interval=roi.interval.updated(c=block_features.interval.c),
+                    dtype=block_features.dtype,
+                    axiskeys="tzyxc",
+                )
+            out.set(block_features, autocrop=True)
+        assert out is not None
+        return FeatureData(out.raw(out.axiskeys), axiskeys=out.axiskeys, location=out.location)
@@ -1,6 +1,5 @@
 from abc import abstractmethod
-from typing import Any, Dict, Iterable, Protocol
-from concurrent.futures import Future
+from typing import Any, Iterable, Protocol
 
 import numpy as np
 from ndstructs.point5D import Point5D
@@ -9,12 +8,26 @@ from ndstructs.array5D import Array5D
 from webilastik.serialization.json_serialization import IJsonable
 from webilastik.datasource import DataSource, DataRoi
 from webilastik.operator import Operator
+from webilastik.utility import get_env_var_or_exit
 from executor_getter import get_executor
 
+def _parse_feature_dtype(value: str) -> "np.dtype[Any]":
+    if value not in ("float32", "float16"):
+        raise ValueError(f"Bad feature dtype: {value}")
+    return np.dtype(value)
+
+# Features are always computed in float32, but the combined features of a FeatureExtractorCollection (the ones that
+# end up in the caches and in the training matrices) can be stored in float16 instead, which halves their size. They
+# are converted back to float32 right before being handed to vigra.
+FEATURE_STORAGE_DTYPE: "np.dtype[Any]" = get_env_var_or_exit(
+    var_name="WEBILASTIK_FEATURE_STORAGE_DTYPE", parser=_parse_feature_dtype, default=np.dtype("float32")
+)
+FLOAT16_MAX = float(np.finfo(np.float16).max)
+
 class FeatureData(Array5D):
-    def __init__(self, arr: "np.ndarray[Any, np.dtype[np.float32]]", axiskeys: str, location: Point5D = Point5D.zero()):
+    def __init__(self, arr: "np.ndarray[Any, np.dtype[np.float32 | np.float16]]", axiskeys: str, location: Point5D = Point5D.zero()):
         super().__init__(arr, axiskeys=axiskeys, location=location)
-        assert self.dtype == np.dtype('float32')
+        assert self.dtype == np.dtype('float32') or self.dtype == np.dtype('float16')
 
 
 class FeatureDataMismatchException(Exception):
@@ -45,47 +58,59 @@ class FeatureExtractor(Operator[DataRoi, FeatureData], Protocol):
 
 
 class FeatureExtractorCollection(FeatureExtractor):
-    def __init__(self, extractors: Iterable[FeatureExtractor]):
+    def __init__(self, extractors: Iterable[FeatureExtractor], storage_dtype: "np.dtype[Any]" = FEATURE_STORAGE_DTYPE):
         self.extractors = tuple(extractors)
         assert len(self.extractors) > 0
+        self.storage_dtype = _parse_feature_dtype(str(storage_dtype))
         super().__init__()
 
     def is_applicable_to(self, datasource: DataSource) -> bool:
         return all(fx.is_applicable_to(datasource) for fx in self.extractors)
 
     def __call__(self, /, roi: DataRoi) -> FeatureData:
+        return self.compute(roi)
+
+    def compute(self, roi: DataRoi) -> FeatureData:
+        """The features over roi.
+
+        They are not cached here, since the combined arrays are big and their callers cache them on their own terms
+        (whole compute blocks for predictions, feature samples for training), under a byte budget.
+        """
         assert roi.interval.c[0] == 0
-        feature_promises: Dict[int, Future[FeatureData]] = {}
+        from webilastik.features.feature_graph import FeatureGraph
 
+        # intermediate results like presmoothed data are computed once and shared by all extractors that need them
         executor = get_executor(hint="feature_extraction", max_workers=len(self.extractors))
-        from webilastik.features.ilp_filter import IlpGaussianSmoothing
-
-        feature_promises = {
-            fx_index: executor.submit(fx, roi)
-            for fx_index, fx in enumerate(self.extractors)
-            if isinstance(fx, IlpGaussianSmoothing)
-        }
-        feature_promises.update({
-            fx_index: executor.submit(fx, roi)
-            for fx_index, fx in enumerate(self.extractors)
-            if not isinstance(fx, IlpGaussianSmoothing)
-        })
-        assert len(feature_promises) == len(self.extractors)
-        features = [feature_promises[i].result() for i in range(len(self.extractors))]
-
-        out = Array5D.allocate(
-            dtype=np.dtype("float32"),
-            interval=roi.shape.updated(c=sum(feat.shape.c for feat in features)),
-            axiskeys="tzyxc",
-        ).translated(roi.start)
-
-        channel_offset: int = 0
-        for feature in features:
-            out.set(feature.translated(Point5D.zero(c=channel_offset)))
-            channel_offset += feature.shape.c
-
+        graph = FeatureGraph(self.extractors)
+        channel_counts = [graph.get_num_channels(output, roi.shape.c) for output in graph.outputs]
+
+        if all(num_channels is not None for num_channels in channel_counts):
+            # every extractor writes straight into its own channels of the combined array
+            out = Array5D.allocate(
+                dtype=np.dtype("float32"),
+                interval=roi.shape.updated(c=sum(num_channels or 0 for num_channels in channel_counts)),
+                axiskeys="tzyxc",
+            ).translated(roi.start)
+            _ = graph.compute(roi, executor=executor, out=out)
+        else:
+            features = graph.compute(roi, executor=executor)
+            out = Array5D.allocate(
+                dtype=np.dtype("float32"),
+                interval=roi.shape.updated(c=sum(feat.shape.c for feat in features)),
+                axiskeys="tzyxc",
+            ).translated(roi.start)
+
+            channel_offset: int = 0
+            for feature in features:
+                out.set(feature.translated(Point5D.zero(c=channel_offset)))
+                channel_offset += feature.shape.c
+
+        raw_out = out.raw(out.axiskeys)
+        if self.storage_dtype == np.dtype("float16"):
+            # saturate instead of overflowing to inf (e.g. structure tensor eigenvalues of high contrast images)
+            raw_out = np.clip(raw_out, -FLOAT16_MAX, FLOAT16_MAX).astype(np.float16)
         return FeatureData(
-            arr=out.raw(out.axiskeys),
+            arr=raw_out,
             axiskeys=out.axiskeys,
             location=out.location
         )
@@ -0,0 +1,187 @@
+from concurrent.futures import Executor
+from typing import Any, Dict, List, Optional, Sequence
+import math
+
+import numpy as np
+from ndstructs.array5D import Array5D
+from ndstructs.point5D import Point5D
+
+from webilastik.datasource import DataRoi
+from webilastik.features.channelwise_fastfilters import ChannelwiseFastFilter, DifferenceOfGaussians, GaussianSmoothing
+from webilastik.features.feature_extractor import FeatureData, FeatureExtractor
+from webilastik.features.ilp_filter import IlpFilter
+from webilastik.operator import Operator
+from webilastik.utility import get_env_var_or_exit, parse_bool
+
+# Deriving a gaussian of sigma s1 from one of sigma s0 < s1 by smoothing it again with sqrt(s1^2 - s0^2) is only
+# exact for continuous kernels. With sampled kernels truncated at WINDOW_SIZE sigmas, and starting from
+# CASCADE_MIN_SIGMA, the maximum absolute difference to smoothing the input directly stays under
+# CASCADE_TOLERANCE times the dynamic range of the input.
+GAUSSIAN_CASCADE: bool = get_env_var_or_exit(var_name="WEBILASTIK_GAUSSIAN_CASCADE", parser=parse_bool, default=False)
+CASCADE_MIN_SIGMA = 1.0
+CASCADE_TOLERANCE = 0.01
+
+def _max_point(a: Point5D, b: Point5D) -> Point5D:
+    return Point5D(**{label: max(a[label], b[label]) for label in Point5D.LABELS})
+
+
+class FeatureGraph:
+    """The intermediate results needed to compute a set of feature extractors, each computed once per ROI.
+
+    Nodes are operators, compared by value: the presmoothers of IlpFilters of the same scale, the gaussians
+    inside of a DifferenceOfGaussians and a GaussianSmoothing of the same sigma, or the retrieval of the raw
+    data are all shared between the extractors that consume them. Every node is computed over the ROI
+    enlarged by the largest halo any of its consumers needs. Extractors the graph doesn't know how to break
+    down are computed as a whole.
+
+    In cascade mode, gaussians of increasing sigma over the same input (like the presmoothers of the different
+    scales) are each derived from the next smaller one, so each only costs a convolution with the increment
+    between the two sigmas. See CASCADE_TOLERANCE for how close that gets to the exact result.
+    """
+
+    def __init__(self, extractors: Sequence[FeatureExtractor], cascade: bool = GAUSSIAN_CASCADE) -> None:
+        self.outputs: List[Operator[DataRoi, Any]] = [
+            extractor.op if isinstance(extractor, IlpFilter) else extractor for extractor in extractors
+        ]
+        # nodes that get computed as some other, cheaper node
+        self.substitutes: Dict[Operator[DataRoi, Any], Operator[DataRoi, Any]] = {}
+        if cascade:
+            self._add_cascades()
+        self.radii: Dict[Operator[DataRoi, Any], Point5D] = {}
+        self.levels: Dict[Operator[DataRoi, Any], int] = {}
+        for output in self.outputs:
+            self._add_node(self.resolve(output), radius=Point5D.zero())
+        super().__init__()
+
+    def _add_cascades(self) -> None:
+        base_gaussians: Dict[Any, List[GaussianSmoothing]] = {}
+        nodes_to_visit = list(self.outputs)
+        while nodes_to_visit:
+            node = nodes_to_visit.pop()
+            if isinstance(node, GaussianSmoothing) and not isinstance(node.preprocessor, ChannelwiseFastFilter):
+                group = base_gaussians.setdefault((node.preprocessor, node.axis_2d, node.window_size, node.approximable), [])
+                if node not in group:
+                    group.append(node)
+            nodes_to_visit.extend(self.get_inputs(node))
+
+        for group in base_gaussians.values():
+            cascade = sorted((node for node in group if node.sigma >= CASCADE_MIN_SIGMA), key=lambda node: node.sigma)
+            for previous, node in zip(cascade[:-1], cascade[1:]):
+                self.substitutes[node] = GaussianSmoothing(
+                    preprocessor=previous,
+                    sigma=math.sqrt(node.sigma ** 2 - previous.sigma ** 2),
+                    window_size=node.window_size,
+                    axis_2d=node.axis_2d,
+                    approximable=node.approximable,
+                )
+
+    def resolve(self, node: Operator[DataRoi, Any]) -> Operator[DataRoi, Any]:
+        return self.substitutes.get(node, node)
+
+    def get_inputs(self, node: Operator[DataRoi, Any]) -> Sequence[Operator[DataRoi, Any]]:
+        if isinstance(node, DifferenceOfGaussians):
+            return [
+                self.resolve(GaussianSmoothing(
+                    preprocessor=node.preprocessor, sigma=sigma, window_size=node.window_size, axis_2d=node.axis_2d
+                ))
+                for sigma in (node.sigma0, node.sigma1)
+            ]
+        if isinstance(node, ChannelwiseFastFilter):
+            return [self.resolve(node.preprocessor)]
+        return []
+
+    @classmethod
+    def get_input_radius(cls, node: Operator[DataRoi, Any], radius: Point5D) -> Point5D:
+        if isinstance(node, DifferenceOfGaussians):
+            return radius # the gaussians bring their own halos
+        if isinstance(node, ChannelwiseFastFilter):
+            return radius + node.halo
+        return radius
+
+    def _add_node(self, node: Operator[DataRoi, Any], radius: Point5D) -> int:
+        previous_radius = self.radii.get(node)
+        if previous_radius is not None and _max_point(previous_radius, radius) == previous_radius:
+            return self.levels[node]
+        radius = radius if previous_radius is None else _max_point(previous_radius, radius)
+        self.radii[node] = radius
+        input_radius = self.get_input_radius(node, radius)
+        self.levels[node] = max([self._add_node(input, input_radius) + 1 for input in self.get_inputs(node)], default=0)
+        return self.levels[node]
+
+    @classmethod
+    def get_num_channels(cls, node: Operator[DataRoi, Any], num_input_channels: int) -> Optional[int]:
+        """How many channels node produces out of num_input_channels, if that is known before computing it"""
+        if isinstance(node, IlpFilter):
+            node = node.op
+        if isinstance(node, ChannelwiseFastFilter):
+            return num_input_channels * node.channel_multiplier
+        return None
+
+    def compute(self, roi: DataRoi, executor: Executor, out: Optional[Array5D] = None) -> List[FeatureData]:
+        """Computes all outputs over roi.
+
+        If out is given, it must be a float32 array over roi with the channels of all outputs one after the other
+        (see get_num_channels), and the returned features are views of it. Outputs are written straight into their
+        slice of out unless they run in a different process or are also needed over a larger ROI as an input
+        to some other node, in which case they are copied over once done.
+        """
+        output_slices: Dict[Operator[DataRoi, Any], Array5D] = {}
+        if out is not None:
+            channel_offset = 0
+            for output in self.outputs:
+                num_channels = self.get_num_channels(output, roi.shape.c)
+                assert num_channels is not None, f"Can't tell how many channels {output} has in advance"
+                output_slice = out.cut(out.interval.updated(c=(channel_offset, channel_offset + num_channels)))
+                output_slices.setdefault(self.resolve(output), output_slice.translated(Point5D.zero(c=-channel_offset)))
+                channel_offset += num_channels
+            assert channel_offset == out.shape.c
+
+        results: Dict[Operator[DataRoi, Any], Array5D] = {}
+        for level in range(max(self.levels.values()) + 1):
+            level_nodes = [node for node, node_level in self.levels.items() if node_level == level]
+            futures = [
+                executor.submit(
+                    _compute_node,
+                    node,
+                    roi.enlarged(self.radii[node]),
+                    [results[input] for input in self.get_inputs(node)],
+                    output_slices.get(node) if self.radii[node] == Point5D.zero() else None,
+                )
+                for node in level_nodes
+            ]
+            for node, future in zip(level_nodes, futures):
+                results[node] = future.result()
+
+        features: List[FeatureData] = []
+        channel_offset = 0
+        for output in self.outputs:
+            result = results[self.resolve(output)]
+            feature = FeatureData(result.raw(result.axiskeys).astype(np.float32, copy=False), axiskeys=result.axiskeys, location=result.location)
+            if out is not None:
+                output_slice = out.cut(out.interval.updated(c=(channel_offset, channel_offset + feature.shape.c)))
+                if not np.shares_memory(output_slice.raw(output_slice.axiskeys), feature.raw(feature.axiskeys)):
+                    output_slice.set(feature.cut(roi.interval.updated(c=feature.interval.c)).translated(Point5D.zero(c=channel_offset)))
+                feature = FeatureData(output_slice.raw(output_slice.axiskeys), axiskeys=output_slice.axiskeys, location=output_slice.location.updated(c=0))
+                channel_offset += feature.shape.c
+            features.append(feature)
+        return features
+
+
+def _compute_node(
+    node: Operator[DataRoi, Any], node_roi: DataRoi, inputs: Sequence[Array5D], out: Optional[Array5D] = None
+) -> Array5D:
+    if isinstance(node, DifferenceOfGaussians):
+        a, b = [input.cut(node_roi.interval.updated(c=input.interval.c)) for input in inputs]
+        if out is None:
+            return FeatureData(a.raw(a.axiskeys) - b.raw(a.axiskeys), axiskeys=a.axiskeys, location=a.location)
+        out.set(Array5D(a.raw(out.axiskeys) - b.raw(out.axiskeys), axiskeys=out.axiskeys, location=out.location))
+        return out
+    if isinstance(node, ChannelwiseFastFilter):
+        source = inputs[0]
+        haloed_roi = node_roi.enlarged(node.halo)
+        return node.compute_from_source(source_data=source.cut(haloed_roi.interval.updated(c=source.interval.c)), roi=node_roi, out=out)
+    result: Array5D = node(node_roi)
+    if result.dtype != np.dtype("float32"):
+        # the raw data is usually consumed by many filters, so it's converted only once
+        result = Array5D(result.raw(result.axiskeys).astype(np.float32), axiskeys=result.axiskeys, location=result.location)
+    return result
@@ -0,0 +1,79 @@
+# pyright: strict
+
+"""Gaussian filters computed as separable FFT convolutions.
+
+These mirror the fastfilters functions of the same names. Their cost barely depends on the width of the kernels,
+so they outperform direct convolution for large sigmas (see benchmarks/fft_filters_benchmark.py). Borders are
+reflected, like fastfilters does.
+"""
+
+from typing import Any, List, Sequence
+import math
+
+import numpy
+from numpy import ndarray, float32, float64, dtype
+
+
+def get_gaussian_kernel(sigma: float, order: int, window_size: float) -> "ndarray[Any, dtype[float64]]":
+    """A sampled gaussian (derivative) kernel, normalized so that it is exact on polynomials of its order"""
+    radius = math.ceil(sigma * window_size)
+    x = numpy.arange(-radius, radius + 1, dtype=numpy.float64)
+    gaussian = numpy.exp(-(x ** 2) / (2 * sigma ** 2))
+    if order == 0:
+        return gaussian / gaussian.sum()
+    if order == 1:
+        kernel = -x / sigma ** 2 * gaussian
+        return kernel / -(kernel * x).sum()
+    if order == 2:
+        kernel = (x ** 2 / sigma ** 4 - 1 / sigma ** 2) * gaussian
+        kernel -= kernel.mean()
+        return kernel / ((kernel * x ** 2).sum() / 2)
+    raise ValueError(f"Unsupported derivative order: {order}")
+
+def fft_convolve_axis(
+    data: "ndarray[Any, dtype[Any]]", kernel: "ndarray[Any, dtype[float64]]", axis: int
+) -> "ndarray[Any, dtype[float64]]":
+    radius = (kernel.shape[0] - 1) // 2
+    size = data.shape[axis]
+    padding = [(0, 0)] * data.ndim
+    padding[axis] = (radius, radius)
+    padded = numpy.pad(data, padding, mode="reflect")
+    fft_size = padded.shape[axis] + kernel.shape[0] - 1
+    kernel_shape = [1] * data.ndim
+    kernel_shape[axis] = fft_size // 2 + 1
+    spectrum = numpy.fft.rfft(padded, n=fft_size, axis=axis) * numpy.fft.rfft(kernel, n=fft_size).reshape(kernel_shape)
+    convolved = numpy.fft.irfft(spectrum, n=fft_size, axis=axis)
+    # the full convolution is shifted by the radius of the kernel on top of the padding
+    return numpy.take(convolved, numpy.arange(2 * radius, 2 * radius + size), axis=axis)
+
+def _separable_convolve(
+    data: "ndarray[Any, dtype[Any]]", kernels: Sequence["ndarray[Any, dtype[float64]]"]
+) -> "ndarray[Any, dtype[float64]]":
+    out = data
+    for axis, kernel in enumerate(kernels):
+        out = fft_convolve_axis(out, kernel, axis=axis)
+    return out
+
+def _derivative_kernels(sigma: float, window_size: float, orders: Sequence[int]) -> List["ndarray[Any, dtype[float64]]"]:
+    return [get_gaussian_kernel(sigma, order=order, window_size=window_size) for order in orders]
+
+def gaussian_smoothing(source_raw: "ndarray[Any, dtype[float32]]", sigma: float, window_size: float) -> "ndarray[Any, dtype[float32]]":
+    kernels = _derivative_kernels(sigma, window_size, orders=[0] * source_raw.ndim)
+    return _separable_convolve(source_raw, kernels).astype(numpy.float32)
+
+def gaussian_gradient_magnitude(
+    source_raw: "ndarray[Any, dtype[float32]]", sigma: float, window_size: float
+) -> "ndarray[Any, dtype[float32]]":
+    squared_sum = numpy.zeros(source_raw.shape, dtype=numpy.float64)
+    for axis in range(source_raw.ndim):
+        orders = [1 if i == axis else 0 for i in range(source_raw.ndim)]
+        derivative = _separable_convolve(source_raw, _derivative_kernels(sigma, window_size, orders))
+        squared_sum += derivative ** 2
+    return numpy.sqrt(squared_sum).astype(numpy.float32)
+
+def laplacian_of_gaussian(source_raw: "ndarray[Any, dtype[float32]]", scale: float, window_size: float) -> "ndarray[Any, dtype[float32]]":
+    laplacian = numpy.zeros(source_raw.shape, dtype=numpy.float64)
+    for axis in range(source_raw.ndim):
+        orders = [2 if i == axis else 0 for i in range(source_raw.ndim)]
+        laplacian += _separable_convolve(source_raw, _derivative_kernels(scale, window_size, orders))
+    return laplacian.astype(numpy.float32)
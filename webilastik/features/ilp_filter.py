@@ -3,6 +3,7 @@ from typing import Final, Mapping, Optional, Literal, Iterable, List, Sequence,
 
 
 from ndstructs.array5D import Array5D
+from ndstructs.point5D import Point5D
 from ndstructs.utils.json_serializable import JsonObject, JsonValue, ensureJsonFloat, ensureJsonObject, ensureJsonString
 
 from webilastik.datasource import DataRoi, DataSource
@@ -40,8 +41,13 @@ class IlpFilter(PresmoothedFilter):
             class_name=self.ilp_name(),
         )
 
+    @property
+    def halo(self) -> Point5D:
+        """How far around a ROI data is read, through both the presmoother and the filter applied to its output"""
+        return self.presmoother.halo + self.op.halo
+
     def is_applicable_to(self, datasource: DataSource) -> bool:
-        return self.op.is_applicable_to(datasource)
+        return datasource.shape >= self.halo * 2
 
     @property
     def channel_multiplier(self) -> int:
@@ -4,6 +4,7 @@ import typing
 from typing import Sequence, Tuple, List
 
 from webilastik.server.rpc.dto import BucketFSDto, HttpFsDto, OsfsDto, ZipFsDto, FsDto
+from webilastik.utility.io_pool import io_map
 from webilastik.utility.url import Url
 
 
@@ -62,6 +63,12 @@ class FsIoException(Exception):
 
 #####################################
 
+@dataclass(frozen=True)
+class FsReadRequest:
+    path: PurePosixPath
+    offset: int = 0
+    num_bytes: "int | None" = None
+
 class IFilesystem(typing.Protocol):
     def list_contents(self, path: PurePosixPath) -> "FsDirectoryContents | FsIoException":
         ...
@@ -71,6 +78,9 @@ class IFilesystem(typing.Protocol):
         ...
     def read_file(self, path: PurePosixPath, offset: int = 0, num_bytes: "int | None" = None) -> "bytes | FsIoException | FsFileNotFoundException":
         ...
+    def read_files(self, requests: Sequence[FsReadRequest]) -> "List[bytes | FsIoException | FsFileNotFoundException]":
+        """Reads many files (or ranges of files) concurrently. Results come in the same order as the requests"""
+        return io_map(lambda req: self.read_file(req.path, offset=req.offset, num_bytes=req.num_bytes), requests)
     def get_size(self, path: PurePosixPath) -> "int | FsIoException | FsFileNotFoundException":
         ...
     def delete(self, path: PurePosixPath) -> "None | FsIoException":
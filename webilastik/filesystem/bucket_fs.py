@@ -1,11 +1,12 @@
 #pyright: strict
 
+from collections import OrderedDict
 import json
-from typing import Iterator, Literal, Optional, Tuple, List
+from typing import Callable, Iterator, Literal, Optional, Tuple, List, TypeVar
 from pathlib import Path, PurePosixPath
+import threading
 import time
 
-import requests
 from ndstructs.utils.json_serializable import ensureJsonArray, ensureJsonObject, ensureJsonString
 from requests.models import CaseInsensitiveDict
 
@@ -16,14 +17,69 @@ from webilastik.serialization.json_serialization import parse_json
 from webilastik.utility.log import Logger
 from webilastik.utility.url import Url
 from webilastik.server.rpc.dto import BucketFSDto, DataProxyObjectUrlResponse
-from webilastik.utility import Seconds
+from webilastik.utility import Seconds, get_env_var_or_exit
 from webilastik.utility.request import ErrRequestCompletedAsFailure, request_size, request as safe_request, ErrRequestCrashed
 
-_cscs_session = requests.Session()
-_data_proxy_session = requests.Session()
-
 logger = Logger()
 
+T = TypeVar("T")
+
+class ObjectUrlCache:
+    """Remembers the temporary object URLs handed out by the data-proxy, so that reads skip the extra round trip.
+
+    Entries expire after ttl_seconds, or shortly before the URL itself expires if it says when that happens
+    (like the temp_url_expires parameter of Swift temporary URLs).
+    """
+
+    def __init__(self, *, ttl_seconds: float, max_entries: int = 100_000, expiry_margin_seconds: float = 10) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.expiry_margin_seconds = expiry_margin_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, PurePosixPath], Tuple[Url, float]]" = OrderedDict()
+        super().__init__()
+
+    def _get_expiry(self, url: Url) -> float:
+        expiry = time.time() + self.ttl_seconds
+        raw_url_expiry = (url.search or {}).get("temp_url_expires")
+        if raw_url_expiry is not None and raw_url_expiry.isdigit():
+            expiry = min(expiry, int(raw_url_expiry) - self.expiry_margin_seconds)
+        return expiry
+
+    def get(self, *, bucket_name: str, path: PurePosixPath) -> Optional[Url]:
+        key = (bucket_name, path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            url, expiry = entry
+            if time.time() >= expiry:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return url
+
+    def put(self, *, bucket_name: str, path: PurePosixPath, url: Url) -> None:
+        expiry = self._get_expiry(url)
+        if expiry <= time.time():
+            return
+        with self._lock:
+            self._entries[(bucket_name, path)] = (url, expiry)
+            self._entries.move_to_end((bucket_name, path))
+            while len(self._entries) > self.max_entries:
+                _ = self._entries.popitem(last=False)
+
+    def invalidate(self, *, bucket_name: str, path: PurePosixPath) -> None:
+        with self._lock:
+            _ = self._entries.pop((bucket_name, path), None)
+
+_object_url_cache = ObjectUrlCache(
+    ttl_seconds=get_env_var_or_exit(var_name="WEBILASTIK_BUCKET_FS_URL_TTL_SECONDS", parser=float, default=300)
+)
+
+# the object URL was revoked, expired or points to an object that was replaced or deleted
+_STALE_OBJECT_URL_STATUS_CODES = (401, 403, 404)
+
 def _requests_from_data_proxy(
     method: Literal["get", "put", "delete"],
     url: Url,
@@ -33,7 +89,6 @@ def _requests_from_data_proxy(
     from webilastik.libebrains.global_user_login import GlobalLogin
     user_token = GlobalLogin.get_token()
     response_result = safe_request(
-        session=_data_proxy_session,
         method=method,
         url=url,
         data=data,
@@ -134,7 +189,7 @@ class BucketFs(IFilesystem):
         cscs_url_result = self._parse_url_from_data_proxy_response(response[0])
         if isinstance(cscs_url_result, Exception):
             return FsIoException(f"Could not parse CSCS object URL (write): {cscs_url_result}")
-        response = safe_request(session=_cscs_session, method="put", url=cscs_url_result, data=contents)
+        response = safe_request(method="put", url=cscs_url_result, data=contents)
         if isinstance(response, Exception):
             return FsIoException(response)
         return None
@@ -152,22 +207,37 @@ class BucketFs(IFilesystem):
         cscs_url_result = self._parse_url_from_data_proxy_response(data_proxy_response[0])
         if isinstance(cscs_url_result, Exception):
             return FsIoException(f"Could not parse CSCS object URL (read): {cscs_url_result}")
+        _object_url_cache.put(bucket_name=self.bucket_name, path=path, url=cscs_url_result)
         return cscs_url_result
 
-    def read_file(self, path: PurePosixPath, offset: int = 0, num_bytes: "int | None"  = None) -> "bytes | FsIoException | FsFileNotFoundException":
+    def _request_object(
+        self, path: PurePosixPath, do_request: "Callable[[Url], T | ErrRequestCompletedAsFailure | Exception]"
+    ) -> "T | ErrRequestCompletedAsFailure | Exception":
+        cached_url = _object_url_cache.get(bucket_name=self.bucket_name, path=path)
+        if cached_url is not None:
+            result = do_request(cached_url)
+            if not (isinstance(result, ErrRequestCompletedAsFailure) and result.status_code in _STALE_OBJECT_URL_STATUS_CODES):
+                return result
+            _object_url_cache.invalidate(bucket_name=self.bucket_name, path=path)
         cscs_url_result = self.get_swift_object_url(path=path)
         if isinstance(cscs_url_result, Exception):
             return cscs_url_result
-        cscs_response = safe_request(session=_cscs_session, method="get", url=cscs_url_result, offset=offset, num_bytes=num_bytes)
+        return do_request(cscs_url_result)
+
+    def read_file(self, path: PurePosixPath, offset: int = 0, num_bytes: "int | None"  = None) -> "bytes | FsIoException | FsFileNotFoundException":
+        cscs_response = self._request_object(
+            path, lambda cscs_url: safe_request(method="get", url=cscs_url, offset=offset, num_bytes=num_bytes)
+        )
+        if isinstance(cscs_response, (FsIoException, FsFileNotFoundException)):
+            return cscs_response
         if isinstance(cscs_response, Exception):
             return FsIoException(cscs_response) # FIXME: pass exception directly into other?
         return cscs_response[0]
 
     def get_size(self, path: PurePosixPath) -> "int | FsIoException | FsFileNotFoundException":
-        cscs_url_result = self.get_swift_object_url(path=path)
-        if isinstance(cscs_url_result, Exception):
-            return cscs_url_result
-        size_result = request_size(session=_cscs_session, url=cscs_url_result)
+        size_result = self._request_object(path, lambda cscs_url: request_size(url=cscs_url))
+        if isinstance(size_result, (FsIoException, FsFileNotFoundException)):
+            return size_result
         if isinstance(size_result, ErrRequestCompletedAsFailure):
             if size_result.status_code == 404:
                 return FsFileNotFoundException(path)
@@ -185,6 +255,7 @@ class BucketFs(IFilesystem):
             return dir_contents_result
 
         deletion_response = _requests_from_data_proxy(method="delete", url=self.url.concatpath(path), data=None)
+        _object_url_cache.invalidate(bucket_name=self.bucket_name, path=path)
         #FIXME: what about not found?
         if isinstance(deletion_response, Exception):
             return FsIoException(deletion_response)
@@ -238,7 +309,7 @@ class BucketFs(IFilesystem):
         cscs_url = Url.parse_or_raise(ensureJsonString(response_obj.get("url"))) #FIXME: could raise
 
         source_file = source_fs.resolve_path(source_path).open("rb")
-        response = safe_request(session=_cscs_session, method="put", url=cscs_url, data=source_file)
+        response = safe_request(method="put", url=cscs_url, data=source_file)
         if isinstance(response, Exception):
             return FsIoException(response)
         return None
\ No newline at end of file
@@ -1,10 +1,11 @@
-from typing import List, Final, Tuple
+from typing import Dict, List, Final, Sequence, Tuple
 from pathlib import PurePosixPath, Path
 import uuid
 import os
 from webilastik.config import WorkflowConfig
 
-from webilastik.filesystem import IFilesystem, FsIoException, FsFileNotFoundException, FsDirectoryContents
+from webilastik.filesystem import IFilesystem, FsIoException, FsFileNotFoundException, FsDirectoryContents, FsReadRequest
+from webilastik.utility.io_pool import io_map
 from webilastik.utility.url import Url
 from webilastik.server.rpc.dto import OsfsDto
 from webilastik.utility import Seconds
@@ -102,6 +103,51 @@ class OsFs(IFilesystem):
         except Exception as e:
             return FsIoException(e)
 
+    def _read_ranges(
+        self, path: PurePosixPath, requests: Sequence[FsReadRequest]
+    ) -> "List[bytes | FsIoException | FsFileNotFoundException]":
+        # opens the file once and serves every range with pread, which doesn't move a shared file position
+        try:
+            fd = os.open(self.resolve_path(path), os.O_RDONLY)
+        except FileNotFoundError:
+            return [FsFileNotFoundException(path=path) for _ in requests]
+        except Exception as e:
+            return [FsIoException(e) for _ in requests]
+        try:
+            file_size = os.fstat(fd).st_size
+            out: "List[bytes | FsIoException | FsFileNotFoundException]" = []
+            for req in requests:
+                offset = req.offset if req.offset >= 0 else file_size + req.offset
+                if offset < 0:
+                    # same as seeking before the start of the file in read_file
+                    out.append(FsIoException(f"Offset {req.offset} is before the start of {path}"))
+                    continue
+                num_bytes = req.num_bytes if req.num_bytes is not None else max(0, file_size - offset)
+                try:
+                    out.append(os.pread(fd, num_bytes, offset))
+                except Exception as e:
+                    out.append(FsIoException(e))
+            return out
+        finally:
+            os.close(fd)
+
+    def read_files(self, requests: Sequence[FsReadRequest]) -> "List[bytes | FsIoException | FsFileNotFoundException]":
+        requests_per_path: Dict[PurePosixPath, List[int]] = {}
+        for req_index, req in enumerate(requests):
+            requests_per_path.setdefault(req.path, []).append(req_index)
+        for req_indices in requests_per_path.values():
+            req_indices.sort(key=lambda idx: requests[idx].offset)
+
+        paths = list(requests_per_path.keys())
+        results_per_path = io_map(
+            lambda path: self._read_ranges(path, [requests[idx] for idx in requests_per_path[path]]), paths
+        )
+        out: "List[bytes | FsIoException | FsFileNotFoundException]" = [FsIoException("Not read")] * len(requests)
+        for path, results in zip(paths, results_per_path):
+            for req_index, result in zip(requests_per_path[path], results):
+                out[req_index] = result
+        return out
+
     def get_size(self, path: PurePosixPath) -> "int | FsIoException | FsFileNotFoundException":
         try:
             return self.resolve_path(path).stat().st_size
@@ -1,8 +1,8 @@
 # pyright: strict
 
 from pathlib import PurePosixPath
-from typing import Final, Any, Tuple, Set, Dict
-from webilastik.filesystem import FsDirectoryContents, FsFileNotFoundException, FsIoException, IFilesystem, create_filesystem_from_message, create_filesystem_from_url
+from typing import Final, Any, List, Sequence, Tuple, Set, Dict
+from webilastik.filesystem import FsDirectoryContents, FsFileNotFoundException, FsIoException, FsReadRequest, IFilesystem, create_filesystem_from_message, create_filesystem_from_url
 from dataclasses import dataclass
 import zipfile
 import io
@@ -173,13 +173,16 @@ class ZipFs(IFilesystem):
     def create_directory(self, path: PurePosixPath) -> "None | FsIoException":
         return FsIoException("Not implemented")
 
-    def read_file(self, path: PurePosixPath, offset: int = 0, num_bytes: "int | None" = None) -> "bytes | FsIoException | FsFileNotFoundException":
+    def _read_entry(self, path: PurePosixPath) -> "bytes | FsIoException | FsFileNotFoundException":
         try:
-            data = self.archive[self.raw_path(path)]
+            return self.archive[self.raw_path(path)]
         except KeyError as e:
             return FsFileNotFoundException(path)
         except Exception as e:
             return FsIoException(e)
+
+    @classmethod
+    def _slice_entry_data(cls, data: bytes, offset: int = 0, num_bytes: "int | None" = None) -> "bytes | FsIoException":
         data_len = len(data)
 
         start = offset
@@ -194,6 +197,31 @@ class ZipFs(IFilesystem):
 
         return data[start:end]
 
+    def read_file(self, path: PurePosixPath, offset: int = 0, num_bytes: "int | None" = None) -> "bytes | FsIoException | FsFileNotFoundException":
+        data = self._read_entry(path)
+        if isinstance(data, Exception):
+            return data
+        return self._slice_entry_data(data, offset=offset, num_bytes=num_bytes)
+
+    def read_files(self, requests: Sequence[FsReadRequest]) -> "List[bytes | FsIoException | FsFileNotFoundException]":
+        # every entry is read once, no matter how many ranges of it were requested, and entries are read one
+        # after the other in central directory order, so that reads into the archive mostly move forward
+        central_directory_positions = {raw_path: position for position, raw_path in enumerate(self.archive.files.keys())}
+        requested_paths = sorted(
+            {req.path for req in requests},
+            key=lambda path: central_directory_positions.get(self.raw_path(path), len(central_directory_positions)),
+        )
+        entries = {path: self._read_entry(path) for path in requested_paths}
+
+        out: "List[bytes | FsIoException | FsFileNotFoundException]" = []
+        for req in requests:
+            data = entries[req.path]
+            if isinstance(data, Exception):
+                out.append(data)
+            else:
+                out.append(self._slice_entry_data(data, offset=req.offset, num_bytes=req.num_bytes))
+        return out
+
     def get_size(self, path: PurePosixPath) -> "int | FsIoException | FsFileNotFoundException":
         entry = self.archive.files.get(self.raw_path(path))
         if entry is None:
@@ -2,7 +2,6 @@
 
 import threading
 
-import requests
 from webilastik.config import WorkflowConfig
 
 from webilastik.libebrains.user_token import AccessToken, HbpIamPublicKey
@@ -28,7 +27,6 @@ class GlobalLogin:
 
             request_result = request(
                 method="post",
-                session=requests.Session(),
                 url=Url.parse_or_raise("https://app.ilastik.org/api/refresh_token"),
                 headers={
                     "Authorization": f"Bearer {cls._token.raw_token}",
@@ -15,3 +15,9 @@ class OpRetriever(Operator[DataRoi, Array5D]):
         super().__init__()
     def __call__(self, /, roi: DataRoi) -> Array5D:
         return roi.retrieve(axiskeys_hint=self.axiskeys_hint)
+
+    def __hash__(self) -> int:
+        return hash((self.__class__, self.axiskeys_hint))
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, OpRetriever) and self.axiskeys_hint == other.axiskeys_hint
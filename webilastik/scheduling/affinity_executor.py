@@ -0,0 +1,49 @@
+# pyright: strict
+
+from concurrent.futures import Executor, Future
+import threading
+from typing import Callable, Hashable, Sequence, TypeVar
+from typing_extensions import ParamSpec
+
+_P = ParamSpec("_P")
+_T = TypeVar("_T")
+
+
+class AffinityExecutor(Executor):
+    """Spreads tasks over a set of single-worker executors, always sending tasks of the same affinity key to the same one.
+
+    Like with the HashingMpiExecutor, related tasks (e.g. tiles of the same compute block) then find each other's
+    intermediate results in the in-process caches of their worker instead of each worker computing them again.
+    """
+
+    def __init__(self, workers: Sequence[Executor]) -> None:
+        if len(workers) == 0:
+            raise ValueError("AffinityExecutor needs at least one worker")
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._next_worker_index = 0
+        super().__init__()
+
+    def submit(self, fn: Callable[_P, _T], /, *args: _P.args, **kwargs: _P.kwargs) -> "Future[_T]":
+        with self._lock:
+            worker = self.workers[self._next_worker_index]
+            self._next_worker_index = (self._next_worker_index + 1) % len(self.workers)
+        return worker.submit(fn, *args, **kwargs)
+
+    def submit_with_affinity(
+        self, affinity_key: Hashable, fn: Callable[_P, _T], /, *args: _P.args, **kwargs: _P.kwargs
+    ) -> "Future[_T]":
+        return self.workers[hash(affinity_key) % len(self.workers)].submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        for worker in self.workers:
+            worker.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+def submit_with_affinity(
+    executor: Executor, affinity_key: Hashable, fn: Callable[_P, _T], /, *args: _P.args, **kwargs: _P.kwargs
+) -> "Future[_T]":
+    """Submits fn to the worker for affinity_key if executor is an AffinityExecutor, or anywhere otherwise"""
+    if isinstance(executor, AffinityExecutor):
+        return executor.submit_with_affinity(affinity_key, fn, *args, **kwargs)
+    return executor.submit(fn, *args, **kwargs)
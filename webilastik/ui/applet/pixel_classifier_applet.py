@@ -12,6 +12,8 @@ from webilastik.ui.applet  import Applet, AppletOutput, CascadeOk, CascadeResult
 from webilastik.annotations.annotation import Annotation, Color
 from webilastik.features.ilp_filter import IlpFilter, IlpFilterCollection
 from webilastik.classifiers.pixel_classifier import VigraPixelClassifier
+from webilastik.classifiers.worker_classifier_registry import WorkerClassifierRegistry
+from webilastik.scheduling.affinity_executor import submit_with_affinity
 from webilastik.ui.usage_error import UsageError
 
 
@@ -69,6 +71,7 @@ class PixelClassificationApplet(Applet):
         self._in_feature_extractors = feature_extractors
         self._in_label_classes = label_classes
         self.executor = executor
+        self.classifier_registry = WorkerClassifierRegistry(executor=executor)
         self.on_async_change = on_async_change
 
         self._state: _State = _State(
@@ -114,8 +117,12 @@ class PixelClassificationApplet(Applet):
                 self._state = self._state.updated_with(classifier=None)
                 return CascadeOk()
 
-            classifier_future = self.executor.submit(
-                partial(Classifier.train, feature_extractors.filters), tuple(label_classes.values())
+            # always training in the same worker lets it reuse the feature samples of the annotations that didn't change
+            classifier_future = submit_with_affinity(
+                self.executor,
+                self.classifier_registry.registry_id,
+                partial(Classifier.train, feature_extractors.filters),
+                tuple(label_classes.values()),
             )
             previous_state = self._state = self._state.updated_with(classifier=classifier_future)
 
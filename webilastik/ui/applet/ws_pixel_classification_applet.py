@@ -113,18 +113,21 @@ class WsPixelClassificationApplet(WsApplet, PixelClassificationApplet):
             return uncachable_json_response(payload=f"Could not get data source from URL: {ds_result}", status=400)
         datasource = ds_result
 
+        # classifier and generation must be read together so that the registry never keys a classifier under the wrong generation
+        generational_classifier = self.generational_pixel_classifier()
         with self.lock:
-            classifier = self.pixel_classifier()
             label_classes = self._in_label_classes()
-        if classifier is None:
+        if generational_classifier is None:
             return web.json_response({"error": "Classifier is not ready yet"}, status=412)
+        classifier, classifier_generation = generational_classifier
 
-        if generation != self._state.generation:
+        if generation != classifier_generation:
             return web.json_response({"error": "This classifier is stale"}, status=410)
 
-        predictions = await asyncio.wrap_future(self.executor.submit(
-            classifier,
-            DataRoi(datasource, x=(xBegin, xEnd), y=(yBegin, yEnd), z=(zBegin, zEnd))
+        predictions = await asyncio.wrap_future(self.classifier_registry.submit(
+            classifier=classifier,
+            generation=generation,
+            roi=DataRoi(datasource, x=(xBegin, xEnd), y=(yBegin, yEnd), z=(zBegin, zEnd)),
         ))
 
         if "format" in request.query:
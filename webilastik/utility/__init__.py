@@ -81,6 +81,15 @@ class DebugLock:
         self.traceback = None
         self._lock.release()
 
+def parse_bool(value: str) -> "bool | ValueError":
+    """Parses boolean environment variables, rejecting typos instead of taking them to mean false"""
+    lowered = value.lower()
+    if lowered in ("yes", "true", "1"):
+        return True
+    if lowered in ("no", "false", "0"):
+        return False
+    return ValueError(f"Bad boolean value: {value}. Expected one of yes/no, true/false or 1/0")
+
 def get_env_var(
     *,
     var_name: str,
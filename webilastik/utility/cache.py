@@ -0,0 +1,390 @@
+# pyright: strict
+
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from dataclasses import dataclass
+import hashlib
+import importlib
+import json
+import pickle
+import struct
+import sys
+import threading
+import zlib
+from typing import Any, Callable, Dict, Hashable, Literal, Mapping, Optional, Protocol, Set, Tuple, TypeVar
+
+import numpy as np
+from ndstructs.array5D import Array5D
+
+from webilastik.utility import Empty
+
+
+CacheKey = Tuple[Hashable, ...]
+T = TypeVar("T")
+K = TypeVar("K", contravariant=True)
+
+def make_cache_key(func: Callable[..., Any], args: Tuple[Any, ...], kwargs: Mapping[str, Any]) -> CacheKey:
+    return (func, args, tuple(sorted(kwargs.items(), key=lambda item: item[0])))
+
+def get_nbytes(value: object) -> int:
+    if isinstance(value, Array5D):
+        return value.raw(value.axiskeys).nbytes
+    if isinstance(value, np.ndarray):
+        return value.nbytes # pyright: ignore [reportUnknownMemberType, reportUnknownVariableType]
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+@dataclass
+class CacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    resident_bytes: int
+    num_entries: int
+    max_bytes: int
+
+    @property
+    def hit_rate(self) -> float:
+        num_lookups = self.hits + self.misses
+        return 0.0 if num_lookups == 0 else self.hits / num_lookups
+
+
+class CacheTier(Protocol[K]):
+    def get(self, key: K) -> "Any | Empty":
+        ...
+    def put(self, key: K, value: Any) -> None:
+        ...
+    def stats(self) -> CacheStats:
+        ...
+
+
+class LocalCache(Protocol):
+    """An in-process cache that can look values up without counting it as a hit or miss"""
+    def get(self, key: Hashable, record_stats: bool = True) -> "Any | Empty":
+        ...
+    def put(self, key: Hashable, value: Any) -> None:
+        ...
+
+
+class LruCache(LocalCache):
+    """An LRU cache bounded by how many entries it holds"""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        super().__init__()
+
+    def get(self, key: Hashable, record_stats: bool = True) -> "Any | Empty":
+        with self._lock:
+            if key not in self._entries:
+                return Empty()
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                _ = self._entries.popitem(last=False)
+
+
+class ByteBudgetCache(CacheTier[Hashable]):
+    """An LRU cache that evicts entries based on their size in bytes instead of on how many entries there are"""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._resident_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        super().__init__()
+
+    def get(self, key: Hashable, record_stats: bool = True) -> "Any | Empty":
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1 if record_stats else 0
+                return Empty()
+            self._entries.move_to_end(key)
+            self._hits += 1 if record_stats else 0
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        nbytes = get_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous_entry = self._entries.pop(key, None)
+            if previous_entry is not None:
+                self._resident_bytes -= previous_entry[1]
+            self._entries[key] = (value, nbytes)
+            self._resident_bytes += nbytes
+            while self._resident_bytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self._resident_bytes -= evicted_nbytes
+                self._evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._resident_bytes = 0
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+                resident_bytes=self._resident_bytes,
+                num_entries=len(self._entries),
+                max_bytes=self.max_bytes,
+            )
+
+
+class SingleFlight:
+    """Deduplicates concurrent computations of the same key.
+
+    The first caller for a key runs the computation; callers arriving while it is still in flight wait on
+    its future instead of computing the same value again."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, "Future[Any]"] = {}
+        super().__init__()
+
+    def run(self, key: Hashable, compute: Callable[[], T]) -> T:
+        future: "Future[T]" = Future()
+        with self._lock:
+            in_flight = self._in_flight.setdefault(key, future)
+        if in_flight is not future:
+            return in_flight.result()
+
+        try:
+            value = compute()
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def get_or_compute(self, key: Hashable, *, cache: LocalCache, compute: Callable[[], T]) -> T:
+        """Looks key up in cache, computing and storing its value on a miss.
+
+        Hits are served straight from the cache; only misses go through single-flight."""
+        value = cache.get(key)
+        if not isinstance(value, Empty):
+            return value
+
+        def compute_missing() -> T:
+            # another caller might have finished computing this while we were waiting to get in
+            value = cache.get(key, record_stats=False)
+            if not isinstance(value, Empty):
+                return value
+            value = compute()
+            cache.put(key, value)
+            return value
+        return self.run(key, compute_missing)
+
+    def num_in_flight(self) -> int:
+        with self._lock:
+            return len(self._in_flight)
+
+
+
+class TieredCache:
+    """A small in-process cache (l1) in front of a bigger, usually shared, one (l2).
+
+    Values found in l2 are promoted to l1. Freshly computed values go into both tiers; if a write_back_executor
+    is provided, writing to l2 happens in the background so the caller doesn't wait on e.g. a network hop."""
+
+    def __init__(self, *, l1: ByteBudgetCache, l2: "CacheTier[bytes]", write_back_executor: Optional[Executor] = None) -> None:
+        self.l1 = l1
+        self.l2 = l2
+        self.write_back_executor = write_back_executor
+        self._single_flight = SingleFlight()
+        super().__init__()
+
+    def get_or_compute(
+        self, *, local_key: CacheKey, make_shared_key: Callable[[], "bytes | Exception"], compute: Callable[[], T]
+    ) -> T:
+        value = self.l1.get(local_key)
+        if not isinstance(value, Empty):
+            return value
+        return self._single_flight.run(
+            local_key, lambda: self._fetch_or_compute(local_key=local_key, make_shared_key=make_shared_key, compute=compute)
+        )
+
+    def _fetch_or_compute(
+        self, *, local_key: CacheKey, make_shared_key: Callable[[], "bytes | Exception"], compute: Callable[[], T]
+    ) -> T:
+        value = self.l1.get(local_key, record_stats=False)
+        if not isinstance(value, Empty):
+            return value
+        shared_key = make_shared_key()
+        if isinstance(shared_key, Exception):
+            # values without a key that other processes could use are only cached locally
+            value = compute()
+            self.l1.put(local_key, value)
+            return value
+        value = self.l2.get(shared_key)
+        if not isinstance(value, Empty):
+            self.l1.put(local_key, value)
+            return value
+
+        value = compute()
+        self.l1.put(local_key, value)
+        if self.write_back_executor is None:
+            self.l2.put(shared_key, value)
+        else:
+            _ = self.write_back_executor.submit(self.l2.put, shared_key, value)
+        return value
+
+    def stats(self) -> Mapping[str, CacheStats]:
+        return {"l1": self.l1.stats(), "l2": self.l2.stats()}
+
+
+def _stable_key_parts(value: Any, _visiting: Optional[Set[int]] = None) -> Any:
+    """Describes value in terms that are the same across processes.
+
+    Only a known set of types can be described: primitives and sequences of them, arrays, rois and
+    intervals, objects that know how to describe themselves via to_dto() and operators like feature
+    extractors, which are value objects and are described by their attributes.
+    """
+    from ndstructs.point5D import Interval5D, Point5D
+    from webilastik.datasource import DataRoi
+    from webilastik.annotations.annotation import Annotation
+    from webilastik.operator import Operator
+
+    visiting = _visiting if _visiting is not None else set()
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        return value
+    if isinstance(value, (tuple, list)):
+        return tuple(_stable_key_parts(v, visiting) for v in value) # pyright: ignore [reportUnknownVariableType]
+    if isinstance(value, np.dtype):
+        return str(value) # pyright: ignore [reportUnknownArgumentType]
+    if isinstance(value, np.ndarray):
+        return ("ndarray", str(value.dtype), value.shape, hashlib.blake2b(value.tobytes(), digest_size=16).digest()) # pyright: ignore
+    if isinstance(value, Annotation):
+        # the same strokes over different images are different annotations
+        return ("Annotation", value.axiskeys, _stable_key_parts(value.location), _stable_key_parts(value.raw(value.axiskeys)), _stable_key_parts(value.raw_data))
+    if isinstance(value, Array5D):
+        return ("Array5D", value.axiskeys, _stable_key_parts(value.location), _stable_key_parts(value.raw(value.axiskeys)))
+    if isinstance(value, DataRoi):
+        return ("DataRoi", value.x, value.y, value.z, value.t, value.c, _stable_key_parts(value.datasource))
+    if isinstance(value, Interval5D):
+        return ("Interval5D", value.x, value.y, value.z, value.t, value.c)
+    if isinstance(value, Point5D):
+        return ("Point5D", value.x, value.y, value.z, value.t, value.c)
+    to_dto = getattr(value, "to_dto", None)
+    if callable(to_dto):
+        # datasources and filesystems know how to describe themselves without dragging sessions and handles along
+        return (type(value).__qualname__, json.dumps(to_dto().to_json_value(), sort_keys=True))
+    # Operator is a non-runtime-checkable Protocol, so look for it in the mro instead of using isinstance
+    if Operator in type(value).__mro__ and hasattr(value, "__dict__"):
+        if id(value) in visiting:
+            raise TypeError(f"Can't make a stable cache key out of {type(value).__qualname__}: it references itself")
+        visiting.add(id(value))
+        try:
+            return (
+                f"{type(value).__module__}.{type(value).__qualname__}",
+                tuple((k, _stable_key_parts(v, visiting)) for k, v in sorted(vars(value).items())),
+            )
+        finally:
+            visiting.remove(id(value))
+    raise TypeError(
+        f"Can't make a stable cache key out of a {type(value).__module__}.{type(value).__qualname__}. "
+        "Only primitives, arrays, rois, operators and objects with a to_dto() method can be used as cache keys"
+    )
+
+def make_stable_cache_key(namespace: str, args: Tuple[Any, ...], kwargs: Mapping[str, Any]) -> bytes:
+    """A compact key that is the same across processes for equivalent arguments, e.g. for shared caches"""
+    parts = (_stable_key_parts(args), _stable_key_parts(sorted(kwargs.items(), key=lambda item: item[0])))
+    digest = hashlib.blake2b(repr(parts).encode("utf8"), digest_size=20).hexdigest()
+    return f"{namespace}:{digest}".encode("utf8")
+
+def try_make_stable_cache_key(namespace: str, args: Tuple[Any, ...], kwargs: Mapping[str, Any]) -> "bytes | TypeError":
+    """Like make_stable_cache_key, but returning the error for arguments that can't be described across processes
+    (e.g. an ArrayDataSource), so that callers can skip the shared cache for them"""
+    try:
+        return make_stable_cache_key(namespace, args, kwargs)
+    except TypeError as e:
+        return e
+
+
+Compression = Literal["none", "zlib", "lz4"]
+
+_VALUE_MAGIC = b"WIC1"
+_VALUE_KIND_PICKLE = 0
+_VALUE_KIND_ARRAY = 1
+_COMPRESSION_CODES: Mapping[Compression, int] = {"none": 0, "zlib": 1, "lz4": 2}
+_VALUE_PREAMBLE = struct.Struct("!4sBBI") # magic, kind, compression, header length
+
+def _compress(data: bytes, compression: Compression) -> bytes:
+    if compression == "zlib":
+        return zlib.compress(data, 1)
+    if compression == "lz4":
+        import lz4.frame # pyright: ignore [reportMissingImports, reportMissingTypeStubs]
+        return lz4.frame.compress(data) # pyright: ignore
+    return data
+
+def _decompress(data: memoryview, compression_code: int) -> "bytes | memoryview":
+    if compression_code == _COMPRESSION_CODES["zlib"]:
+        return zlib.decompress(data)
+    if compression_code == _COMPRESSION_CODES["lz4"]:
+        import lz4.frame # pyright: ignore [reportMissingImports, reportMissingTypeStubs]
+        return lz4.frame.decompress(data) # pyright: ignore
+    return data
+
+def encode_cache_value(value: Any, compression: Compression = "none") -> bytes:
+    """Serializes Array5D values as a small json header followed by their raw buffer, and anything else via pickle"""
+    if isinstance(value, Array5D):
+        raw = np.ascontiguousarray(value.raw(value.axiskeys))
+        header = json.dumps({
+            "class": f"{type(value).__module__}:{type(value).__qualname__}",
+            "dtype": raw.dtype.str,
+            "shape": list(raw.shape),
+            "axiskeys": value.axiskeys,
+            "location": list(value.location.to_tuple("tzyxc")),
+        }).encode("utf8")
+        kind = _VALUE_KIND_ARRAY
+        payload = raw.tobytes()
+    else:
+        header = b""
+        kind = _VALUE_KIND_PICKLE
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    preamble = _VALUE_PREAMBLE.pack(_VALUE_MAGIC, kind, _COMPRESSION_CODES[compression], len(header))
+    return preamble + header + _compress(payload, compression)
+
+def decode_cache_value(data: bytes) -> Any:
+    from ndstructs.point5D import Point5D
+
+    magic, kind, compression_code, header_length = _VALUE_PREAMBLE.unpack_from(data)
+    if magic != _VALUE_MAGIC:
+        raise ValueError(f"Bad cache value magic: {magic}")
+    header_start = _VALUE_PREAMBLE.size
+    payload = _decompress(memoryview(data)[header_start + header_length:], compression_code)
+    if kind == _VALUE_KIND_PICKLE:
+        return pickle.loads(payload)
+
+    header = json.loads(data[header_start:header_start + header_length])
+    module_name, qualname = header["class"].split(":")
+    array_class: Any = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        array_class = getattr(array_class, name)
+    if not (isinstance(array_class, type) and issubclass(array_class, Array5D)):
+        raise ValueError(f"Not an Array5D class: {header['class']}")
+    raw = np.frombuffer(payload, dtype=np.dtype(header["dtype"])).reshape(header["shape"])
+    return array_class(
+        raw,
+        axiskeys=header["axiskeys"],
+        location=Point5D(**dict(zip("tzyxc", header["location"]))),
+    )
@@ -0,0 +1,49 @@
+# pyright: strict
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, ContextManager, List, Optional, Sequence, TypeVar
+import threading
+
+from webilastik.utility import get_env_var_or_exit
+
+T = TypeVar("T")
+OUT = TypeVar("OUT")
+
+IO_THREAD_PREFIX = "webilastik_io_"
+
+_io_executor_lock = threading.Lock()
+_io_executor: Optional[ThreadPoolExecutor] = None
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """A process-wide, bounded pool for blocking I/O like fetching tiles or files over the network"""
+    global _io_executor
+    with _io_executor_lock:
+        if _io_executor is None:
+            max_workers = get_env_var_or_exit(var_name="WEBILASTIK_IO_MAX_THREADS", parser=int, default=32)
+            _io_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=IO_THREAD_PREFIX)
+        return _io_executor
+
+def is_io_thread() -> bool:
+    return threading.current_thread().name.startswith(IO_THREAD_PREFIX)
+
+def io_map(
+    fn: Callable[[T], OUT],
+    items: Sequence[T],
+    *,
+    limiter: "Optional[ContextManager[object]]" = None,
+) -> List[OUT]:
+    """Applies fn to all items concurrently in the I/O pool, preserving the order of items.
+
+    At most as many calls as allowed by limiter (e.g. a threading.Semaphore) run at the same time. Calls made
+    from within the I/O pool itself run serially, so that nested calls never wait on threads of a full pool.
+    """
+    if len(items) <= 1 or is_io_thread():
+        return [fn(item) for item in items]
+    context = limiter or nullcontext()
+
+    def limited_fn(item: T) -> OUT:
+        with context:
+            return fn(item)
+
+    return list(get_io_executor().map(limited_fn, items))
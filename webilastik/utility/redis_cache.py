@@ -0,0 +1,149 @@
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+import os
+import sys
+import threading
+import time
+import uuid
+
+import redis # pyright: ignore [reportMissingTypeStubs]
+
+from webilastik.utility import Empty, get_env_var, get_env_var_or_exit
+from webilastik.utility.cache import CacheStats, CacheTier, Compression, SingleFlight, decode_cache_value, encode_cache_value
+
+
+def parse_ip_port(value: str) -> Tuple[str, int]:
+    ip_str, port = value.split(":")
+    return ip_str, int(port)
+
+def parse_compression(value: str) -> "Compression | Exception":
+    if value == "none" or value == "zlib" or value == "lz4":
+        return value
+    return ValueError(f"Bad compression: {value}. Expected one of 'none', 'zlib', 'lz4'")
+
+def get_connection_pool_from_env() -> "redis.ConnectionPool":
+    max_connections = get_env_var_or_exit(var_name="REDIS_CACHE_MAX_CONNECTIONS", parser=int, default=64)
+    redis_host_port = os.environ.get("REDIS_HOST_PORT")
+    if redis_host_port is not None:
+        redis_host, redis_port = parse_ip_port(redis_host_port)
+        return redis.ConnectionPool(host=redis_host, port=redis_port, max_connections=max_connections)
+
+    redis_unix_socket_path = get_env_var_or_exit(var_name="REDIS_UNIX_SOCKET_PATH", parser=Path)
+    if not redis_unix_socket_path.exists():
+        print(f"Redis socket path {redis_unix_socket_path} does not exist", file=sys.stderr)
+        exit(1)
+    if not redis_unix_socket_path.is_socket():
+        print(f"Redis socket path {redis_unix_socket_path} is not a socket", file=sys.stderr)
+        exit(1)
+    return redis.ConnectionPool(
+        connection_class=redis.UnixDomainSocketConnection,
+        path=str(redis_unix_socket_path),
+        max_connections=max_connections,
+    )
+
+
+# A process computing a value holds this lock so that other processes wait for its result instead of
+# computing it too. The lock expires on its own in case its holder dies before releasing it.
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+else
+    return 0
+end
+"""
+
+class RedisCache(CacheTier[bytes]):
+    def __init__(
+        self,
+        *,
+        connection_pool: "redis.ConnectionPool",
+        ttl_seconds: Optional[int] = None,
+        compression: Compression = "none",
+        lock_ttl_ms: int = 30_000,
+        lock_poll_interval_s: float = 0.005,
+    ) -> None:
+        # redis.Redis is thread-safe; connections are checked out of the shared pool per command
+        self._redis = redis.Redis(connection_pool=connection_pool)
+        self.ttl_seconds = ttl_seconds
+        self.compression: Compression = compression
+        self.lock_ttl_ms = lock_ttl_ms
+        self.lock_poll_interval_s = lock_poll_interval_s
+        self._single_flight = SingleFlight()
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        super().__init__()
+
+    @classmethod
+    def from_env(cls) -> "RedisCache":
+        ttl_seconds = get_env_var(var_name="REDIS_CACHE_TTL_SECONDS", parser=int)
+        return RedisCache(
+            connection_pool=get_connection_pool_from_env(),
+            ttl_seconds=None if isinstance(ttl_seconds, Exception) else ttl_seconds,
+            compression=get_env_var_or_exit(var_name="REDIS_CACHE_COMPRESSION", parser=parse_compression, default="none"),
+        )
+
+    def get_many(self, keys: Sequence[bytes], record_stats: bool = True) -> "List[Any | Empty]":
+        if len(keys) == 0:
+            return []
+        raw_values: List[Optional[bytes]] = self._redis.mget(keys) # pyright: ignore
+        if record_stats:
+            num_hits = sum(1 for raw in raw_values if raw is not None)
+            with self._stats_lock:
+                self._hits += num_hits
+                self._misses += len(raw_values) - num_hits
+        return [Empty() if raw is None else decode_cache_value(raw) for raw in raw_values]
+
+    def put_many(self, items: Sequence[Tuple[bytes, Any]]) -> None:
+        pipeline = self._redis.pipeline(transaction=False)
+        for key, value in items:
+            _ = pipeline.set(key, encode_cache_value(value, compression=self.compression), ex=self.ttl_seconds)
+        _ = pipeline.execute()
+
+    def get(self, key: bytes) -> "Any | Empty":
+        return self.get_many([key])[0]
+
+    def put(self, key: bytes, value: Any) -> None:
+        _ = self._redis.set(key, encode_cache_value(value, compression=self.compression), ex=self.ttl_seconds)
+
+    def get_or_compute(self, key: bytes, compute: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if not isinstance(value, Empty):
+            return value
+        return self.compute_missing(key, compute)
+
+    def compute_missing(self, key: bytes, compute: Callable[[], Any]) -> Any:
+        # threads of this process wait on each other locally; other processes wait on the redis lock key
+        return self._single_flight.run(key, lambda: self._get_or_compute_under_lock(key, compute))
+
+    def _get_or_compute_under_lock(self, key: bytes, compute: Callable[[], Any]) -> Any:
+        lock_key = b"lock:" + key
+        lock_token = uuid.uuid4().bytes
+        while True:
+            value = self.get_many([key], record_stats=False)[0]
+            if not isinstance(value, Empty):
+                return value
+            if self._redis.set(lock_key, lock_token, nx=True, px=self.lock_ttl_ms):
+                break
+            time.sleep(self.lock_poll_interval_s)
+
+        try:
+            value = compute()
+            self.put(key, value)
+            return value
+        finally:
+            _ = self._redis.eval(_RELEASE_LOCK_SCRIPT, 1, lock_key, lock_token)
+
+    def stats(self) -> CacheStats:
+        # hits and misses are as seen by this process; memory and evictions are server-wide
+        memory_info = self._redis.info("memory") # pyright: ignore
+        stats_info = self._redis.info("stats") # pyright: ignore
+        with self._stats_lock:
+            return CacheStats(
+                hits=self._hits,
+                misses=self._misses,
+                evictions=int(stats_info.get("evicted_keys", 0)), # pyright: ignore
+                resident_bytes=int(memory_info.get("used_memory", 0)), # pyright: ignore
+                num_entries=int(self._redis.dbsize()), # pyright: ignore
+                max_bytes=int(memory_info.get("maxmemory", 0)), # pyright: ignore
+            )
@@ -1,12 +1,17 @@
 # pyright: strict
 
+from http.cookiejar import DefaultCookiePolicy
 from io import IOBase
-from typing import Literal, Mapping, Tuple
+from typing import Dict, Literal, Mapping, Optional, Tuple
 import requests
 import sys
+import threading
 
+from requests.adapters import HTTPAdapter
 from requests.models import CaseInsensitiveDict
+from urllib3.util.retry import Retry
 
+from webilastik.utility import get_env_var_or_exit, parse_bool
 from webilastik.utility.url import Url
 
 class ErrRequestCompletedAsFailure(Exception):
@@ -22,15 +27,56 @@ class ErrRequestCrashed(Exception):
 class ErrBadContentLength(Exception):
     pass
 
+_SessionKey = Tuple[str, str, Optional[int]]
+
+_sessions_lock = threading.Lock()
+_sessions: Dict[_SessionKey, requests.Session] = {}
+
+def _create_session() -> requests.Session:
+    pool_maxsize = get_env_var_or_exit(var_name="WEBILASTIK_HTTP_POOL_MAXSIZE", parser=int, default=32)
+    max_retries = get_env_var_or_exit(var_name="WEBILASTIK_HTTP_MAX_RETRIES", parser=int, default=3)
+    backoff_factor = get_env_var_or_exit(var_name="WEBILASTIK_HTTP_RETRY_BACKOFF_FACTOR", parser=float, default=0.2)
+    keep_alive = get_env_var_or_exit(var_name="WEBILASTIK_HTTP_KEEP_ALIVE", parser=parse_bool, default=True)
+
+    # only idempotent requests are retried; uploads might be streaming from a file that can't be rewound
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False,
+    )
+    session = requests.Session()
+    # sessions are shared by every request of the process to their host, regardless of which user it is made for,
+    # so they must never keep cookies that one request got and send them along with the next
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    # a session only ever talks to a single host, so it only needs a single pool of connections
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+    return session
+
+def get_session(url: Url) -> requests.Session:
+    """A process-wide session for the (protocol, host, port) of url, so that connections and TLS handshakes get reused"""
+    key: _SessionKey = (url.protocol, url.hostname, url.port)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = _create_session()
+        return session
+
 def request(
-    session: requests.Session,
     method: Literal["get", "put", "post", "delete", "head"],
     url: Url,
     data: "bytes | IOBase | None" = None,
     offset: int = 0,
     num_bytes: "int | None" = None,
     headers: "Mapping[str, str] | None" = None,
+    session: "requests.Session | None" = None,
 ) -> "Tuple[bytes, CaseInsensitiveDict[str]] | ErrRequestCompletedAsFailure | ErrRequestCrashed":
+    session = session or get_session(url)
     range_header_value: str
     if offset >= 0:
         range_header_value = f"bytes={offset}-"
@@ -55,9 +101,9 @@ def request(
         return ErrRequestCrashed(e)
 
 def request_size(
-    session: requests.Session,
     url: Url,
     headers: "Mapping[str, str] | None" = None,
+    session: "requests.Session | None" = None,
 ) -> "int | ErrRequestCompletedAsFailure | ErrRequestCrashed | ErrBadContentLength":
     response = request(session=session, method="head", url=url, headers=headers)
     if isinstance(response, Exception):
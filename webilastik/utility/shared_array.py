@@ -0,0 +1,48 @@
+# pyright: strict
+
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class SharedArrayHandle:
+    """A picklable reference to a SharedArray, for worker processes to read it without copying"""
+    name: str
+    shape: Tuple[int, ...]
+    dtype: str
+
+    def attach(self) -> SharedMemory:
+        return SharedMemory(name=self.name)
+
+    def view(self, memory: SharedMemory) -> "np.ndarray[Any, Any]":
+        """An array over memory, which must not be closed while the array is still referenced"""
+        return np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=memory.buf)
+
+
+class SharedArray:
+    """A copy of an array in shared memory, which lives until released.
+
+    Processes spawned by this one (like the workers of a ProcessPoolExecutor) share its resource tracker, so attaching
+    to the memory from them doesn't risk it being unlinked when they exit.
+    """
+
+    def __init__(self, arr: "np.ndarray[Any, Any]") -> None:
+        self._memory: Optional[SharedMemory] = SharedMemory(create=True, size=max(arr.nbytes, 1))
+        self.handle = SharedArrayHandle(name=self._memory.name, shape=arr.shape, dtype=arr.dtype.str)
+        self.handle.view(self._memory)[...] = arr
+        super().__init__()
+
+    def release(self) -> None:
+        if self._memory is not None:
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
+
+    def __enter__(self) -> "SharedArray":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.release()